@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# APN settings for the SIM in the 4G module.
+# The SIM's IMSI starts with the MCC+MNC of its network. apn_db.tsv maps
+# MCC+MNC (and, for virtual operators sharing their host's MCC+MNC, the
+# service provider name or GID1 of the SIM) to the APN, authentication and IP
+# type, so most SIMs connect on the first attempt. Entries in
+# ~/.config/uconsole-network-toggle/apns.tsv (same format) come first and may
+# also name a single SIM by IMSI or ICCID.
+# The files are only read on the first lookup and indexed by key, so a lookup
+# is a few dict accesses and processes that never connect pay nothing. The SIM
+# is read from ModemManager, or with AT commands when ModemManager does not
+# know the modem (e.g. in 9011 mode).
+# Usage: python3 apn_db.py [--shell] [IMSI|MCCMNC] [--spn NAME] [--gid1 HEX]
+import argparse
+import os
+import shlex
+import sys
+import threading
+
+import at_channel
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "apn_db.tsv")
+OVERRIDES_PATH = os.path.join(os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config")),
+                              "uconsole-network-toggle", "apns.tsv")
+
+FIELDS = ("apn", "auth", "username", "password", "ip_type", "operator")
+# The APN these tools always used, for SIMs that cannot be read
+DEFAULT = {"apn": "internet.digimobil.es", "auth": "none", "username": "", "password": "",
+           "ip_type": "ipv4", "operator": "Digi (ES)"}
+# Most networks without an entry accept this one
+UNKNOWN_APN = "internet"
+
+# ICCID, service provider name and GID1 elementary files (3GPP TS 31.102)
+EF_ICCID = 12258
+EF_SPN = 28486
+EF_GID1 = 28478
+SIM_QUERIES = ("AT+CIMI", f"AT+CRSM=176,{EF_ICCID},0,0,10")
+
+
+def _load(path):
+    # {key: settings}; key is "MCCMNC", "MCCMNC spn:name", "MCCMNC gid1:hex", an IMSI or an ICCID
+    index = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                columns = [column.strip() for column in line.rstrip("\n").split("\t")]
+                if len(columns) < 3:
+                    continue
+                columns += ["-"] * (2 + len(FIELDS) - len(columns))
+                key, match = columns[0], columns[1]
+                settings = {field: "" if value == "-" else value for field, value in zip(FIELDS, columns[2:])}
+                settings["auth"] = settings["auth"] or "none"
+                settings["ip_type"] = settings["ip_type"] or "ipv4"
+                index[key if match == "-" else f"{key} {match.lower()}"] = settings
+    except OSError:
+        pass
+    return index
+
+
+def _decode_bcd(data):
+    # ICCID digits are stored as swapped nibbles, padded with F
+    return "".join(data[i + 1] + data[i] for i in range(0, len(data) - 1, 2)).rstrip("Ff")
+
+
+def _crsm_data(lines):
+    # Hex data of a successful +CRSM: 144,0,"..." response, or None
+    for line in lines:
+        if line.startswith("+CRSM:"):
+            parts = [part.strip().strip('"') for part in line[6:].split(",")]
+            if parts[0] in ("144", "145") and len(parts) > 2 and parts[2]:
+                return parts[2]
+    return None
+
+
+def _spn(data):
+    # First byte is the display condition, then the name padded with FF
+    raw = bytes.fromhex(data)[1:]
+    return raw.split(b"\xff")[0].decode("latin-1").strip() or None
+
+
+class APNDatabase:
+    def __init__(self, path=DB_PATH, overrides=OVERRIDES_PATH):
+        self.path = path
+        self.overrides_path = overrides
+        self.tables = None
+        # MCC+MNCs with entries for virtual operators
+        self.shared = set()
+        self.lock = threading.Lock()
+
+    def _index(self):
+        # (overrides, built-in), loaded on first use
+        with self.lock:
+            if self.tables is None:
+                tables = (_load(self.overrides_path), _load(self.path))
+                self.shared = {key.split(" ")[0] for table in tables for key in table if " " in key}
+                self.tables = tables
+        return self.tables
+
+    def _plmns(self, imsi):
+        # MCC+MNC candidates of an IMSI: the MNC has 3 digits in some countries
+        return [imsi[:6], imsi[:5]] if len(imsi) >= 6 else [imsi]
+
+    def needs_match(self, imsi):
+        # Whether the SPN or GID1 decide between entries for this SIM's network
+        self._index()
+        return any(plmn in self.shared for plmn in self._plmns(imsi))
+
+    def lookup(self, sim):
+        # Settings for sim ({"imsi", "iccid", "spn", "gid1"}, all optional) plus
+        # "source": where they came from ("override", "database", "unknown" or "default")
+        imsi = sim.get("imsi") or ""
+        if not imsi:
+            return dict(DEFAULT, source="default")
+        overrides, builtin = self._index()
+        keys = [key for key in (sim.get("iccid"), imsi) if key]
+        for plmn in self._plmns(imsi):
+            if sim.get("spn"):
+                keys.append(f"{plmn} spn:{sim['spn'].lower()}")
+            if sim.get("gid1"):
+                keys.append(f"{plmn} gid1:{sim['gid1'].lower()}")
+            keys.append(plmn)
+        for table, source in ((overrides, "override"), (builtin, "database")):
+            for key in keys:
+                if key in table:
+                    return dict(table[key], source=source)
+        return {"apn": UNKNOWN_APN, "auth": "none", "username": "", "password": "", "ip_type": "ipv4",
+                "operator": f"unknown operator {imsi[:5]}", "source": "unknown"}
+
+
+def read_sim(backend=None, run_command=None, port=at_channel.AT_PORT):
+    # {"imsi", "iccid", "spn", "gid1"} of the SIM, the fields that could be read;
+    # {} when there is no readable SIM
+    sim = backend.modem_sim() if backend is not None else None
+    if sim and sim.get("imsi"):
+        return sim
+    channel = at_channel.get_channel(port)
+    try:
+        responses = channel.query(SIM_QUERIES)
+    except PermissionError:
+        # Only the IMSI is read through sudo socat
+        imsi = at_channel.send_with_fallback("AT+CIMI", run_command, port)
+        return {"imsi": imsi.strip()} if imsi and imsi.strip().isdigit() else {}
+    except (OSError, at_channel.ATError):
+        channel.close()
+        return {}
+    imsi = next((line for line in at_channel.response_lines(responses["AT+CIMI"]) if line.isdigit()), None)
+    if imsi is None:
+        return {}
+    sim = {"imsi": imsi}
+    iccid = _crsm_data(at_channel.response_lines(responses[SIM_QUERIES[1]]))
+    if iccid:
+        sim["iccid"] = _decode_bcd(iccid)
+    # The SPN and GID1 only matter for networks with virtual operators in the database
+    if database.needs_match(imsi):
+        try:
+            spn = _crsm_data(channel.command(f"AT+CRSM=176,{EF_SPN},0,0,17"))
+            gid1 = _crsm_data(channel.command(f"AT+CRSM=176,{EF_GID1},0,0,0"))
+        except (OSError, at_channel.ATError):
+            spn = gid1 = None
+        if spn:
+            sim["spn"] = _spn(spn)
+        if gid1:
+            sim["gid1"] = gid1.rstrip("Ff").lower()
+    return sim
+
+
+def describe(settings):
+    auth = f", {settings['auth']} as {settings['username']}" if settings["username"] else ""
+    return f"{settings['apn']} ({settings['operator']}, {settings['ip_type']}{auth}; {settings['source']})"
+
+
+database = APNDatabase()
+
+
+def lookup(sim):
+    return database.lookup(sim)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the APN settings for a SIM")
+    parser.add_argument("imsi", nargs="?", help="IMSI or MCC+MNC; default: read the SIM in the module")
+    parser.add_argument("--spn", help="service provider name")
+    parser.add_argument("--gid1", help="group identifier (hex)")
+    parser.add_argument("--shell", action="store_true", help="print APN=... USERNAME=... PASSWORD=... for eval")
+    args = parser.parse_args()
+    if args.imsi:
+        sim = {"imsi": args.imsi, "spn": args.spn, "gid1": args.gid1}
+    else:
+        import executor
+        from network_backend import NetworkBackend
+
+        sim = read_sim(NetworkBackend(lambda command, shell=False: executor.run_command(command, shell, quiet=True)),
+                       lambda command, shell=False: executor.run_command(command, shell, quiet=True))
+    settings = lookup(sim)
+    if args.shell:
+        print(f"APN={shlex.quote(settings['apn'])} USERNAME={shlex.quote(settings['username'])} "
+              f"PASSWORD={shlex.quote(settings['password'])}")
+    else:
+        if sim:
+            print("SIM: " + ", ".join(f"{name} {value}" for name, value in sim.items() if value))
+        else:
+            print("SIM: not readable")
+        print(f"APN: {describe(settings)}")
+    sys.exit(0)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# In-process AT command channel for the 4G module.
+# Opens the serial port once with termios and keeps it open, frames responses
+# on the final result code (OK/ERROR/+CME ERROR/...), keeps unsolicited result
+# codes (URCs) apart from command responses, enforces a deadline per command
+# and can send several queries in one round trip.
+# Usage: python3 at_channel.py [--timeout SECONDS] PORT COMMAND [COMMAND...]
+import collections
+import os
+import select
+import termios
+import threading
+import time
+
+# Overridable for testing, e.g. with a pseudo-terminal (see benchmark.py)
+AT_PORT = os.environ.get("UCONSOLE_AT_PORT", "/dev/ttyUSB2")
+DEFAULT_TIMEOUT = 2.0
+
+FINAL_OK = ("OK",)
+FINAL_ERRORS = ("ERROR", "+CME ERROR", "+CMS ERROR", "NO CARRIER", "NO DIALTONE", "BUSY", "NO ANSWER")
+
+
+class ATError(Exception):
+    pass
+
+
+class ATTimeout(ATError):
+    pass
+
+
+def _prefix(command):
+    # "AT+CSQ" -> "+CSQ", "AT+COPS?" -> "+COPS", "AT" -> ""
+    body = command[2:] if command.upper().startswith("AT") else command
+    for end, char in enumerate(body):
+        if char in "?=":
+            return body[:end]
+    return body
+
+
+class ATChannel:
+    def __init__(self, port=AT_PORT, baudrate=termios.B115200):
+        self.port = port
+        self.baudrate = baudrate
+        self.fd = None
+        self.buffer = b""
+        self.lock = threading.Lock()
+        # Unsolicited result codes seen while waiting for responses
+        self.urcs = collections.deque(maxlen=100)
+
+    def open(self):
+        if self.fd is not None:
+            return
+        fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            attrs = termios.tcgetattr(fd)
+            attrs[0] = 0                                   # iflag: raw input
+            attrs[1] = 0                                   # oflag: raw output
+            attrs[2] = termios.CS8 | termios.CREAD | termios.CLOCAL
+            attrs[3] = 0                                   # lflag: no echo, non-canonical
+            attrs[4] = attrs[5] = self.baudrate
+            attrs[6][termios.VMIN] = 0
+            attrs[6][termios.VTIME] = 0
+            termios.tcsetattr(fd, termios.TCSANOW, attrs)
+            termios.tcflush(fd, termios.TCIOFLUSH)
+        except termios.error:
+            # Not a real tty (e.g. a pipe in a test harness); use it as-is
+            pass
+        self.fd = fd
+        self.buffer = b""
+
+    def close(self):
+        # Under the lock: another thread may be in the middle of an exchange
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _readline(self, deadline):
+        while b"\n" not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ATTimeout(f"No response from {self.port}")
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if ready:
+                chunk = os.read(self.fd, 4096)
+                if not chunk:
+                    raise ATError(f"{self.port} closed")
+                self.buffer += chunk
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return line.strip(b"\r").decode(errors="replace").strip()
+
+    def _exchange(self, command, prefixes, timeout):
+        # Send one command line and collect its response lines until the final result code
+        self.open()
+        os.write(self.fd, command.encode() + b"\r")
+        deadline = time.monotonic() + timeout
+        lines = []
+        while True:
+            try:
+                line = self._readline(deadline)
+            except ATTimeout:
+                # A late reply would be read as the answer to the next command;
+                # the port is flushed when it is opened again
+                self._close()
+                raise
+            if not line or line == command:
+                continue
+            if line in FINAL_OK:
+                return lines
+            if line.startswith(FINAL_ERRORS):
+                raise ATError(f"{command}: {line}")
+            # Prefixed lines that do not belong to any pending command are URCs
+            if line.startswith("+") and not any(p and line.startswith(p + ":") for p in prefixes):
+                self.urcs.append(line)
+                continue
+            lines.append(line)
+
+    def command(self, command, timeout=DEFAULT_TIMEOUT):
+        # Run one command and return its response lines (without echo and OK)
+        with self.lock:
+            return self._exchange(command, [_prefix(command)], timeout)
+
+    def query(self, commands, timeout=DEFAULT_TIMEOUT):
+        # Run several commands in one round trip using V.250 command
+        # concatenation ("AT+A;+B;+C"). Returns {command: [lines]}; a command
+        # that fails is retried on its own so one bad query does not lose the rest,
+        # and maps to its ATError instead of lines (see response_lines()).
+        prefixes = [_prefix(command) for command in commands]
+        line = "AT" + ";".join(prefix + command[2 + len(prefix):] for prefix, command in zip(prefixes, commands))
+        with self.lock:
+            try:
+                lines = self._exchange(line, prefixes, timeout)
+            except ATTimeout:
+                raise
+            except ATError:
+                return {command: self._try(command, timeout) for command in commands}
+        results = {command: [] for command in commands}
+        for response in lines:
+            for prefix, command in zip(prefixes, commands):
+                if prefix and response.startswith(prefix + ":"):
+                    results[command].append(response)
+                    break
+            else:
+                # Unprefixed responses (e.g. AT+CIMI) go to the first command without a prefixed match
+                for prefix, command in zip(prefixes, commands):
+                    if not results[command]:
+                        results[command].append(response)
+                        break
+        return results
+
+    def _try(self, command, timeout):
+        try:
+            return self._exchange(command, [_prefix(command)], timeout)
+        except ATTimeout:
+            raise
+        except ATError as e:
+            return e
+
+
+def response_lines(response):
+    # The lines of one query() response; none for a command that failed
+    return [] if isinstance(response, ATError) else response
+
+
+# Channels stay open between calls so each query costs one round trip
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+def get_channel(port=AT_PORT):
+    with _channels_lock:
+        if port not in _channels:
+            _channels[port] = ATChannel(port)
+        return _channels[port]
+
+
+def send(command, port=AT_PORT, timeout=DEFAULT_TIMEOUT):
+    # Convenience wrapper: returns the response text, or None if the port
+    # cannot be opened, does not answer in time or reports an error
+    channel = get_channel(port)
+    try:
+        return "\n".join(channel.command(command, timeout))
+    except (OSError, ATError):
+        channel.close()
+        return None
+
+
+def send_with_fallback(command, run_command=None, port=AT_PORT, timeout=DEFAULT_TIMEOUT):
+    # Like send(), but falls back to "sudo socat" when this user is not allowed
+    # to open the port (the tty usually belongs to root:dialout)
+    channel = get_channel(port)
+    try:
+        return "\n".join(channel.command(command, timeout))
+    except PermissionError:
+        if run_command is None:
+            return None
+    except (OSError, ATError):
+        channel.close()
+        return None
+    output = run_command(f'echo -en "{command}\\r\\n" | sudo timeout {int(timeout) + 1} socat - {port},crnl 2>/dev/null || true', shell=True)
+    if not output or "OK" not in output:
+        return None
+    return "\n".join(line for line in output.split('\n') if line.strip() not in ("", "OK", command))
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Send AT commands to the 4G module")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("port")
+    parser.add_argument("commands", nargs="+")
+    args = parser.parse_args()
+    try:
+        with ATChannel(args.port) as channel:
+            if len(args.commands) == 1:
+                responses = {args.commands[0]: channel.command(args.commands[0], args.timeout)}
+            else:
+                responses = channel.query(args.commands, args.timeout)
+    except (OSError, ATError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    for command, response in responses.items():
+        print(f"{command}: {response if isinstance(response, ATError) else ' | '.join(response) or 'OK'}")
+    for urc in channel.urcs:
+        print(f"URC: {urc}")
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+# Benchmark every entry point against scripted stand-ins for the system tools.
+# nmcli, mmcli, socat, ip, ifconfig, systemctl, sudo and uconsole-4g-cm4 are
+# replaced by small shell scripts on PATH that keep their state in a
+# temporary directory and can be slowed down or made to fail. The AT port is
+# a pseudo-terminal answered by a fake modem. Each operation is run on the
+# CLI class, the daemon and toggle_network.sh. Wall time, CPU time (this
+# process plus its children) and the number of tool invocations are reported
+# as a table and optionally as JSON, which a later run can compare against;
+# the table also shows the 99th percentile of the wall time.
+# Nothing touches the real network: D-Bus is not used, every command goes
+# to a stand-in and the reachability check probes local DNS and HTTP stand-ins.
+# The subcommand entry point starts "network_toggle_cli.py OPERATION" as a new
+# process each time. With the daemon running, "status" is the cold start a
+# status bar sees and has to stay within STATUS_BUDGET_MS.
+# Usage: python3 benchmark.py [--iterations N] [--latency TOOL=SECONDS] [--fail TOOL=exit|hang]
+#                             [--pid-mode 9001|9011] [--json FILE] [--compare FILE] [--tolerance PERCENT]
+import argparse
+import json
+import math
+import os
+import pty
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Default latency (seconds) of each stand-in, roughly what the real tools take on a uConsole
+LATENCIES = {
+    "nmcli": 0.03,
+    "mmcli": 0.05,
+    "socat": 0.05,
+    "ip": 0.005,
+    "ifconfig": 0.005,
+    "systemctl": 0.5,
+    "uconsole-4g-cm4": 0.2,
+    "sudo": 0.0,
+}
+# Seconds a "hang" failure blocks before exiting with an error
+HANG_TIME = 30
+# Deadline given to a hanging tool (see executor.COMMAND_TIMEOUTS), so the run shows the bounded time
+HANG_DEADLINE = 2
+
+OPERATIONS = ("status", "wifi off", "wifi on", "mobile on", "mobile off")
+ENTRY_POINTS = ("cli", "daemon", "script", "subcommand")
+
+# Cold start to answer of "network_toggle_cli.py status" while the daemon has the status cached
+STATUS_BUDGET_MS = 100
+
+# Every stand-in logs its call, sleeps for its latency and applies its failure mode first
+SHIM_HEADER = """#!/bin/bash
+S="$SHIM_STATE"
+echo "{name} $*" >> "$S/calls.log"
+sleep {latency}
+case "{failure}" in
+    exit) echo "{name}: simulated failure" >&2; exit 1 ;;
+    hang) sleep {hang}; echo "{name}: simulated hang" >&2; exit 1 ;;
+esac
+wifi_on() {{ [ "$(cat "$S/wifi" 2>/dev/null)" != disabled ]; }}
+"""
+
+SHIM_BODIES = {
+    "sudo": 'exec "$@"\n',
+    "nmcli": r"""active() {
+    if wifi_on; then echo "HomeWiFi:802-11-wireless:activated:wlan0"; fi
+    if [ -e "$S/4gnet.up" ]; then echo "4gnet:gsm:activated:ttyUSB2"; fi
+}
+case "$*" in
+    "radio wifi") if wifi_on; then echo enabled; else echo disabled; fi ;;
+    "radio wifi on") echo enabled > "$S/wifi" ;;
+    "radio wifi off") echo disabled > "$S/wifi" ;;
+    "-t -f IN-USE,SSID,BSSID,FREQ,SIGNAL device wifi list"*)
+        if wifi_on; then echo '*:HomeWiFi:AA\:BB\:CC\:00\:00\:01:5180 MHz:70'; fi ;;
+    "device wifi rescan"*|"device connect "*|"connection up HomeWiFi"*)
+        if ! wifi_on; then echo "Error: Wi-Fi is disabled." >&2; exit 10; fi ;;
+    "-t -f NAME,TYPE,STATE,DEVICE connection show --active") active ;;
+    "-t -f TYPE,STATE,DEVICE connection show --active") active | cut -d: -f2- ;;
+    "-t -f NAME,TYPE connection show --active") active | cut -d: -f1,2 ;;
+    "-t -f NAME connection show") echo HomeWiFi; if [ -e "$S/4gnet" ]; then echo 4gnet; fi ;;
+    "-g IP4.ADDRESS connection show 4gnet") if [ -e "$S/4gnet.up" ]; then echo 10.64.0.2/30; fi ;;
+    "connection show 4gnet")
+        if [ ! -e "$S/4gnet" ]; then echo "Error: 4gnet - no such connection profile." >&2; exit 10; fi ;;
+    "-g gsm.apn connection show 4gnet") if [ -e "$S/4gnet" ]; then cat "$S/4gnet"; fi ;;
+    "connection add "*)
+        while [ $# -gt 1 ]; do if [ "$1" = apn ]; then echo "$2" > "$S/4gnet"; fi; shift; done
+        touch "$S/4gnet" ;;
+    "connection delete 4gnet") rm -f "$S/4gnet" "$S/4gnet.up" ;;
+    "connection up 4gnet")
+        if [ ! -e "$S/4gnet" ] || [ ! -e "$S/modem" ]; then echo "Error: Connection activation failed." >&2; exit 4; fi
+        touch "$S/4gnet.up" ;;
+    "connection down 4gnet") rm -f "$S/4gnet.up" ;;
+esac
+exit 0
+""",
+    "mmcli": r"""if [ ! -e "$S/modem" ]; then
+    if [ "$*" = "-L" ]; then echo "No modems were found"; exit 0; fi
+    echo "error: couldn't find modem" >&2; exit 1
+fi
+case "$*" in
+    "-L") echo "    /org/freedesktop/ModemManager1/Modem/0 [QUALCOMM INCORPORATED] SIMCOM_SIM7600G-H" ;;
+    "-m "*)
+        echo "  System   |   primary port: ttyUSB2"
+        if [ -e "$S/4gnet.up" ]; then echo "  Status   |          state: connected"; else echo "  Status   |          state: registered"; fi ;;
+esac
+exit 0
+""",
+    "socat": r"""request=$(cat)
+if [ ! -e "$S/modem" ]; then exit 1; fi
+case "$request" in
+    *CUSBPIDSWITCH*) printf '+CUSBPIDSWITCH: %s,1,1\nOK\n' "$(cat "$S/pid_mode")" ;;
+    *) echo OK ;;
+esac
+""",
+    "ip": r"""case "$*" in
+    *"dev usb0"*)
+        if [ -e "$S/modem" ] && [ "$(cat "$S/pid_mode")" = 9011 ]; then
+            echo "5: usb0    inet 192.168.225.20/24 brd 192.168.225.255 scope global usb0"
+        fi ;;
+    *)
+        echo "1: lo    inet 127.0.0.1/8 scope host lo"
+        if wifi_on; then echo "3: wlan0    inet 192.168.1.20/24 brd 192.168.1.255 scope global wlan0"; fi
+        if [ -e "$S/4gnet.up" ]; then echo "4: wwan0    inet 10.64.0.2/30 scope global wwan0"; fi ;;
+esac
+""",
+    "ifconfig": r"""echo "lo: flags=73<UP,LOOPBACK,RUNNING>  mtu 65536"
+echo "        inet 127.0.0.1  netmask 255.0.0.0"
+if wifi_on; then
+    echo "wlan0: flags=4163<UP,BROADCAST,RUNNING,MULTICAST>  mtu 1500"
+    echo "        inet 192.168.1.20  netmask 255.255.255.0"
+fi
+""",
+    "systemctl": "exit 0\n",
+    "uconsole-4g-cm4": r"""case "$1" in
+    enable) touch "$S/modem" ;;
+    disable) rm -f "$S/modem" "$S/4gnet.up" ;;
+esac
+""",
+}
+
+
+class FakeModem:
+    # Answers AT commands on a pseudo-terminal while the module is powered
+    def __init__(self, state_dir, latency=0.02):
+        self.state_dir = state_dir
+        self.latency = latency
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _reply(self, command):
+        if not os.path.exists(os.path.join(self.state_dir, "modem")):
+            return b""
+        time.sleep(self.latency)
+        lines = []
+        for part in command.split(";"):
+            if "CUSBPIDSWITCH" in part:
+                with open(os.path.join(self.state_dir, "pid_mode")) as f:
+                    lines.append(f"+CUSBPIDSWITCH: {f.read().strip()},1,1")
+            elif "CSQ" in part:
+                lines.append("+CSQ: 20,99")
+            elif "CPIN" in part:
+                lines.append("+CPIN: READY")
+            elif "CIMI" in part:
+                lines.append("214220123456789")
+            elif "CRSM=176,12258" in part:
+                lines.append('+CRSM: 144,0,"98342200000000000010"')
+        return ("".join(f"\r\n{line}\r\n" for line in lines) + "\r\nOK\r\n").encode()
+
+    def _run(self):
+        buffer = b""
+        while True:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            buffer += data
+            while b"\r" in buffer:
+                line, buffer = buffer.split(b"\r", 1)
+                command = line.strip().decode(errors="replace")
+                if command:
+                    os.write(self.master, self._reply(command))
+
+
+def free_port(kind):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Environment:
+    def __init__(self, latencies, failures, pid_mode):
+        self.root = tempfile.mkdtemp(prefix="uconsole-bench-")
+        self.bin_dir = os.path.join(self.root, "bin")
+        self.state_dir = os.path.join(self.root, "state")
+        os.makedirs(self.bin_dir)
+        os.makedirs(self.state_dir)
+        self.pid_mode = pid_mode
+        for name, body in SHIM_BODIES.items():
+            path = os.path.join(self.bin_dir, name)
+            with open(path, "w") as f:
+                f.write(SHIM_HEADER.format(name=name, latency=latencies.get(name, 0), hang=HANG_TIME,
+                                           failure=failures.get(name, "")))
+                f.write(body)
+            os.chmod(path, 0o755)
+        self.modem = FakeModem(self.state_dir)
+        os.environ.update({
+            "PATH": f"{self.bin_dir}:{os.environ['PATH']}",
+            "SHIM_STATE": self.state_dir,
+            "UCONSOLE_AT_PORT": self.modem.port,
+            "UCONSOLE_NETWORK_SOCKET": os.path.join(self.root, "daemon.sock"),
+            "UCONSOLE_LOCK_PATH": os.path.join(self.root, "operations.lock"),
+            "XDG_CACHE_HOME": os.path.join(self.root, "cache"),
+            "XDG_STATE_HOME": os.path.join(self.root, "xdg-state"),
+            "UCONSOLE_COMMAND_TIMEOUTS": " ".join(f"{name}={HANG_DEADLINE}" for name, failure in failures.items()
+                                                  if failure == "hang"),
+        })
+        # Stand-ins for the reachability check (see connectivity.py)
+        dns_port, http_port = free_port(socket.SOCK_DGRAM), free_port(socket.SOCK_STREAM)
+        os.environ.update({
+            "UCONSOLE_CHECK_DNS": f"127.0.0.1:{dns_port}",
+            "UCONSOLE_CHECK_TCP": f"127.0.0.1:{http_port}",
+            "UCONSOLE_CHECK_URL": f"http://check.test:{http_port}/generate_204",
+        })
+        import connectivity
+        connectivity.start_stand_ins("127.0.0.1", dns_port=dns_port, http_port=http_port)
+        self.reset()
+
+    def reset(self):
+        # WiFi up, 4G module off, no 4gnet profile
+        for name in os.listdir(self.state_dir):
+            os.unlink(os.path.join(self.state_dir, name))
+        with open(os.path.join(self.state_dir, "wifi"), "w") as f:
+            f.write("enabled\n")
+        with open(os.path.join(self.state_dir, "pid_mode"), "w") as f:
+            f.write(f"{self.pid_mode}\n")
+        shutil.rmtree(os.environ["XDG_CACHE_HOME"], ignore_errors=True)
+
+    def calls(self):
+        try:
+            with open(os.path.join(self.state_dir, "calls.log")) as f:
+                return sum(1 for _ in f)
+        except OSError:
+            return 0
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def cpu_time():
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def quietly(func):
+    # Run func with its prints discarded; returns its result
+    def wrapper(*args):
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            return func(*args)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return wrapper
+
+
+class CLIEntry:
+    def __init__(self):
+        from network_toggle_cli import NetworkToggleCLI
+        self.cli = quietly(NetworkToggleCLI)(False)
+        # Only the stand-ins may be used, never a real NetworkManager on the bus
+        self.cli.backend.client = None
+        self.operations = {
+            "status": self.cli.check_status,
+            "wifi off": self.cli.disable_wifi,
+            "wifi on": self.cli.enable_wifi,
+            "mobile on": self.cli.enable_mobile_data,
+            "mobile off": self.cli.disable_mobile_data,
+        }
+
+    def run(self, operation):
+        if operation == "status":
+            self.cli.status_cache.invalidate()
+        return quietly(self.operations[operation])() is not False
+
+    def close(self):
+        self.cli.status_cache.stop()
+
+
+class DaemonEntry:
+    def __init__(self):
+        import network_toggle_client
+        import network_toggled
+        self.client = network_toggle_client
+        self.daemon = quietly(network_toggled.NetworkToggleDaemon)()
+        self.daemon.toggle.backend.client = None
+        quietly(self.daemon.start)()
+        self.server = network_toggled.DaemonServer(self.client.SOCKET_PATH, network_toggled.RequestHandler)
+        self.server.daemon = self.daemon
+        threading.Thread(target=quietly(self.server.serve_forever), daemon=True).start()
+
+    def run(self, operation):
+        if operation == "status":
+            response = self.client.request("status")
+        else:
+            cmd, state = operation.split()
+            response = self.client.request(cmd, state=state)
+        return response is not None and response["ok"]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.unlink(self.client.SOCKET_PATH)
+        self.daemon.status_cache.stop()
+
+
+class ScriptEntry:
+    def run(self, operation):
+        result = subprocess.run(["bash", os.path.join(SCRIPT_DIR, "toggle_network.sh")] + operation.split(),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result.returncode == 0
+
+    def close(self):
+        pass
+
+
+class SubcommandEntry:
+    def run(self, operation):
+        command = ["status", "--json"] if operation == "status" else operation.split()
+        result = subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, "network_toggle_cli.py")] + command,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result.returncode == 0
+
+    def close(self):
+        pass
+
+
+ENTRY_CLASSES = {"cli": CLIEntry, "daemon": DaemonEntry, "script": ScriptEntry, "subcommand": SubcommandEntry}
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * fraction) - 1)]
+
+
+def benchmark(env, entry_name, iterations):
+    env.reset()
+    entry = ENTRY_CLASSES[entry_name]()
+    samples = {operation: [] for operation in OPERATIONS}
+    try:
+        for _ in range(iterations):
+            for operation in OPERATIONS:
+                calls, cpu, start = env.calls(), cpu_time(), time.perf_counter()
+                ok = entry.run(operation)
+                samples[operation].append({
+                    "wall": time.perf_counter() - start,
+                    "cpu": cpu_time() - cpu,
+                    "subprocesses": env.calls() - calls,
+                    "ok": ok,
+                })
+    finally:
+        entry.close()
+    return {
+        operation: {
+            "wall_ms": round(statistics.median(s["wall"] for s in runs) * 1000, 1),
+            "p99_ms": round(percentile([s["wall"] for s in runs], 0.99) * 1000, 1),
+            "cpu_ms": round(statistics.mean(s["cpu"] for s in runs) * 1000, 1),
+            "subprocesses": round(statistics.mean(s["subprocesses"] for s in runs), 1),
+            "ok": all(s["ok"] for s in runs),
+        }
+        for operation, runs in samples.items()
+    }
+
+
+def cached_status_time(env, iterations):
+    # Median wall time (ms) of "network_toggle_cli.py status --json" with the daemon running
+    env.reset()
+    daemon = DaemonEntry()
+    entry = SubcommandEntry()
+    try:
+        times = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            entry.run("status")
+            times.append(time.perf_counter() - start)
+    finally:
+        daemon.close()
+    return round(statistics.median(times) * 1000, 1)
+
+
+def print_table(results, baseline=None):
+    print(f"{'entry':<10} {'operation':<11} {'wall ms':>9} {'p99 ms':>9} {'cpu ms':>8} {'procs':>6} {'ok':>3}"
+          + ("   vs baseline" if baseline else ""))
+    for entry, operations in results.items():
+        for operation, result in operations.items():
+            line = (f"{entry:<10} {operation:<11} {result['wall_ms']:9.1f} {result.get('p99_ms', 0):9.1f} "
+                    f"{result['cpu_ms']:8.1f} "
+                    f"{result['subprocesses']:6.1f} {'yes' if result['ok'] else 'NO':>3}")
+            old = (baseline or {}).get(entry, {}).get(operation)
+            if old and old["wall_ms"]:
+                line += f"   {(result['wall_ms'] - old['wall_ms']) / old['wall_ms'] * 100:+6.1f}%"
+            print(line)
+
+
+def regressions(results, baseline, tolerance):
+    # Operations whose wall time grew by more than tolerance percent, or that stopped working
+    found = []
+    for entry, operations in results.items():
+        for operation, result in operations.items():
+            old = baseline.get(entry, {}).get(operation)
+            if not old:
+                continue
+            if old["ok"] and not result["ok"]:
+                found.append(f"{entry} {operation}: now fails")
+            elif old["wall_ms"] and result["wall_ms"] > old["wall_ms"] * (1 + tolerance / 100):
+                found.append(f"{entry} {operation}: {old['wall_ms']} -> {result['wall_ms']} ms")
+    return found
+
+
+def parse_pairs(values, convert):
+    pairs = {}
+    for value in values:
+        name, _, setting = value.partition("=")
+        pairs[name] = convert(setting)
+    return pairs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the network toggle entry points against fake system tools")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--entry", action="append", choices=ENTRY_POINTS, help="entry point to run (default: all)")
+    parser.add_argument("--latency", action="append", default=[], metavar="TOOL=SECONDS")
+    parser.add_argument("--fail", action="append", default=[], metavar="TOOL=exit|hang")
+    parser.add_argument("--pid-mode", choices=("9001", "9011"), default="9001")
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=20, help="allowed wall time increase in percent (default: 20)")
+    args = parser.parse_args()
+
+    latencies = dict(LATENCIES, **parse_pairs(args.latency, float))
+    failures = parse_pairs(args.fail, str)
+    env = Environment(latencies, failures, args.pid_mode)
+    try:
+        results = {entry: benchmark(env, entry, args.iterations) for entry in args.entry or ENTRY_POINTS}
+        status_ms = cached_status_time(env, max(args.iterations, 5))
+    finally:
+        env.cleanup()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_table(results, baseline)
+    print(f"\nCached status cold start: {status_ms} ms (budget {STATUS_BUDGET_MS} ms)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"scenario": {"latencies": latencies, "failures": failures, "pid_mode": args.pid_mode,
+                                    "iterations": args.iterations}, "results": results,
+                       "cached_status_ms": status_ms}, f, indent=2)
+    found = regressions(results, baseline, args.tolerance) if baseline else []
+    if status_ms > STATUS_BUDGET_MS:
+        found.append(f"cached status: {status_ms} ms, over the {STATUS_BUDGET_MS} ms budget")
+    for regression in found:
+        print(f"Regression: {regression}")
+    sys.exit(1 if found else 0)
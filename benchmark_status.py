@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Compare the fork count and wall time of the old CLI-based status check, run
+# one command after the other and fanned out through executor.py, against the
+# kernel-based snapshot in net_status.py.
+# Usage: python3 benchmark_status.py [iterations]
+import subprocess
+import sys
+import time
+
+import executor
+import net_status
+
+fork_count = 0
+_original_popen_init = subprocess.Popen.__init__
+
+
+def _counting_popen_init(self, *args, **kwargs):
+    global fork_count
+    fork_count += 1
+    _original_popen_init(self, *args, **kwargs)
+
+
+def run_command(command, shell=False):
+    try:
+        result = subprocess.run(command, shell=shell, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        return result.stdout.strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+# The four commands check_status() used to run
+LEGACY_COMMANDS = [
+    ["nmcli", "radio", "wifi"],
+    ["mmcli", "-L"],
+    ["nmcli", "-t", "-f", "TYPE,STATE,DEVICE", "connection", "show", "--active"],
+    "ip -4 addr show | grep -oP '(?<=inet\\s)\\d+(\\.\\d+){3}'",
+]
+
+
+def legacy_status():
+    for command in LEGACY_COMMANDS:
+        run_command(command, shell=isinstance(command, str))
+
+
+def concurrent_status():
+    executor.run_many(LEGACY_COMMANDS, quiet=True)
+
+
+def kernel_status():
+    net_status.snapshot(run_command)
+
+
+def measure(name, func, iterations):
+    global fork_count
+    fork_count = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {elapsed / iterations * 1000:10.2f} ms/call {fork_count / iterations:8.1f} forks/call")
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    subprocess.Popen.__init__ = _counting_popen_init
+    print(f"Status check benchmark ({iterations} iterations)")
+    measure("legacy", legacy_status, iterations)
+    measure("concurrent", concurrent_status, iterations)
+    measure("kernel", kernel_status, iterations)
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+# Idempotent, resumable bring-up of the 4G module and WiFi.
+# A bring-up is a list of steps. Each step has a cheap "already done?" check,
+# the work itself and the steps it needs. The checks run from the goal
+# backwards before anything else, and a satisfied step satisfies everything it
+# needs too. An enable on a connected modem therefore costs one check, and a
+# partially-up modem resumes at the first unsatisfied step. Steps whose needs
+# are met run concurrently; for example, the 4gnet profile is created while the
+# module powers on when the primary port is already known.
+# Both bring-ups end with an internet reachability step (see connectivity.py):
+# an address alone does not mean traffic flows. A captive portal is reported
+# but does not fail the bring-up, since the link itself is up.
+# Usage: python3 bringup.py mobile|wifi [--plan]
+import argparse
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+import apn_db
+import at_channel
+import connectivity
+import operations
+import probe_cache
+import standby
+import tracing
+from handover import uplink_interface
+from modem_ready import AT_PORT, WARM_MODEM_TIMEOUT, ModemReadiness
+from wifi_reconnect import WifiReconnect
+
+PROFILE = "4gnet"
+DEFAULT_PORT = "ttyUSB2"
+REACHABILITY = "internet reachability"
+# Seconds the "already done?" check of the reachability step may take
+QUICK_CHECK_TIMEOUT = 1
+# Sources of APN settings (see apn_db.lookup) that replace an APN already configured;
+# the "unknown" and "default" guesses do not
+APN_SOURCES_TRUSTED = ("settings", "override", "database")
+
+
+class Step:
+    def __init__(self, name, done, run, needs=(), error=None):
+        # done() is the cheap check; run() does the work and returns False on failure
+        self.name = name
+        self.done = done
+        self.run = run
+        self.needs = tuple(needs)
+        self.error = error or f"{name} failed"
+
+
+def plan(steps):
+    # Names of the steps already satisfied, checking from the goal backwards
+    by_name = {step.name: step for step in steps}
+    satisfied = set()
+
+    def satisfy(step):
+        if step.name not in satisfied:
+            satisfied.add(step.name)
+            for need in step.needs:
+                satisfy(by_name[need])
+
+    for step in reversed(steps):
+        if step.name not in satisfied and step.done():
+            satisfy(step)
+    return satisfied
+
+
+def run_steps(steps, report=print):
+    # Run the unsatisfied steps, each as soon as its needs are met. Returns the
+    # step that failed, or None once all are satisfied. Raises
+    # operations.Cancelled, once the running steps finished, when another
+    # request preempted the operation.
+    satisfied = plan(steps)
+    for step in steps:
+        if step.name in satisfied:
+            report(f"{step.name}: already done")
+    pending = [step for step in steps if step.name not in satisfied]
+    parent = tracing.tracer.current()
+    finished = queue.Queue()
+    running = 0
+    failed = None
+    cancelled = None
+
+    def work(step):
+        ok = False
+        try:
+            with tracing.tracer.attached(parent), tracing.span(step.name) as span:
+                ok = bool(step.run())
+                if not ok:
+                    span.fail()
+        except operations.Cancelled as e:
+            ok = e
+        except Exception as e:
+            report(f"{step.name}: {e}")
+        finally:
+            finished.put((step, ok))
+
+    while pending or running:
+        if failed is None and cancelled is None:
+            try:
+                operations.check_cancelled()
+            except operations.Cancelled as e:
+                cancelled = e
+        if failed is None and cancelled is None:
+            for step in [step for step in pending if all(need in satisfied for need in step.needs)]:
+                pending.remove(step)
+                threading.Thread(target=work, args=(step,), daemon=True).start()
+                running += 1
+        if not running:
+            break
+        step, ok = finished.get()
+        running -= 1
+        if isinstance(ok, operations.Cancelled):
+            cancelled = ok
+        elif ok:
+            satisfied.add(step.name)
+        elif failed is None:
+            failed = step
+    if cancelled is not None:
+        raise cancelled
+    return failed
+
+
+def reachability_step(kind, needs, report=print):
+    # Final step: the kind ("wifi"/"mobile") uplink reaches the internet. Without
+    # an interface of that kind the probes follow the routing table.
+    quick = connectivity.Verifier(timeout=QUICK_CHECK_TIMEOUT)
+
+    def done():
+        # Without an interface of the kind, or unbound (no CAP_NET_RAW), the probes
+        # could take the other uplink; the full check then runs and says so
+        interface = uplink_interface(kind)
+        if interface is None:
+            return False
+        result = quick.check(interface)
+        return result["bound"] and result["state"] == connectivity.ONLINE
+
+    def verify():
+        interface = uplink_interface(kind)
+        result = connectivity.Verifier().wait(interface)
+        report(f"{interface or 'Default route'}: {connectivity.describe(result)}")
+        if interface and not result["bound"]:
+            report(f"Unverified: without CAP_NET_RAW the check could not be bound to {interface} "
+                   "and went over the default route")
+        return result["state"] != connectivity.OFFLINE
+
+    return Step(REACHABILITY, done, verify, needs=needs,
+                error=f"The {kind} link is up but does not reach the internet.")
+
+
+class MobileBringUp:
+    def __init__(self, toggle, report=print):
+        # toggle provides backend, run_command, probe_cache and the APN settings
+        # (toggle.apn None: from the SIM, see apn_db.py)
+        self.toggle = toggle
+        self.backend = toggle.backend
+        self.run_command = toggle.run_command
+        self.cache = toggle.probe_cache
+        self.report = report
+        self.readiness = ModemReadiness(self.run_command, report=report, backend=self.backend)
+        self.facts = None
+        self.cached = False
+        self.settings = None
+        self.error = None
+
+    # Steps
+
+    def _connected(self):
+        # Goal check that does not need to know the PID mode
+        if self.readiness.interface_ip("usb0"):
+            return True
+        return self.backend.profile_exists(PROFILE) and bool(self.backend.connection_ip(PROFILE))
+
+    def _powered(self):
+        # The module is on the USB bus and its AT port is there
+        return probe_cache.usb_identity() is not None and os.path.exists(AT_PORT)
+
+    def _power_on(self):
+        if not self.cache.run_model_command("enable", self.report):
+            self.report("Failed to enable 4G module. Please check your uConsole model.")
+            return False
+        return self.readiness.wait_for_ports()
+
+    def _detect_version(self):
+        if not self.readiness.wait_for_at():
+            return False
+        self.report("Checking 4G module version...")
+        version_output = at_channel.send_with_fallback("AT+CUSBPIDSWITCH?", self.run_command)
+        if version_output and "9001" in version_output:
+            self.report("Detected 4G module version 9001")
+            self.facts = {"pid_mode": "9001", "at_port": AT_PORT, "profile": PROFILE}
+        else:
+            self.facts = {"pid_mode": "9011", "at_port": AT_PORT, "interface": "usb0"}
+        return True
+
+    def _start_modemmanager(self):
+        # ModemManager normally picks up a known modem by itself; restart it only if it
+        # does not. A newly detected one needs the restart (see How-to-use-the-4G-extension.md).
+        if self.cached and self.readiness.wait_for_modemmanager(timeout=WARM_MODEM_TIMEOUT):
+            return True
+        self.report("Restarting ModemManager...")
+        with tracing.span("ModemManager restart"):
+            self.run_command(["sudo", "systemctl", "restart", "ModemManager"])
+        return self.readiness.wait_for_modemmanager()
+
+    def _discover_port(self):
+        self.report("Finding primary port...")
+        port_output = self.backend.modem_primary_port() or ""
+        if "cdc-wdm0" in port_output:
+            # Blacklist some kernel modules as suggested in the documentation
+            self.report("Detected cdc-wdm0 port, blacklisting kernel modules...")
+            blacklist_cmd = 'sudo bash -c \'cat << EOF > /etc/modprobe.d/blacklist-qmi.conf\nblacklist qmi_wwan\nblacklist cdc_wdm\nEOF\''
+            self.run_command(blacklist_cmd, shell=True)
+            port = DEFAULT_PORT  # Use ttyUSB2 as suggested
+        elif "ttyUSB" in port_output:
+            port = re.search(r'ttyUSB\d+', port_output).group(0)
+        else:
+            port = DEFAULT_PORT
+        self.report(f"Using port: {port}")
+        self.facts["primary_port"] = port
+        return True
+
+    def _apn(self):
+        # APN settings for the SIM in the module, read once it answers
+        if self.settings is None:
+            if self.toggle.apn:
+                settings = dict(apn_db.DEFAULT, apn=self.toggle.apn, username=self.toggle.username,
+                                password=self.toggle.password, operator="configured", source="settings")
+            else:
+                sim = apn_db.read_sim(self.backend, self.run_command)
+                settings = apn_db.lookup(sim)
+                if not sim:
+                    # Not readable yet; try again at the next step
+                    return settings
+            self.settings = settings
+            self.report(f"APN: {apn_db.describe(settings)}")
+        return self.settings
+
+    def _create_profile(self):
+        settings = self._apn()
+        self.report(f"Creating 4G connection with APN: {settings['apn']}...")
+        self.backend.add_gsm_profile(PROFILE, self.facts.get("primary_port", DEFAULT_PORT), settings["apn"],
+                                     settings["username"], settings["password"], settings["ip_type"])
+        return self.readiness.wait_for_profile(PROFILE)
+
+    def _activate(self):
+        # A profile made for another SIM is made again with this SIM's APN, but a
+        # profile (perhaps set up by hand) is not replaced with a guessed APN
+        settings = self._apn()
+        if (settings["source"] in APN_SOURCES_TRUSTED
+                and self.backend.profile_apn(self.facts["profile"]) not in (None, settings["apn"])):
+            self.report("The SIM changed since the 4G connection was created")
+            self.backend.delete_profile(self.facts["profile"])
+            if not self._create_profile():
+                return False
+        self.report("Bringing up the connection...")
+        self.backend.connection_up(self.facts["profile"], on_line=lambda line: self.report(f"  {line}"))
+        return self.readiness.wait_for_connection_ip(self.facts["profile"])
+
+    def _context_apn(self):
+        # APN of the module's first PDP context, which it dials itself in 9011 mode
+        response = at_channel.send("AT+CGDCONT?") or ""
+        match = re.search(r'\+CGDCONT: 1,"[^"]*","([^"]*)"', response)
+        return match.group(1) if match else None
+
+    def _context_configured(self):
+        apn = self._context_apn()
+        if apn and self._apn()["source"] not in APN_SOURCES_TRUSTED:
+            return True
+        return apn is not None and apn == self._apn()["apn"]
+
+    def _set_context_apn(self):
+        settings = self._apn()
+        self.report(f"Setting the module's APN to {settings['apn']}...")
+        pdp_type = {"ipv4": "IP", "ipv6": "IPV6", "ipv4v6": "IPV4V6"}.get(settings["ip_type"], "IP")
+        if at_channel.send(f'AT+CGDCONT=1,"{pdp_type}","{settings["apn"]}"') is None:
+            return False
+        if settings["username"]:
+            auth = 2 if settings["auth"] == "chap" else 1
+            at_channel.send(f'AT+CGAUTH=1,{auth},"{settings["username"]}","{settings["password"]}"')
+        return True
+
+    def _interface_ip(self):
+        self.report(f"Checking for {self.facts['interface']} interface...")
+        return self.readiness.wait_for_interface_ip(self.facts["interface"])
+
+    def power_steps(self):
+        return [
+            Step("module power-on", self._powered, self._power_on,
+                 error="4G module did not come up. Please check your hardware."),
+            Step("version check", lambda: self.facts is not None, self._detect_version, needs=("module power-on",),
+                 error="4G module did not answer. Please check your hardware."),
+        ]
+
+    def radio_step(self):
+        # Only a module left in standby by "mobile off" needs its radio turned on (see standby.py).
+        # Done only for a powered module, so it never vouches for the power-on of one that is off.
+        return Step("radio on", lambda: self._powered() and not standby.active(),
+                    lambda: not standby.active() or standby.wake(self.backend, self.report),
+                    needs=("module power-on",), error="The 4G module did not leave standby.")
+
+    def steps(self):
+        # The plan for the PID mode in self.facts
+        power = self.power_steps()[0]
+        if self.facts["pid_mode"] != "9001":
+            address = f"{self.facts['interface']} address"
+            return [power,
+                    Step("APN setup", self._context_configured, self._set_context_apn, needs=(power.name,),
+                         error="Could not set the APN of the 4G module."),
+                    self.radio_step(),
+                    Step(address, lambda: self.readiness.interface_ip(self.facts["interface"]), self._interface_ip,
+                         needs=("APN setup", "radio on"),
+                         error="Failed to detect mobile data connection. Please check your SIM card and 4G module."),
+                    reachability_step("mobile", (address,), self.report)]
+        # With a known port the profile does not have to wait for the modem
+        port_known = "primary_port" in self.facts
+        return [
+            power,
+            Step("ModemManager", self.backend.modem_detected, self._start_modemmanager, needs=(power.name,),
+                 error="4G modem not detected. Please check your hardware."),
+            Step("port discovery", lambda: "primary_port" in self.facts, self._discover_port,
+                 needs=() if port_known else ("ModemManager",)),
+            Step("profile creation", lambda: self.backend.profile_exists(self.facts["profile"]), self._create_profile,
+                 needs=("port discovery",), error="Could not create the 4gnet connection profile."),
+            self.radio_step(),
+            Step("connection activation", lambda: self.backend.connection_ip(self.facts["profile"]), self._activate,
+                 needs=("ModemManager", "profile creation", "radio on"),
+                 error="4G connection did not get an IP address. Please check your SIM card and APN."),
+            reachability_step("mobile", ("connection activation",), self.report),
+        ]
+
+    def run(self):
+        # Returns True once the mobile connection has an address; self.error says why not.
+        # The time to switch on is recorded for starts from standby and from a powered-off module.
+        start = "standby" if standby.active() else None if self._powered() else "cold"
+        began = time.monotonic()
+        connected = self._run()
+        if connected and start:
+            seconds = time.monotonic() - began
+            standby.record_switch_on(start, seconds)
+            self.report(f"Switched on from {start} in {seconds:.1f} s")
+        return connected
+
+    def _run(self):
+        fingerprint = probe_cache.usb_fingerprint()
+        if fingerprint is None and not self._connected():
+            # A powered-off module is not on the USB bus yet, so its cache entry
+            # can only be found once it is powered on
+            failed = run_steps(self.power_steps()[:1], self.report)
+            if failed is not None:
+                self.error = failed.error
+                return False
+            fingerprint = probe_cache.usb_fingerprint()
+        self.facts = self.cache.modem(fingerprint)
+        cached = self.cached = self.facts is not None
+        if cached:
+            self.report(f"Using cached probe results for {fingerprint}")
+        elif self._connected():
+            # Nothing is cached for this module, but there is nothing to do either
+            self.report("Mobile data is already connected")
+            failed = run_steps([reachability_step("mobile", (), self.report)], self.report)
+            self.error = failed.error if failed else None
+            return failed is None
+        else:
+            # The PID mode decides the rest of the plan; ask the module first
+            failed = run_steps(self.power_steps(), self.report)
+            if failed is not None:
+                self.error = failed.error
+                return False
+        failed = run_steps(self.steps(), self.report)
+        if failed is not None:
+            self.error = failed.error
+            if cached and failed.name != REACHABILITY:
+                # Rediscover everything next time
+                self.cache.forget_modem(fingerprint)
+            return False
+        if not cached:
+            self.cache.update_modem(probe_cache.usb_fingerprint(), model_command=self.cache.model_command(),
+                                    **self.facts)
+        return True
+
+
+class WifiBringUp:
+    def __init__(self, toggle, report=print):
+        self.backend = toggle.backend
+        self.reconnect = WifiReconnect(self.backend, toggle.probe_cache, report=report)
+        self.report = report
+        self.error = None
+
+    def _radio_on(self):
+        self.backend.set_wifi_enabled(True)
+        return True
+
+    def steps(self):
+        return [
+            Step("WiFi radio", self.backend.wifi_enabled, self._radio_on),
+            Step("WiFi association", self.reconnect.associated, self.reconnect.connect, needs=("WiFi radio",),
+                 error="Could not connect to a known WiFi network."),
+            reachability_step("wifi", ("WiFi association",), self.report),
+        ]
+
+    def run(self):
+        failed = run_steps(self.steps(), self.report)
+        self.error = failed.error if failed else None
+        return failed is None
+
+
+if __name__ == "__main__":
+    from network_toggle_cli import NetworkToggleCLI
+
+    parser = argparse.ArgumentParser(description="Bring up 4G or WiFi, skipping the steps already done")
+    parser.add_argument("kind", choices=("mobile", "wifi"))
+    parser.add_argument("--plan", action="store_true", help="only show which steps would run")
+    args = parser.parse_args()
+    toggle = NetworkToggleCLI(use_daemon=False, watch_events=False)
+    bringup = MobileBringUp(toggle) if args.kind == "mobile" else WifiBringUp(toggle)
+    if args.plan:
+        if args.kind == "mobile":
+            bringup.facts = toggle.probe_cache.modem(probe_cache.usb_fingerprint())
+            steps = bringup.steps() if bringup.facts else bringup.power_steps()
+        else:
+            steps = bringup.steps()
+        satisfied = plan(steps)
+        for step in steps:
+            print(f"{'done' if step.name in satisfied else 'run ':4}  {step.name}")
+        sys.exit(0)
+    if not operations.run(f"{args.kind} on", bringup.run):
+        print(bringup.error)
+        sys.exit(1)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# Internet reachability check bound to one interface.
+# An address on usb0, or "nmcli connection up" returning, does not prove that
+# traffic flows. The verifier races three kinds of probes, all bound to the
+# interface with SO_BINDTODEVICE:
+#   DNS   an A query for the check host to each DNS server
+#   TCP   a handshake with each TCP target
+#   HTTP  a captive-portal check: the check URL must answer with CHECK_STATUS
+# The first conclusive result decides. An HTTP answer is conclusive either way:
+# the expected status means online, anything else means a captive portal.
+# A successful DNS or TCP probe means online. Since portals often let those
+# through, the HTTP probe still gets PORTAL_GRACE seconds to report one.
+# The link is offline when every probe failed.
+# The targets default to public anycast servers and Google's generate_204 URL;
+# UCONSOLE_CHECK_DNS, UCONSOLE_CHECK_TCP (space-separated HOST:PORT lists) and
+# UCONSOLE_CHECK_URL replace them.
+# Binding to an interface needs CAP_NET_RAW; without it the probes follow the
+# routing table, which the result reports as "bound": False.
+#
+# Stand-in servers for testing (a DNS server answering every A query with its
+# own address, and an HTTP server answering 204, or a portal redirect with
+# --portal) can be started in a network namespace:
+#   ip netns add upstream
+#   ip link add veth0 type veth peer name veth1 && ip link set veth1 netns upstream
+#   ip addr add 10.99.0.2/24 dev veth0 && ip link set veth0 up
+#   ip -n upstream addr add 10.99.0.1/24 dev veth1 && ip -n upstream link set veth1 up
+#   ip netns exec upstream python3 connectivity.py --serve 10.99.0.1 [--portal]
+#   python3 connectivity.py veth0 --dns 10.99.0.1 --tcp 10.99.0.1:80 --url http://check.test/generate_204
+# Usage: python3 connectivity.py [IFACE] [--dns HOST[:PORT]]... [--tcp HOST:PORT]... [--url URL] [--wait SECONDS]
+#        python3 connectivity.py --serve ADDRESS [--portal] [--dns-port PORT] [--http-port PORT]
+import argparse
+import os
+import queue
+import random
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+
+
+def _target(text, port=None):
+    # "host:port" (or "host" when port has a default) -> (host, port)
+    host, sep, number = text.rpartition(":")
+    if not sep:
+        if port is None:
+            raise ValueError(f"{text} has no port")
+        return text, port
+    return host, int(number)
+
+
+DNS_SERVERS = tuple(_target(text, 53) for text in os.environ.get("UCONSOLE_CHECK_DNS", "1.1.1.1 8.8.8.8").split())
+TCP_TARGETS = tuple(_target(text) for text in os.environ.get("UCONSOLE_CHECK_TCP", "1.1.1.1:443 8.8.8.8:443").split())
+CHECK_URL = os.environ.get("UCONSOLE_CHECK_URL", "http://connectivitycheck.gstatic.com/generate_204")
+CHECK_STATUS = 204
+
+PROBE_TIMEOUT = 3  # seconds one round of probes may take
+PORTAL_GRACE = 1.0  # seconds the HTTP probe gets after a DNS/TCP success
+VERIFY_TIMEOUT = 15  # seconds wait() keeps retrying an offline link
+RETRY_INTERVAL = 0.5
+
+ONLINE = "online"
+PORTAL = "portal"
+OFFLINE = "offline"
+
+SO_BINDTODEVICE = getattr(socket, "SO_BINDTODEVICE", 25)
+
+
+def bound_socket(kind, ifname=None, timeout=PROBE_TIMEOUT):
+    # IPv4 socket that only uses ifname; binding needs CAP_NET_RAW
+    sock = socket.socket(socket.AF_INET, kind)
+    sock.settimeout(timeout)
+    if ifname:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, ifname.encode())
+        except OSError:
+            sock.close()
+            raise
+    return sock
+
+
+def can_bind(ifname):
+    try:
+        bound_socket(socket.SOCK_DGRAM, ifname).close()
+        return True
+    except PermissionError:
+        return False
+    except OSError:
+        # A missing interface is the probes' business
+        return True
+
+
+# DNS
+
+def dns_query(name):
+    # (id, packet) of a recursive A query for name
+    ident = random.randrange(65536)
+    header = struct.pack(">HHHHHH", ident, 0x0100, 1, 0, 0, 0)
+    question = b"".join(bytes([len(label)]) + label.encode() for label in name.split(".")) + b"\0"
+    return ident, header + question + struct.pack(">HH", 1, 1)
+
+
+def _skip_name(data, offset):
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        if length == 0:
+            return offset + 1
+        offset += length + 1
+
+
+def parse_dns_answer(data, ident):
+    # IPv4 addresses in the response to query ident; ValueError for anything else
+    if len(data) < 12:
+        raise ValueError("short DNS response")
+    response_id, flags, questions, answers = struct.unpack(">HHHH", data[:8])
+    if response_id != ident or not flags & 0x8000:
+        raise ValueError("not a response to our query")
+    offset = 12
+    for _ in range(questions):
+        offset = _skip_name(data, offset) + 4
+    addresses = []
+    for _ in range(answers):
+        offset = _skip_name(data, offset)
+        record_type, _, _, length = struct.unpack(">HHIH", data[offset:offset + 10])
+        offset += 10
+        if record_type == 1 and length == 4:
+            addresses.append(socket.inet_ntoa(data[offset:offset + 4]))
+        offset += length
+    return addresses
+
+
+def resolve(name, server, ifname=None, timeout=PROBE_TIMEOUT):
+    # IPv4 addresses of name from the (host, port) server, asked through ifname
+    ident, query = dns_query(name)
+    deadline = time.monotonic() + timeout
+    with bound_socket(socket.SOCK_DGRAM, ifname, timeout) as sock:
+        sock.sendto(query, server)
+        while True:
+            sock.settimeout(max(0.01, deadline - time.monotonic()))
+            data, _ = sock.recvfrom(512)
+            try:
+                return parse_dns_answer(data, ident)
+            except (ValueError, struct.error, IndexError):
+                continue
+
+
+class Verifier:
+    def __init__(self, dns_servers=DNS_SERVERS, tcp_targets=TCP_TARGETS, url=CHECK_URL, expect=CHECK_STATUS,
+                 timeout=PROBE_TIMEOUT, portal_grace=PORTAL_GRACE):
+        self.dns_servers = tuple(dns_servers)
+        self.tcp_targets = tuple(tcp_targets)
+        self.url = urllib.parse.urlsplit(url)
+        self.expect = expect
+        self.timeout = timeout
+        self.portal_grace = portal_grace
+
+    # Probes return (state, detail) and raise OSError when they are inconclusive
+
+    def _dns(self, ifname, server):
+        addresses = resolve(self.url.hostname, server, ifname, self.timeout)
+        if not addresses:
+            raise OSError(f"{server[0]} has no address for {self.url.hostname}")
+        return ONLINE, f"{self.url.hostname} is {addresses[0]} (DNS {server[0]})"
+
+    def _tcp(self, ifname, target):
+        with bound_socket(socket.SOCK_STREAM, ifname, self.timeout) as sock:
+            sock.connect(target)
+        return ONLINE, f"TCP {target[0]}:{target[1]}"
+
+    def _http(self, ifname):
+        host = self.url.hostname
+        address = None
+        for server in self.dns_servers:
+            try:
+                address = resolve(host, server, ifname, self.timeout)[0]
+                break
+            except (OSError, IndexError):
+                continue
+        if address is None:
+            raise OSError(f"could not resolve {host}")
+        with bound_socket(socket.SOCK_STREAM, ifname, self.timeout) as sock:
+            sock.connect((address, self.url.port or 80))
+            sock.sendall(f"GET {self.url.path or '/'} HTTP/1.1\r\nHost: {host}\r\n"
+                         f"User-Agent: uconsole-network-toggle\r\nConnection: close\r\n\r\n".encode())
+            response = b""
+            while b"\r\n\r\n" not in response and len(response) < 4096:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                response += chunk
+        lines = response.decode(errors="replace").split("\r\n")
+        try:
+            status = int(lines[0].split()[1])
+        except (IndexError, ValueError):
+            raise OSError(f"no HTTP response from {host}")
+        if status == self.expect:
+            return ONLINE, f"HTTP {status} from {host}"
+        location = next((line.split(":", 1)[1].strip() for line in lines if line.lower().startswith("location:")), None)
+        return PORTAL, f"HTTP {status} from {host}" + (f", redirected to {location}" if location else "")
+
+    def probes(self, ifname):
+        probes = [("http", lambda: self._http(ifname))]
+        probes += [(f"dns {server[0]}", lambda server=server: self._dns(ifname, server)) for server in self.dns_servers]
+        probes += [(f"tcp {target[0]}", lambda target=target: self._tcp(ifname, target)) for target in self.tcp_targets]
+        return probes
+
+    def check(self, ifname=None):
+        # One race of all probes: {"state", "probe", "detail", "seconds", "bound"}
+        start = time.monotonic()
+        results = queue.Queue()
+        if ifname and not can_bind(ifname):
+            ifname = None
+
+        def run(name, probe):
+            try:
+                results.put((name,) + probe())
+            except OSError as e:
+                results.put((name, None, str(e)))
+
+        probes = self.probes(ifname)
+        for name, probe in probes:
+            threading.Thread(target=run, args=(name, probe), daemon=True).start()
+
+        deadline = start + self.timeout + 0.1
+        decided = None
+        for _ in probes:
+            try:
+                name, state, detail = results.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if state is None:
+                continue
+            if name == "http":
+                decided = (name, state, detail)
+                break
+            if decided is None:
+                # Give the HTTP probe a moment to spot a captive portal
+                decided = (name, state, detail)
+                deadline = min(deadline, time.monotonic() + self.portal_grace)
+        if decided is None:
+            decided = (None, OFFLINE, "no probe succeeded")
+        name, state, detail = decided
+        return {"state": state, "probe": name, "detail": detail, "seconds": round(time.monotonic() - start, 3),
+                "bound": ifname is not None}
+
+    def wait(self, ifname=None, timeout=VERIFY_TIMEOUT):
+        # Repeat check() until the link is not offline or timeout seconds passed
+        deadline = time.monotonic() + timeout
+        while True:
+            result = self.check(ifname)
+            if result["state"] != OFFLINE or time.monotonic() >= deadline:
+                return result
+            time.sleep(min(RETRY_INTERVAL, max(0, deadline - time.monotonic())))
+
+
+def describe(result):
+    if result["state"] == ONLINE:
+        return f"online ({result['detail']}, {result['seconds'] * 1000:.0f} ms)"
+    if result["state"] == PORTAL:
+        return f"captive portal ({result['detail']}); log in through a browser"
+    return f"offline ({result['detail']})"
+
+
+# Stand-in servers
+
+class _DNSHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        if len(data) < 12:
+            return
+        question_end = _skip_name(data, 12) + 4
+        answer = b"\xc0\x0c" + struct.pack(">HHIH", 1, 1, 60, 4) + socket.inet_aton(self.server.answer)
+        sock.sendto(data[:2] + b"\x81\x80" + data[4:6] + b"\x00\x01\x00\x00\x00\x00" + data[12:question_end] + answer,
+                    self.client_address)
+
+
+class _HTTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.rfile.readline()
+        if self.server.portal:
+            self.wfile.write(b"HTTP/1.1 302 Found\r\nLocation: http://portal.test/login\r\nContent-Length: 0\r\n\r\n")
+        else:
+            self.wfile.write(b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n")
+
+
+def start_stand_ins(address, portal=False, dns_port=53, http_port=80):
+    # Serve the stand-ins from threads; returns the (DNS, HTTP) servers
+    dns = socketserver.ThreadingUDPServer((address, dns_port), _DNSHandler)
+    dns.answer = address
+    http = socketserver.ThreadingTCPServer((address, http_port), _HTTPHandler)
+    http.daemon_threads = True
+    http.portal = portal
+    for server in (dns, http):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return dns, http
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check internet reachability through an interface")
+    parser.add_argument("interface", nargs="?", help="interface to probe through (default: the routing table decides)")
+    parser.add_argument("--dns", action="append", type=lambda text: _target(text, 53), metavar="HOST[:PORT]",
+                        help="DNS server to probe (repeatable)")
+    parser.add_argument("--tcp", action="append", type=_target, metavar="HOST:PORT", help="TCP target (repeatable)")
+    parser.add_argument("--url", default=CHECK_URL, help=f"captive-portal check URL (default: {CHECK_URL})")
+    parser.add_argument("--expect", type=int, default=CHECK_STATUS, help="HTTP status of an open internet")
+    parser.add_argument("--wait", type=float, default=0, metavar="SECONDS", help="keep retrying while offline")
+    parser.add_argument("--serve", metavar="ADDRESS", help="run stand-in DNS and HTTP servers on ADDRESS instead")
+    parser.add_argument("--portal", action="store_true", help="with --serve, answer like a captive portal")
+    parser.add_argument("--dns-port", type=int, default=53, help="with --serve, port of the DNS stand-in")
+    parser.add_argument("--http-port", type=int, default=80, help="with --serve, port of the HTTP stand-in")
+    args = parser.parse_args()
+    if args.serve:
+        print(f"DNS and HTTP ({'portal' if args.portal else '204'}) stand-ins on {args.serve}")
+        start_stand_ins(args.serve, args.portal, args.dns_port, args.http_port)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    verifier = Verifier(args.dns or DNS_SERVERS, args.tcp or TCP_TARGETS, args.url, args.expect)
+    result = verifier.wait(args.interface, args.wait) if args.wait else verifier.check(args.interface)
+    print(describe(result))
+    sys.exit({ONLINE: 0, PORTAL: 2}.get(result["state"], 1))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# Diagnostics engine for the 4G module, used by troubleshoot_4g.sh.
+# Probes every candidate AT port and data source (USB bus, ModemManager,
+# network interfaces) concurrently, each with its own timeout, and stops
+# waiting as soon as the facts it needs are known. Produces a structured
+# report as JSON, human-readable text or shell variable assignments.
+# Usage: python3 diagnose_4g.py [--format text|json|shell] [--ports-only]
+#        python3 diagnose_4g.py --wait-for ports|modem|ip [--timeout SECONDS]
+import argparse
+import glob
+import json
+import os
+import queue
+import re
+import shlex
+import shutil
+import sys
+import threading
+import time
+
+import at_channel
+import executor
+import net_status
+from modem_ready import wait_until
+from network_backend import NetworkBackend
+
+PROBE_TIMEOUT = 3.0
+TOTAL_TIMEOUT = 10.0
+
+# Queries sent in one round trip to every port that answers AT
+PORT_QUERIES = ["AT+CUSBPIDSWITCH?", "AT+CSQ", "AT+CPIN?", "AT+COPS?"]
+
+MOBILE_INTERFACES = ("usb0", "ppp0", "wwan0")
+
+
+def run_command(command, shell=False):
+    return executor.run_command(command, shell, quiet=True, timeout=PROBE_TIMEOUT)
+
+
+def run_concurrently(probes, timeout, done=None):
+    # Start every probe in its own daemon thread and collect results as they
+    # arrive. Returns as soon as done(results) is true, every probe finished or
+    # the overall timeout passed; probes still running are abandoned.
+    results = queue.Queue()
+
+    def run(name, probe):
+        start = time.monotonic()
+        try:
+            value = probe()
+        except Exception as e:
+            value = {"error": str(e)}
+        results.put((name, value, time.monotonic() - start))
+
+    for name, probe in probes.items():
+        threading.Thread(target=run, args=(name, probe), daemon=True).start()
+
+    collected = {}
+    timings = {}
+    deadline = time.monotonic() + timeout
+    while len(collected) < len(probes):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            name, value, elapsed = results.get(timeout=remaining)
+        except queue.Empty:
+            break
+        collected[name] = value
+        timings[name] = round(elapsed, 3)
+        if done and done(collected):
+            break
+    return collected, timings
+
+
+def candidate_ports():
+    return sorted(glob.glob("/dev/ttyUSB*"), key=lambda port: int(re.sub(r'\D', '', port) or 0))
+
+
+def probe_port(port, timeout=PROBE_TIMEOUT):
+    with at_channel.ATChannel(port) as channel:
+        channel.command("AT", timeout)
+        responses = channel.query(PORT_QUERIES, timeout)
+    version_text = " ".join(at_channel.response_lines(responses.get("AT+CUSBPIDSWITCH?", [])))
+    match = re.search(r'9001|9011', version_text)
+    return {
+        "ok": True,
+        "version": match.group(0) if match else None,
+        # The text of the error for a query the module rejected
+        "responses": {command: str(response) if isinstance(response, at_channel.ATError) else response
+                      for command, response in responses.items()},
+    }
+
+
+def probe_usb():
+    devices = []
+    for path in glob.glob("/sys/bus/usb/devices/*/idVendor"):
+        directory = os.path.dirname(path)
+        vendor = net_status._read(path)
+        if vendor in net_status.MODEM_USB_VENDORS:
+            devices.append({
+                "vendor": vendor,
+                "product": net_status._read(f"{directory}/idProduct"),
+                "name": net_status._read(f"{directory}/product", ""),
+            })
+    if not devices and not os.path.isdir("/sys/bus/usb/devices"):
+        output = run_command(["lsusb"]) or ""
+        devices = [{"name": line} for line in output.split('\n') if "SIMCom" in line or "Qualcomm" in line]
+    return devices
+
+
+def probe_modemmanager():
+    backend = NetworkBackend(run_command)
+    detected = backend.modem_detected()
+    return {
+        "detected": detected,
+        "index": backend.modem_index() if detected else None,
+        "primary_port": backend.modem_primary_port() if detected else None,
+    }
+
+
+def probe_network():
+    status = net_status.snapshot(run_command)
+    interfaces = {name: status["interfaces"][name] for name in MOBILE_INTERFACES if name in status["interfaces"]}
+    return {"interfaces": interfaces, "current_ip": status["current_ip"]}
+
+
+def detect_model():
+    if shutil.which("uconsole-4g-cm4"):
+        return "CM4"
+    if shutil.which("uconsole-4g"):
+        return "A06/R01"
+    return "unknown"
+
+
+def diagnose(ports_only=False, probe_timeout=PROBE_TIMEOUT, total_timeout=TOTAL_TIMEOUT):
+    start = time.monotonic()
+    ports = candidate_ports()
+    probes = {port: (lambda port=port: probe_port(port, probe_timeout)) for port in ports}
+    if not ports_only:
+        probes.update({"usb": probe_usb, "modemmanager": probe_modemmanager, "network": probe_network})
+
+    def done(results):
+        # Everything but the ports must be in; for the ports, one that reports
+        # its version is enough (the others would only confirm it)
+        if any(name not in results for name in probes if not name.startswith("/dev/")):
+            return False
+        answered = [results[port] for port in ports if port in results]
+        return any(result.get("version") for result in answered) or len(answered) == len(ports)
+
+    results, timings = run_concurrently(probes, total_timeout, done)
+
+    at_ports = {}
+    for port in ports:
+        if port in results:
+            at_ports[port] = results[port] if "error" not in results[port] else dict(results[port], ok=False)
+    working = [port for port in ports if port in at_ports and at_ports[port].get("ok")]
+    versioned = [port for port in working if at_ports[port].get("version")]
+    working_port = (versioned or working or [None])[0]
+    for port in ports:
+        if port not in at_ports:
+            reason = "skipped, another port already answered" if working_port else "no answer before the deadline"
+            at_ports[port] = {"ok": False, "error": reason}
+    at_ports = {port: at_ports[port] for port in ports}
+
+    report = {
+        "model": detect_model(),
+        "ports": ports,
+        "at_ports": at_ports,
+        "working_port": working_port,
+        "version": at_ports[working_port].get("version") if working_port else None,
+        "timings": timings,
+        "elapsed": round(time.monotonic() - start, 3),
+    }
+    if not ports_only:
+        report.update({
+            "usb_devices": results.get("usb", []),
+            "modemmanager": results.get("modemmanager", {"detected": False}),
+            "network": results.get("network", {}),
+        })
+    return report
+
+
+def format_text(report):
+    lines = [f"uConsole Model: {report['model']}"]
+    if "usb_devices" in report:
+        if report["usb_devices"]:
+            for device in report["usb_devices"]:
+                lines.append(f"[OK] USB device: {device.get('name') or device.get('vendor')}")
+        else:
+            lines.append("[WARNING] No SIMCom/Qualcomm USB device found.")
+    if not report["ports"]:
+        lines.append("[ERROR] No ttyUSB devices found.")
+    for port, result in report["at_ports"].items():
+        if result.get("ok"):
+            lines.append(f"[OK] AT command successful on {port} (version: {result.get('version') or 'unknown'})")
+        else:
+            lines.append(f"[INFO] No AT answer on {port}: {result.get('error', 'no answer')}")
+    if report["working_port"]:
+        lines.append(f"[OK] Working AT command port: {report['working_port']}")
+        for command, response in report["at_ports"][report["working_port"]]["responses"].items():
+            lines.append(f"     {command}: {response if isinstance(response, str) else ' | '.join(response) or 'OK'}")
+    else:
+        lines.append("[WARNING] Could not find a working port for AT commands.")
+    if "modemmanager" in report:
+        mm = report["modemmanager"]
+        if mm.get("detected"):
+            lines.append(f"[OK] ModemManager modem {mm.get('index')}, primary port {mm.get('primary_port')}")
+        else:
+            lines.append("[ERROR] No modems found by ModemManager.")
+        for name, info in report["network"].get("interfaces", {}).items():
+            addresses = ", ".join(info["ipv4"] + info["ipv6"]) or "no address"
+            lines.append(f"[OK] Found {name} interface ({info['operstate']}, {addresses})")
+        lines.append(f"IP Address: {report['network'].get('current_ip', 'Not connected')}")
+    lines.append(f"Diagnostics took {report['elapsed']:.2f}s")
+    return "\n".join(lines)
+
+
+def format_shell(report):
+    port = report["working_port"]
+    mm = report.get("modemmanager", {})
+    values = {
+        "WORKING_PORT": re.sub(r'\D', '', port) if port else "",
+        "VERSION": report["version"] or "",
+        "HAS_MODEM": "1" if mm.get("detected") else "0",
+        "PRIMARY_PORT": mm.get("primary_port") or "",
+        "HAS_USB0": "1" if "usb0" in report.get("network", {}).get("interfaces", {}) else "0",
+    }
+    return "\n".join(f"{name}={shlex.quote(value)}" for name, value in values.items())
+
+
+def wait_for(condition, timeout):
+    checks = {
+        "ports": lambda: os.path.exists(at_channel.AT_PORT),
+        "modem": lambda: NetworkBackend(run_command).modem_detected(),
+        "ip": lambda: any(info["ipv4"] for info in probe_network()["interfaces"].values()),
+    }
+    result, elapsed = wait_until(checks[condition], timeout, interval=0.5)
+    print(f"{condition} {'ready' if result else 'not ready'} after {elapsed:.1f}s")
+    return bool(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diagnose the uConsole 4G module")
+    parser.add_argument("--format", choices=["text", "json", "shell"], default="text")
+    parser.add_argument("--ports-only", action="store_true", help="only probe the AT ports")
+    parser.add_argument("--wait-for", choices=["ports", "modem", "ip"], help="wait until the condition holds, then exit")
+    parser.add_argument("--timeout", type=float, default=None, help="deadline in seconds")
+    args = parser.parse_args()
+
+    if args.wait_for:
+        sys.exit(0 if wait_for(args.wait_for, args.timeout or 30) else 1)
+
+    report = diagnose(args.ports_only, total_timeout=args.timeout or TOTAL_TIMEOUT)
+    if args.format == "json":
+        print(json.dumps(report, indent=2))
+    elif args.format == "shell":
+        # Variables on stdout for eval, the human report on stderr
+        print(format_text(report), file=sys.stderr)
+        print(format_shell(report))
+    else:
+        print(format_text(report))
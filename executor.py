@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# Shared executor for external commands (nmcli, mmcli, ip, socat, ...).
+# Commands run as asyncio subprocesses on one event loop in a background
+# thread, at most MAX_CONCURRENT at a time. Independent queries can be fanned
+# out, so a batch takes as long as its slowest command instead of the sum.
+# The sync API (run, run_many, call_all) may be called from any thread other
+# than the loop's, including the Tk apps' worker threads; coroutines running
+# on executor.loop use run_async and gather. With on_line, each line a
+# long-running command such as "nmcli connection up" prints is passed on as
+# soon as it arrives. The loop (and asyncio itself) is only loaded by the
+# first command, so short-lived processes that run none pay nothing.
+#
+# Every command has a deadline (COMMAND_TIMEOUTS by program, overridable with
+# UCONSOLE_COMMAND_TIMEOUTS="mmcli=5 nmcli=20"). A command runs in its own
+# process group without a terminal, so on expiry the whole group is killed,
+# including what sudo or a shell started, and sudo fails at once instead of
+# waiting for a password. Failures that usually clear up by themselves
+# (ModemManager or NetworkManager not ready yet) are retried with jittered
+# exponential backoff within the same deadline. check() raises CommandError
+# subclasses; run() keeps returning None on failure.
+# Usage: python3 executor.py COMMAND...   (runs the quoted shell commands concurrently)
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import tracing
+
+MAX_CONCURRENT = 8
+
+# Deadline (seconds) of a command by program, including its retries
+COMMAND_TIMEOUTS = {
+    "ip": 5,
+    "ifconfig": 5,
+    "lsusb": 5,
+    "mmcli": 15,
+    "socat": 10,
+    "systemctl": 30,
+    "uconsole-4g": 30,
+    "uconsole-4g-cm4": 30,
+    "nmcli": 60,  # "connection up" on a modem can take this long
+}
+DEFAULT_TIMEOUT = 30
+
+
+def _parse_timeouts(text):
+    # {program: seconds} from "mmcli=5 nmcli=20"; malformed entries are reported and skipped
+    timeouts = {}
+    for pair in text.split():
+        program, _, seconds = pair.partition("=")
+        try:
+            value = float(seconds)
+        except ValueError:
+            value = None
+        if not program or value is None or not 0 < value < float("inf"):
+            print(f"UCONSOLE_COMMAND_TIMEOUTS: ignoring {pair!r} (expected PROGRAM=SECONDS)", file=sys.stderr)
+            continue
+        timeouts[program] = value
+    return timeouts
+
+
+COMMAND_TIMEOUTS.update(_parse_timeouts(os.environ.get("UCONSOLE_COMMAND_TIMEOUTS", "")))
+
+# Retries of transient failures, recognised by their error output
+RETRIES = 2
+BACKOFF_BASE = 0.25  # seconds before the first retry at most
+BACKOFF_CAP = 2.0
+TRANSIENT_ERRORS = (
+    "couldn't find modem",
+    "couldn't find the ModemManager process",
+    "NetworkManager is not running",
+    "not ready",
+    "Timeout was reached",
+    "org.freedesktop.DBus.Error.ServiceUnknown",
+    "org.freedesktop.DBus.Error.NoReply",
+)
+
+
+class CommandError(Exception):
+    def __init__(self, command, message):
+        super().__init__(message)
+        self.command = command
+
+
+class CommandNotFound(CommandError):
+    pass
+
+
+class CommandTimeout(CommandError):
+    pass
+
+
+class CommandFailed(CommandError):
+    def __init__(self, command, returncode, stderr):
+        super().__init__(command, str(subprocess.CalledProcessError(returncode, command)))
+        self.returncode = returncode
+        self.stderr = stderr
+
+    @property
+    def transient(self):
+        return any(marker in self.stderr for marker in TRANSIENT_ERRORS)
+
+
+def deadline_for(command):
+    return COMMAND_TIMEOUTS.get(tracing.program_name(command), DEFAULT_TIMEOUT)
+
+
+def backoff(attempt):
+    # Full jitter: anywhere up to the exponential step, so retries do not line up
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+class CommandExecutor:
+    def __init__(self, max_concurrent=MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self.loop = None
+        self.thread = None
+        self.semaphore = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        # The event loop, started on first use
+        with self.lock:
+            if self.loop is None:
+                import asyncio
+
+                loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=loop.run_forever, name="executor", daemon=True)
+                self.thread.start()
+                self.loop = loop
+        return self.loop
+
+    def submit(self, coroutine):
+        # Schedule coroutine on the loop; returns a concurrent.futures.Future
+        import asyncio
+
+        loop = self._start()
+        if threading.current_thread() is self.thread:
+            coroutine.close()
+            raise RuntimeError("the sync API cannot be used from the executor's own loop")
+        return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+    # Async API (on self.loop)
+
+    async def check_async(self, command, shell=False, on_line=None, timeout=None, retries=RETRIES, parent=None):
+        # stdout of command (stripped); raises CommandError
+        import asyncio
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (deadline_for(command) if timeout is None else timeout)
+        async with self.semaphore:
+            with tracing.command_span(command, parent=parent) as span:
+                attempt = 1
+                while True:
+                    try:
+                        stdout = await self._attempt(command, shell, on_line, deadline - loop.time())
+                        span.set(exit_code=0, attempts=attempt)
+                        return stdout
+                    except CommandFailed as e:
+                        delay = backoff(attempt)
+                        if not e.transient or attempt > retries or loop.time() + delay >= deadline:
+                            span.fail(exit_code=e.returncode, attempts=attempt)
+                            raise
+                    except CommandError as e:
+                        span.fail(error=type(e).__name__, attempts=attempt)
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+
+    async def _attempt(self, command, shell, on_line, timeout):
+        import asyncio
+
+        options = dict(stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       start_new_session=True)
+        try:
+            if shell:
+                process = await asyncio.create_subprocess_shell(command, **options)
+            else:
+                process = await asyncio.create_subprocess_exec(*command, **options)
+        except OSError as e:
+            # Tool not installed (e.g. no ModemManager)
+            raise CommandNotFound(command, str(e)) from e
+        try:
+            stdout, stderr = await asyncio.wait_for(self._communicate(process, on_line), max(timeout, 0))
+        except asyncio.TimeoutError:
+            self._kill(process)
+            await process.wait()
+            raise CommandTimeout(command, f"Command {command!r} timed out") from None
+        if process.returncode != 0:
+            raise CommandFailed(command, process.returncode, stderr)
+        return stdout.strip()
+
+    async def _communicate(self, process, on_line):
+        # (stdout, stderr) as text; stdout goes to on_line line by line when given
+        import asyncio
+
+        if on_line is None:
+            stdout, stderr = await process.communicate()
+            return stdout.decode(errors="replace"), stderr.decode(errors="replace")
+        stderr = asyncio.ensure_future(process.stderr.read())
+        lines = []
+        async for raw in process.stdout:
+            line = raw.decode(errors="replace").rstrip("\n")
+            lines.append(line)
+            on_line(line)
+        await process.wait()
+        return "\n".join(lines), (await stderr).decode(errors="replace")
+
+    @staticmethod
+    def _kill(process):
+        # The whole process group: a shell's children and what sudo runs
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            process.kill()
+
+    async def run_async(self, command, shell=False, quiet=False, on_line=None, timeout=None, parent=None):
+        # stdout of command (stripped), or None if it failed, timed out or is not installed
+        try:
+            return await self.check_async(command, shell, on_line, timeout, parent=parent)
+        except CommandError as e:
+            if not quiet:
+                print(f"Command failed: {e}")
+                if isinstance(e, CommandFailed):
+                    print(f"Error output: {e.stderr}")
+            return None
+
+    async def gather(self, commands, quiet=False, timeout=None, parent=None):
+        # Results of commands (strings run through the shell, lists without) in order
+        import asyncio
+
+        return await asyncio.gather(*(self.run_async(command, isinstance(command, str), quiet, timeout=timeout,
+                                                     parent=parent) for command in commands))
+
+    # Sync API (any other thread)
+
+    def run(self, command, shell=False, quiet=False, on_line=None, timeout=None):
+        parent = tracing.tracer.current()
+        return self.submit(self.run_async(command, shell, quiet, on_line, timeout, parent)).result()
+
+    def check(self, command, shell=False, on_line=None, timeout=None, retries=RETRIES):
+        parent = tracing.tracer.current()
+        return self.submit(self.check_async(command, shell, on_line, timeout, retries, parent)).result()
+
+    def run_many(self, commands, quiet=False, timeout=None):
+        # Run commands concurrently; the results in order
+        return self.submit(self.gather(commands, quiet, timeout, tracing.tracer.current())).result()
+
+    def call_all(self, funcs):
+        # Call the functions (which may run commands themselves) concurrently; the results in order
+        if len(funcs) < 2:
+            return [func() for func in funcs]
+        parent = tracing.tracer.current()
+
+        def call(func):
+            with tracing.tracer.attached(parent):
+                return func()
+
+        loop = self._start()
+
+        async def fan_out():
+            import asyncio
+
+            return await asyncio.gather(*(loop.run_in_executor(None, call, func) for func in funcs))
+
+        return self.submit(fan_out()).result()
+
+
+executor = CommandExecutor()
+
+
+def run_command(command, shell=False, quiet=False, on_line=None, timeout=None):
+    return executor.run(command, shell, quiet, on_line, timeout)
+
+
+def check_command(command, shell=False, on_line=None, timeout=None, retries=RETRIES):
+    return executor.check(command, shell, on_line, timeout, retries)
+
+
+def run_many(commands, quiet=False, timeout=None):
+    return executor.run_many(commands, quiet, timeout)
+
+
+def call_all(funcs):
+    return executor.call_all(funcs)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: {os.path.basename(sys.argv[0])} COMMAND...")
+        sys.exit(1)
+    start = time.monotonic()
+    for command, output in zip(sys.argv[1:], run_many(sys.argv[1:])):
+        print(f"$ {command}\n{output if output is not None else '(failed)'}")
+    print(f"{len(sys.argv) - 1} commands in {(time.monotonic() - start) * 1000:.0f} ms")
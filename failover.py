@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# Automatic WiFi/4G failover.
+# Every uplink that has an address is probed with a TCP handshake bound to its
+# interface (see handover.connect_time). The engine keeps a sliding window of
+# RTT and loss per uplink and switches with a make-before-break handover when
+# the active uplink goes bad. It switches back to the preferred uplink once
+# that one is good again; the uplink it left stays up as a standby (with a high
+# route metric), so that is measured too.
+# Flapping is avoided with separate fail and recover thresholds, a number of
+# consecutive bad windows before failing over, and a hold-down time after every
+# switch. The probe cost is bounded by --rate (handshakes per second per
+# uplink, about 5 small packets each).
+# The probes are bound to their uplink's interface, which needs CAP_NET_RAW;
+# without it every probe fails, so the engine refuses to start.
+# To try it without real links, put two veth pairs into network namespaces and
+# degrade one with "tc qdisc add dev IFACE root netem loss 60% delay 800ms".
+# Usage: sudo python3 failover.py [--preferred wifi|mobile] [--rate N] [--hold-down S]
+import argparse
+import collections
+import statistics
+import sys
+import threading
+import time
+
+import connectivity
+import handover
+import operations
+
+# Probing
+PROBE_RATE = 0.5  # handshakes per second per uplink
+WINDOW = 10  # samples kept per uplink
+MIN_SAMPLES = 4  # samples needed before judging an uplink
+
+# The active uplink is bad above these...
+FAIL_LOSS = 0.5
+FAIL_RTT = 1.5
+# ...and a standby uplink only counts as good below these
+RECOVER_LOSS = 0.1
+RECOVER_RTT = 0.5
+RECOVER_JITTER = 0.2
+
+# Consecutive bad evaluations before failing over
+FAIL_COUNT = 3
+# Seconds after a switch during which no other switch is made
+HOLD_DOWN = 60
+# Seconds between attempts to bring the preferred uplink back when it is down
+RETRY_INTERVAL = 300
+
+
+def check_probes():
+    # None if the probes can be bound to an interface, else why not
+    if connectivity.can_bind("lo"):
+        return None
+    return "failover needs CAP_NET_RAW to probe each uplink; run it as root or grant the capability"
+
+
+class UplinkStats:
+    def __init__(self, window=WINDOW):
+        self.interface = None
+        self.samples = collections.deque(maxlen=window)
+
+    def reset(self, interface):
+        self.interface = interface
+        self.samples.clear()
+
+    def add(self, rtt):
+        # rtt is None for a lost probe
+        self.samples.append(rtt)
+
+    def summary(self):
+        rtts = [rtt for rtt in self.samples if rtt is not None]
+        return {
+            "interface": self.interface,
+            "samples": len(self.samples),
+            "loss": (1 - len(rtts) / len(self.samples)) if self.samples else None,
+            "rtt": statistics.mean(rtts) if rtts else None,
+            "jitter": statistics.mean(abs(a - b) for a, b in zip(rtts, rtts[1:])) if len(rtts) > 1 else 0.0,
+        }
+
+    def is_bad(self):
+        stats = self.summary()
+        if stats["samples"] < MIN_SAMPLES:
+            return False
+        return stats["loss"] > FAIL_LOSS or stats["rtt"] is None or stats["rtt"] > FAIL_RTT
+
+    def is_good(self):
+        stats = self.summary()
+        if stats["samples"] < MIN_SAMPLES or stats["rtt"] is None:
+            return False
+        return stats["loss"] <= RECOVER_LOSS and stats["rtt"] <= RECOVER_RTT and stats["jitter"] <= RECOVER_JITTER
+
+
+class FailoverEngine:
+    def __init__(self, toggle, preferred="wifi", rate=PROBE_RATE, hold_down=HOLD_DOWN,
+                 retry=RETRY_INTERVAL, report=print):
+        # toggle provides the enable/disable routines used by the handover
+        # (see handover.Handover); switches queue with other operations (see operations.py)
+        self.toggle = toggle
+        self.preferred = preferred
+        self.interval = 1 / rate
+        self.hold_down = hold_down
+        self.retry = retry
+        self.report = report
+        self.stats = {kind: UplinkStats() for kind in handover.UPLINKS}
+        self.bad_count = 0
+        self.hold_until = 0
+        self.next_retry = 0
+        self.stopped = threading.Event()
+
+    def probe(self):
+        # One probe on every uplink that has an address
+        for kind, stats in self.stats.items():
+            interface = handover.uplink_interface(kind)
+            if interface != stats.interface:
+                stats.reset(interface)
+            if interface:
+                stats.add(handover.connect_time(interface))
+
+    def _switch(self, kind, reason):
+        self.report(f"Switching to {kind}: {reason}")
+        switched = operations.run(f"handover {kind}", lambda: handover.Handover(self.toggle, report=self.report, keep_old=True).run(kind),
+                                  report=self.report)
+        # Hold down after failed attempts too, so a broken link is not retried in a loop
+        self.hold_until = time.monotonic() + self.hold_down
+        self.bad_count = 0
+        return switched
+
+    def evaluate(self):
+        # Decide whether to switch, based on the current windows
+        now = time.monotonic()
+        active_interface = handover.default_interface()
+        active = next((kind for kind, stats in self.stats.items()
+                       if stats.interface and stats.interface == active_interface), None)
+        if active is None or now < self.hold_until:
+            return None
+        standby = next(kind for kind in handover.UPLINKS if kind != active)
+
+        self.bad_count = self.bad_count + 1 if self.stats[active].is_bad() else 0
+        if self.bad_count >= FAIL_COUNT:
+            # The standby is brought up by the handover if needed; the handover
+            # also checks its connectivity before moving any traffic
+            if self.stats[standby].interface is None or not self.stats[standby].is_bad():
+                self._switch(standby, f"{active} {self.describe(active)}")
+                return standby
+            return None
+
+        if active != self.preferred:
+            if self.stats[self.preferred].is_good():
+                self._switch(self.preferred, f"{self.preferred} recovered {self.describe(self.preferred)}")
+                return self.preferred
+            if self.stats[self.preferred].interface is None and now >= self.next_retry:
+                self.next_retry = now + self.retry
+                self._switch(self.preferred, f"retrying {self.preferred}")
+                return self.preferred
+        return None
+
+    def describe(self, kind):
+        stats = self.stats[kind].summary()
+        if stats["rtt"] is None:
+            return f"(loss {stats['loss']:.0%})"
+        return f"(loss {stats['loss']:.0%}, rtt {stats['rtt'] * 1000:.0f} ms, jitter {stats['jitter'] * 1000:.0f} ms)"
+
+    def step(self):
+        self.probe()
+        return self.evaluate()
+
+    def run(self):
+        self.report(f"Failover running: preferring {self.preferred}, {1 / self.interval:g} probes/s per uplink")
+        while not self.stopped.is_set():
+            start = time.monotonic()
+            self.step()
+            self.stopped.wait(max(0, self.interval - (time.monotonic() - start)))
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopped.set()
+
+
+if __name__ == "__main__":
+    from network_toggle_cli import NetworkToggleCLI
+
+    parser = argparse.ArgumentParser(description="Switch between WiFi and 4G automatically")
+    parser.add_argument("--preferred", choices=handover.UPLINKS, default="wifi")
+    parser.add_argument("--rate", type=float, default=PROBE_RATE, help="probes per second per uplink")
+    parser.add_argument("--hold-down", type=float, default=HOLD_DOWN, help="seconds between switches")
+    parser.add_argument("--retry", type=float, default=RETRY_INTERVAL,
+                        help="seconds between attempts to bring the preferred uplink back")
+    args = parser.parse_args()
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+    if check_probes():
+        parser.error(check_probes())
+    engine = FailoverEngine(NetworkToggleCLI(use_daemon=False), args.preferred, args.rate, args.hold_down, args.retry)
+    try:
+        engine.run()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 import tkinter as tk
 from tkinter import ttk, messagebox
-import subprocess
+import threading
+
+import apn_db
+import executor
+import network_toggle_client
+import operations
+import signal_history
+import usage_meter
+from handover import Handover
+from network_backend import NetworkBackend
+from status_cache import StatusCache
+from wifi_reconnect import WifiReconnect
 
 class NetworkToggleApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Network Connection Manager")
-        self.apn = "internet.digimobil.es"
+        # APN; None to use the SIM operator's (see apn_db.py)
+        self.apn = None
+        
+        # Long-lived D-Bus connection to NetworkManager/ModemManager (falls back to nmcli/mmcli)
+        self.backend = NetworkBackend(self.run_command)
         
         # Initialize modem
         self.modem_index = self.get_modem_index()
@@ -20,6 +35,11 @@ class NetworkToggleApp:
         self.status_label = ttk.Label(root, text="Current Status: Checking...")
         self.status_label.pack(pady=10)
         
+        self.usage_label = ttk.Label(root, text="")
+        self.usage_label.pack(pady=5)
+        self.signal_label = ttk.Label(root, text="")
+        self.signal_label.pack(pady=5)
+        
         self.toggle_button = ttk.Button(root, text="Toggle Connection", command=self.toggle_connection)
         self.toggle_button.pack(pady=5)
         
@@ -29,72 +49,230 @@ class NetworkToggleApp:
         self.wifi_radio.pack()
         self.mobile_radio.pack()
         
+        # Mobile data usage and signal history, sampled here while the daemon is not
+        # running (see usage_meter.py and signal_history.py). Only updated while mobile
+        # data is connected and the window is shown; update_status() starts them.
+        self.usage_meter = usage_meter.UsageMeter(
+            on_alert=lambda message: self.root.after(0, messagebox.showwarning, "Data usage", message))
+        self.signal_sampler = signal_history.SignalSampler(self.backend)
+        self.visible = True
+        self.meters_active = None
+        self.meters_job = None
+        self.meters_fetching = False
+        self.meters_stale = False
+        self.root.bind("<Map>", lambda event: self._set_visible(event, True), add="+")
+        self.root.bind("<Unmap>", lambda event: self._set_visible(event, False), add="+")
+        
+        # Push status updates on network events instead of polling every 5 seconds
+        self.last_status = None
+        self.status_fetching = False
+        self.status_stale = False
+        self.status_cache = StatusCache(self.run_command, self.backend,
+                                        on_change=lambda sources: self.root.after(0, self.update_status))
+        
         self.update_status()
 
+    def run_command(self, command, shell=False, on_line=None):
+        return executor.run_command(command, shell, on_line=on_line)
+
     def get_modem_index(self):
-        try:
-            result = subprocess.check_output(["mmcli", "-L"], text=True)
-            return result.split()[0].split('/')[-1]  # Extract modem index
-        except subprocess.CalledProcessError:
-            return None
+        return self.backend.modem_index()
 
     def update_status(self):
-        current_interface = self.interface_var.get()
+        # Fetched in a worker thread so a slow daemon or status read does not freeze
+        # the window; a request while one is running repeats it once it is done
+        if self.status_fetching:
+            self.status_stale = True
+            return
+        self.status_fetching = True
+        self.status_stale = False
+        threading.Thread(target=self._fetch_status, daemon=True).start()
+
+    def _fetch_status(self):
+        shown = None
         try:
-            wifi_status = subprocess.check_output(["nmcli", "radio", "wifi"], text=True).strip()
-            mobile_status = subprocess.check_output(["mmcli", "-m", self.modem_index, "-e"], text=True)
-            
-            status_text = f"WiFi: {wifi_status}\nMobile: {self.get_mobile_status()}"
+            # Ask the resident daemon for its in-memory status when it is running
+            response = network_toggle_client.request("status")
+            if response is not None and response["ok"]:
+                status = response["status"]
+            else:
+                status = self.status_cache.status()
+            wifi_status = "enabled" if status["wifi_enabled"] else "disabled"
+            mobile_status = "connected" if status["current_connection"] == "Mobile Data" else "disconnected"
+            shown = (wifi_status, mobile_status)
+        finally:
+            # Always hand back to the Tk thread, or status_fetching would stay set
+            if shown is None:
+                self.root.after(0, self._status_failed)
+            else:
+                self.root.after(0, self._show_status, *shown)
+
+    def _status_failed(self):
+        self.status_fetching = False
+        if self.status_stale:
+            self.update_status()
+        else:
+            self.root.after(5000, self.update_status)
+
+    def _show_status(self, wifi_status, mobile_status):
+        self.status_fetching = False
+        # Only touch the widgets when something actually changed
+        if (wifi_status, mobile_status) != self.last_status:
+            self.last_status = (wifi_status, mobile_status)
+            status_text = f"WiFi: {wifi_status}\nMobile: {mobile_status}"
             self.status_label.config(text=status_text)
             
             # Update radio buttons based on current connection
-            if "connected" in self.get_mobile_status():
+            if mobile_status == "connected":
                 self.interface_var.set("wwan0")
             else:
                 self.interface_var.set("wlan0")
-                
-        except subprocess.CalledProcessError as e:
-            messagebox.showerror("Error", f"Status check failed: {str(e)}")
+        self.meters_changed()
         
-        self.root.after(5000, self.update_status)
+        if self.status_stale:
+            self.update_status()
+        # Fall back to polling when no event source is available
+        elif not self.status_cache.events_active:
+            self.status_cache.invalidate()
+            self.root.after(5000, self.update_status)
+
+    def _set_visible(self, event, visible):
+        # <Map>/<Unmap> of the window itself, not of its widgets
+        if event.widget is self.root:
+            self.visible = visible
+            self.meters_changed()
+
+    def meters_changed(self):
+        # Refresh the meters once when they start or stop being active
+        active = self.last_status is not None and self.last_status[1] == "connected" and self.visible
+        if active != self.meters_active:
+            if self.meters_job is not None:
+                self.root.after_cancel(self.meters_job)
+                self.meters_job = None
+            self.update_meters()
 
-    def get_mobile_status(self):
+    def update_meters(self):
+        # Like update_status(), fetched in a worker thread
+        self.meters_job = None
+        self.meters_active = self.last_status is not None and self.last_status[1] == "connected" and self.visible
+        if self.meters_fetching:
+            self.meters_stale = True
+            return
+        self.meters_fetching = True
+        self.meters_stale = False
+        threading.Thread(target=self._fetch_meters, args=(self.meters_active,), daemon=True).start()
+
+    def _fetch_meters(self, active):
+        shown = None
         try:
-            status = subprocess.check_output(
-                ["mmcli", "-m", self.modem_index, "--command=AT+UCGSTATUS"],
-                text=True
-            )
-            return "connected" if "1" in status else "disconnected"
-        except subprocess.CalledProcessError:
-            return "status unknown"
+            response = network_toggle_client.request("status")
+            if response is not None and response["ok"] and "usage" in response["status"]:
+                usage = response["status"]["usage"]
+                signal = response["status"].get("signal", {})
+            else:
+                if active and self.usage_meter.thread is None:
+                    self.usage_meter.start()
+                    self.signal_sampler.start()
+                elif not active and self.usage_meter.thread is not None:
+                    self.usage_meter.stop()
+                    self.signal_sampler.stop()
+                usage = self.usage_meter.summary()
+                signal = self.signal_sampler.store.summary()
+            shown = (usage, signal)
+        finally:
+            # Like _fetch_status(), meters_fetching is reset either way
+            if shown is None:
+                self.root.after(0, self._meters_failed)
+            else:
+                self.root.after(0, self._show_meters, *shown)
+
+    def _show_meters(self, usage, signal):
+        self.meters_fetching = False
+        self.usage_label.config(text=f"Mobile data: {usage_meter.describe(usage)}")
+        self.signal_label.config(text=f"Signal: {signal_history.describe(signal)}" if signal else "")
+        if self.meters_stale:
+            self.update_meters()
+        elif self.meters_active and self.meters_job is None:
+            self.meters_job = self.root.after(2000, self.update_meters)
+
+    def _meters_failed(self):
+        self.meters_fetching = False
+        if self.meters_stale:
+            self.update_meters()
+        elif self.meters_active and self.meters_job is None:
+            self.meters_job = self.root.after(2000, self.update_meters)
 
     def toggle_connection(self):
         target_interface = self.interface_var.get()
-        
+        kind = "mobile" if target_interface == "wwan0" else "wifi"
+        # The switch takes seconds; the window stays responsive while it runs
+        self.toggle_button.config(state=tk.DISABLED)
+        self.status_label.config(text=f"Switching to {target_interface}...")
+        threading.Thread(target=self._run_handover, args=(kind, target_interface), daemon=True).start()
+
+    def _run_handover(self, kind, target_interface):
+        # Worker thread; the result is shown on the Tk thread
         try:
-            # Disable current interface
-            if target_interface == "wwan0":
-                subprocess.run(["nmcli", "radio", "wifi", "off"])
-                self.setup_mobile_connection()
+            # Make-before-break: the other link is only released once the target carries the traffic
+            response = network_toggle_client.request("handover", to=kind)
+            if response is not None:
+                if response["ok"]:
+                    result = ("Success", f"Switched to {target_interface} (outage {response['handover']['outage_ms']} ms)")
+                else:
+                    result = ("Error", f"Toggle failed: {response.get('error', 'daemon stopped')}")
             else:
-                subprocess.run(["mmcli", "-m", self.modem_index, "--disable"])
-                subprocess.run(["nmcli", "radio", "wifi", "on"])
-            
-            messagebox.showinfo("Success", f"Switched to {target_interface}")
-        except subprocess.CalledProcessError as e:
-            messagebox.showerror("Error", f"Toggle failed: {str(e)}")
+                handover = Handover(self)
+                # Another tool's switch runs first; the same one already running is not repeated (see operations.py)
+                switched = operations.run(f"handover {kind}", lambda: handover.run(kind)) is True
+                self.status_cache.invalidate_for("wifi")
+                self.status_cache.invalidate_for("mobile")
+                if switched:
+                    result = ("Success", f"Switched to {target_interface} (outage {handover.result.get('outage_ms', 0)} ms)")
+                else:
+                    result = ("Error", f"Toggle failed, still using {handover.result.get('from') or 'no uplink'}")
+        except Exception as e:
+            result = ("Error", f"Toggle failed: {e}")
+        self.root.after(0, self._handover_done, *result)
+
+    def _handover_done(self, title, message):
+        self.toggle_button.config(state=tk.NORMAL)
+        self.last_status = None
+        # Without events the next poll shows the new links; it must not be scheduled twice
+        if self.status_cache.events_active:
+            self.update_status()
+        if title == "Success":
+            messagebox.showinfo(title, message)
+        else:
+            messagebox.showerror(title, message)
+
+    # Link operations used by the handover (see handover.py); each returns False when it failed
+
+    def enable_wifi(self):
+        self.backend.set_wifi_enabled(True)
+        return WifiReconnect(self.backend).connect()
+
+    def disable_wifi(self):
+        self.backend.set_wifi_enabled(False)
+        return True
+
+    def enable_mobile_data(self):
+        return self.setup_mobile_connection()
+
+    def disable_mobile_data(self):
+        return self.backend.modem_enable(False)
 
     def setup_mobile_connection(self):
-        # Configure APN and enable modem
-        subprocess.run([
-            "mmcli", "-m", self.modem_index, 
-            "--3gpp-set-initial-eps-bearer-settings="
-            f"apn={self.apn},ip-type=ipv4"
-        ])
-        subprocess.run(["mmcli", "-m", self.modem_index, "--enable"])
-        subprocess.run(["mmcli", "-m", self.modem_index, "--simple-connect"])
+        # Configure APN and enable modem; returns True once the bearer is connected
+        settings = dict(apn_db.DEFAULT, apn=self.apn) if self.apn else apn_db.lookup(apn_db.read_sim(self.backend, self.run_command))
+        self.backend.modem_set_initial_bearer(settings["apn"], settings["ip_type"])
+        if not self.backend.modem_enable(True):
+            return False
+        return self.backend.modem_simple_connect(settings["apn"], settings["username"], settings["password"])
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = NetworkToggleApp(root)
     root.mainloop()
+    if hasattr(app, "usage_meter"):
+        app.usage_meter.stop()
+        app.signal_sampler.stop()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# Make-before-break handover between WiFi and 4G.
+# The target uplink is brought up next to the current one and checked with the
+# connectivity verifier bound to its interface; traffic does not move to a
+# captive portal, nor to a link that could not be checked because binding needs
+# CAP_NET_RAW. Then its route metric is lowered, so the kernel moves the default
+# route in one step. The old link is released only after a drain period, or,
+# for failover, kept up as a standby with a route metric that never wins the
+# default route. While this runs, a probe over the default route measures the
+# longest gap in connectivity (the outage).
+# Usage: sudo python3 handover.py wifi|mobile [--drain SECONDS]
+import argparse
+import socket
+import sys
+import threading
+import time
+
+import connectivity
+import net_status
+from modem_ready import wait_until
+
+# Reachability probe: a TCP handshake with a well-known anycast DNS server
+PROBE_TARGET = ("1.1.1.1", 53)
+PROBE_TIMEOUT = 1
+# Seconds between probes of the outage meter
+METER_INTERVAL = 0.05
+
+# Deadlines (in seconds) for the target link
+ADDRESS_TIMEOUT = 60
+VERIFY_TIMEOUT = 15
+ROUTE_TIMEOUT = 5
+# Time the old link is kept after the switch so in-flight requests can finish
+DRAIN_TIME = 5
+
+# Metric given to the new uplink. It is lower than NetworkManager's defaults
+# (ethernet 100, WiFi 600, mobile 700), so the new default route wins.
+PREFERRED_METRIC = 50
+# Metric given to an old uplink kept as a standby (higher than all of the above)
+STANDBY_METRIC = 900
+
+# Uplinks that can be handed over, named as in net_status.interface_kind()
+UPLINKS = ("wifi", "mobile")
+
+
+def connect_time(ifname=None, target=PROBE_TARGET, timeout=PROBE_TIMEOUT):
+    # Seconds a TCP handshake with target takes, through ifname when given,
+    # or None if it fails. Binding to an interface needs CAP_NET_RAW.
+    try:
+        with connectivity.bound_socket(socket.SOCK_STREAM, ifname, timeout) as sock:
+            start = time.monotonic()
+            sock.connect(target)
+            return time.monotonic() - start
+    except OSError:
+        return None
+
+
+def uplink_interface(kind):
+    # Name of an interface of the given kind with an IPv4 address, or None
+    interfaces = net_status.read_interfaces()
+    addresses = net_status.read_addresses_or_empty()
+    for name, info in sorted(interfaces.items()):
+        if info["kind"] == kind and addresses.get(info["index"], {}).get("ipv4"):
+            return name
+    return None
+
+
+def default_interface():
+    routes = net_status.read_default_routes()
+    if not routes:
+        return None
+    names = {info["index"]: name for name, info in net_status.read_interfaces().items()}
+    return names.get(routes[0]["ifindex"])
+
+
+class OutageMeter:
+    # Probes the default route in the background and records the longest time
+    # without a successful probe
+    def __init__(self, interval=METER_INTERVAL, target=PROBE_TARGET):
+        self.interval = interval
+        self.target = target
+        self.longest_gap = 0.0
+        self.failures = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        last_success = time.monotonic()
+        while not self.stopped.is_set():
+            if connect_time(target=self.target, timeout=PROBE_TIMEOUT) is not None:
+                now = time.monotonic()
+                self.longest_gap = max(self.longest_gap, now - last_success)
+                last_success = now
+            else:
+                self.failures += 1
+            self.stopped.wait(self.interval)
+        self.longest_gap = max(self.longest_gap, time.monotonic() - last_success)
+
+    def stop(self):
+        # Returns the outage in seconds: the longest gap minus one probe interval
+        self.stopped.set()
+        self.thread.join()
+        return max(0.0, self.longest_gap - self.interval)
+
+
+class Handover:
+    def __init__(self, toggle, report=print, drain=DRAIN_TIME, keep_old=False):
+        # toggle provides enable_wifi/disable_wifi/enable_mobile_data/
+        # disable_mobile_data and the backend (see network_toggle_cli.py).
+        # keep_old leaves the old uplink up as a standby instead of releasing it.
+        self.toggle = toggle
+        self.report = report
+        self.drain = drain
+        self.keep_old = keep_old
+        self.result = {}
+
+    def _enable(self, kind):
+        return self.toggle.enable_wifi() if kind == "wifi" else self.toggle.enable_mobile_data()
+
+    def _disable(self, kind):
+        return self.toggle.disable_wifi() if kind == "wifi" else self.toggle.disable_mobile_data()
+
+    def run(self, kind):
+        # Returns True once the default route is on the kind ("wifi"/"mobile") uplink
+        start = time.monotonic()
+        self.result = {}
+        old_iface = default_interface()
+        old_kind = net_status.interface_kind(old_iface) if old_iface else None
+        if old_kind == kind:
+            self.report(f"Already using {old_iface}")
+            return True
+
+        meter = OutageMeter()
+        meter.start()
+        try:
+            switched = self._switch(kind, old_iface)
+        finally:
+            outage = meter.stop()
+        self.result = {
+            "from": old_iface,
+            "to": self.result.get("to"),
+            "verify": self.result.get("verify"),
+            "switched": switched,
+            "outage_ms": round(outage * 1000),
+            "duration_s": round(time.monotonic() - start, 1),
+        }
+        self.report(f"Handover {'completed' if switched else 'failed'}: "
+                    f"outage {self.result['outage_ms']} ms, took {self.result['duration_s']} s")
+        return switched
+
+    def _switch(self, kind, old_iface):
+        # Bring the target up next to the current uplink
+        self.report(f"Bringing up {kind} alongside {old_iface or 'no uplink'}...")
+        if not self._enable(kind):
+            self.report(f"Could not enable {kind}; keeping {old_iface}")
+            return False
+        new_iface, _ = wait_until(lambda: uplink_interface(kind), ADDRESS_TIMEOUT)
+        if new_iface is None:
+            self.report(f"{kind} got no address; keeping {old_iface}")
+            return False
+        self.result["to"] = new_iface
+
+        # Only move traffic to a link that actually reaches the internet
+        result = connectivity.Verifier().wait(new_iface, VERIFY_TIMEOUT)
+        self.result["verify"] = result
+        if not result["bound"]:
+            # Unbound probes took the old default route and say nothing about new_iface
+            self.report(f"Cannot check {new_iface} without CAP_NET_RAW (run as root, or start the daemon); "
+                        f"keeping {old_iface}")
+            return False
+        if result["state"] != connectivity.ONLINE:
+            self.report(f"{new_iface} is {connectivity.describe(result)}; keeping {old_iface}")
+            return False
+        self.report(f"{new_iface} is {connectivity.describe(result)}, moving the default route...")
+
+        self.toggle.backend.set_route_metric(new_iface, PREFERRED_METRIC)
+        moved, _ = wait_until(lambda: default_interface() == new_iface, ROUTE_TIMEOUT, interval=0.05)
+        if not moved:
+            self.report(f"Default route did not move to {new_iface}; keeping {old_iface}")
+            return False
+
+        # Let in-flight requests on the old link finish before releasing it
+        if old_iface:
+            old_kind = net_status.interface_kind(old_iface)
+            if old_kind in UPLINKS and self.keep_old:
+                # It may have the preferred metric from an earlier handover
+                self.report(f"Keeping {old_iface} up as a standby")
+                self.toggle.backend.set_route_metric(old_iface, STANDBY_METRIC)
+            elif old_kind in UPLINKS:
+                self.report(f"Draining {old_iface} for {self.drain} s...")
+                time.sleep(self.drain)
+                self._disable(old_kind)
+        return True
+
+
+if __name__ == "__main__":
+    import operations
+    from network_toggle_cli import NetworkToggleCLI
+
+    parser = argparse.ArgumentParser(description="Switch uplinks without dropping connections")
+    parser.add_argument("target", choices=UPLINKS)
+    parser.add_argument("--drain", type=float, default=DRAIN_TIME, help="seconds to keep the old link after the switch")
+    args = parser.parse_args()
+    handover = Handover(NetworkToggleCLI(use_daemon=False), drain=args.drain)
+    sys.exit(0 if operations.run(f"handover {args.target}", lambda: handover.run(args.target)) is True else 1)
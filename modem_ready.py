@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Readiness waits for the 4G bring-up path.
+# Every wait polls a cheap condition and returns as soon as it holds, with a
+# deadline per phase, instead of sleeping a fixed amount of time.
+import os
+import time
+
+import at_channel
+import operations
+import tracing
+
+# Deadlines (in seconds) for each bring-up phase
+PORT_TIMEOUT = 45
+AT_TIMEOUT = 20
+MODEM_TIMEOUT = 30
+PROFILE_TIMEOUT = 10
+IP_TIMEOUT = 60
+# ModemManager usually exports a known modem quickly without a restart
+WARM_MODEM_TIMEOUT = 10
+
+# Port used for AT commands, as documented by Clockwork
+AT_PORT = at_channel.AT_PORT
+
+
+def wait_until(condition, timeout, interval=0.5):
+    # Poll condition() until it returns something truthy or the deadline passes.
+    # Returns (result, elapsed seconds); result is None on timeout.
+    start = time.monotonic()
+    deadline = start + timeout
+    while True:
+        result = condition()
+        if result:
+            return result, time.monotonic() - start
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None, time.monotonic() - start
+        time.sleep(min(interval, remaining))
+
+
+class ModemReadiness:
+    def __init__(self, run_command, report=print, backend=None):
+        self.run_command = run_command
+        self.report = report
+        self.backend = backend
+        # Seconds spent in each phase, in the order they ran
+        self.timings = {}
+
+    def _phase(self, name, condition, timeout, interval=0.5):
+        self.report(f"Waiting for {name} (up to {timeout} seconds)...")
+        with tracing.span(name) as span:
+            # A preempting request (see operations.py) ends the wait early
+            result, elapsed = wait_until(lambda: operations.check_cancelled() or condition(), timeout, interval)
+            if not result:
+                span.fail(timeout=timeout)
+        self.timings[name] = elapsed
+        if result:
+            self.report(f"{name[0].upper()}{name[1:]} ready after {elapsed:.1f}s")
+        else:
+            self.report(f"Timed out waiting for {name} after {elapsed:.1f}s")
+        return result
+
+    def summary(self):
+        if not self.timings:
+            return "Bring-up phases: none, already up"
+        parts = [f"{name} {elapsed:.1f}s" for name, elapsed in self.timings.items()]
+        total = sum(self.timings.values())
+        return f"Bring-up phases: {', '.join(parts)} (total {total:.1f}s)"
+
+    # Conditions
+
+    def at_port_answers(self, port=AT_PORT):
+        if not os.path.exists(port):
+            return False
+        return at_channel.send_with_fallback("AT", self.run_command, port, timeout=1) is not None
+
+    def modem_exported(self):
+        if self.backend:
+            return self.backend.modem_detected()
+        output = self.run_command(["mmcli", "-L"])
+        return bool(output) and ("SIMCOM_SIM7600G-H" in output or "QUALCOMM" in output)
+
+    def profile_exists(self, name):
+        if self.backend:
+            return self.backend.profile_exists(name)
+        output = self.run_command(["nmcli", "-t", "-f", "NAME", "connection", "show"])
+        return bool(output) and name in output.split('\n')
+
+    def connection_ip(self, name):
+        if self.backend:
+            return self.backend.connection_ip(name)
+        output = self.run_command(["nmcli", "-g", "IP4.ADDRESS", "connection", "show", name])
+        return output or None
+
+    def interface_ip(self, ifname):
+        if not os.path.exists(f"/sys/class/net/{ifname}"):
+            return None
+        output = self.run_command(["ip", "-4", "-o", "addr", "show", "dev", ifname])
+        if output and " inet " in output:
+            return output.split(" inet ")[1].split()[0]
+        return None
+
+    # Phases
+
+    def wait_for_ports(self, port=AT_PORT, timeout=PORT_TIMEOUT):
+        return self._phase("modem ports", lambda: os.path.exists(port), timeout)
+
+    def wait_for_at(self, port=AT_PORT, timeout=AT_TIMEOUT):
+        return self._phase("AT port", lambda: self.at_port_answers(port), timeout, interval=1)
+
+    def wait_for_modemmanager(self, timeout=MODEM_TIMEOUT):
+        return self._phase("ModemManager modem", self.modem_exported, timeout, interval=1)
+
+    def wait_for_profile(self, name, timeout=PROFILE_TIMEOUT):
+        return self._phase("connection profile", lambda: self.profile_exists(name), timeout)
+
+    def wait_for_connection_ip(self, name, timeout=IP_TIMEOUT):
+        return self._phase("bearer IP address", lambda: self.connection_ip(name), timeout, interval=1)
+
+    def wait_for_interface_ip(self, ifname, timeout=IP_TIMEOUT):
+        return self._phase(f"{ifname} IP address", lambda: self.interface_ip(ifname), timeout, interval=1)
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# Simultaneous WiFi + 4G (multipath) mode.
+# Both uplinks are brought up with the usual enable routines and stay up. Each
+# gets its own routing table holding its default route, and a rule sends
+# traffic from its address through it, so replies and bound sockets leave by
+# the right link. New connections from this machine are spread over both links
+# by a weighted multipath default route in MULTIPATH_TABLE. The kernel hashes
+# each connection (addresses and ports, fib_multipath_hash_policy=1) to one
+# next hop, so a connection stays on its link. Routes of the main table other
+# than the default route (the LAN, VPNs) keep working as before.
+# - The weights follow the throughput measured on each link: the highest rate
+#   seen recently, decaying slowly, so a link that proved faster gets more of
+#   the new connections. Until there is traffic both links get the same weight,
+#   and a slow link keeps an eighth of the top weight so it stays measured.
+# - Policies pin traffic to one link: "uid:1000=mobile" (a user's programs),
+#   "port:22=wifi" (TCP and UDP destination port) or "to:10.8.0.0/16=mobile".
+# - The metered 4G link can have a byte cap (--cap MB). Once the 4G traffic
+#   since the start reaches it, 4G gets no new connections, pinned ones
+#   included; open connections keep their link.
+# The per-link split is kept in a state file for the status output.
+# To try it without real links, put two veth pairs into network namespaces
+# acting as gateways, give the local ends addresses and default routes (as
+# NetworkManager does, with different metrics), and run with
+# --wifi VETH1 --mobile VETH2: those interfaces are then used as they are.
+# Usage: sudo python3 multipath.py [--cap MB] [--policy SELECTOR=LINK]... [--wifi IFACE] [--mobile IFACE] [--status]
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import executor
+import net_status
+import operations
+import usage_meter
+from handover import UPLINKS, uplink_interface
+from modem_ready import wait_until
+
+STATE_PATH = os.path.join(os.environ.get("XDG_STATE_HOME", os.path.expanduser("~/.local/state")),
+                          "uconsole-network-toggle", "multipath.json")
+
+# Routing tables and rule priorities, ahead of the main table's 32766
+LINK_TABLES = {"wifi": 201, "mobile": 202}
+MULTIPATH_TABLE = 200
+PRIORITY_MAIN = 30000  # main table routes except the default route
+PRIORITY_POLICY = 30100  # pinned traffic, one priority per policy
+PRIORITY_SOURCE = 30500  # traffic from a link's address
+PRIORITY_MULTIPATH = 30900  # everything else
+
+INTERVAL = 5  # seconds between samples and weight updates
+LINK_TIMEOUT = 90  # seconds for both links to get an address
+# Measured rates decay by this factor per second, so the weights follow a link
+# that got slower within a few minutes
+DECAY = 0.995
+MAX_WEIGHT = 255
+# Every usable link keeps at least MIN_WEIGHT, so it still gets some new
+# connections and its rate goes on being measured; rates below MIN_RATE
+# (bytes/s, background chatter) count as MIN_RATE
+MIN_WEIGHT = 32
+MIN_RATE = 16 * 1024
+# Relative weight change below which the route is left alone
+WEIGHT_HYSTERESIS = 0.2
+HASH_POLICY = "net.ipv4.fib_multipath_hash_policy"
+
+
+def parse_policy(text):
+    # "uid:1000=mobile" -> ("uid", "1000", "mobile"); raises ValueError
+    selector, _, link = text.rpartition("=")
+    kind, _, value = selector.partition(":")
+    if link not in UPLINKS or kind not in ("uid", "port", "to") or not value:
+        raise ValueError(f"invalid policy {text!r}: expected uid:UID, port:PORT or to:PREFIX, then =wifi or =mobile")
+    return kind, value, link
+
+
+def rule_selectors(kind, value):
+    # ip rule selectors of a policy; a port needs a rule per protocol
+    if kind == "uid":
+        return [["uidrange", f"{value}-{value}"]]
+    if kind == "port":
+        return [["ipproto", protocol, "dport", value] for protocol in ("tcp", "udp")]
+    return [["to", value]]
+
+
+def read_state(path=STATE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def describe(state):
+    # "wifi 70% (1.2 GB, weight 255), mobile 30% (...)"
+    links = state.get("links", {})
+    total = sum(link["bytes"] for link in links.values())
+    parts = []
+    for kind, link in links.items():
+        detail = f"{usage_meter.format_bytes(link['bytes'])}, "
+        detail += "cap reached" if link["capped"] else f"weight {link['weight']}" if link["weight"] else "down"
+        share = f"{link['bytes'] / total:.0%}" if total else "-"
+        parts.append(f"{kind} {share} ({detail})")
+    if state.get("cap"):
+        parts.append(f"4G cap {usage_meter.format_bytes(state['cap'])}")
+    return ", ".join(parts)
+
+
+class Link:
+    def __init__(self, kind, interface=None):
+        self.kind = kind
+        # A fixed interface (a test stand-in), or None to find it by kind
+        self.fixed = interface
+        self.interface = interface
+        self.address = None
+        self.gateway = None
+        self.counters = None
+        self.bytes = 0
+        self.rate = 0.0
+        self.weight = MAX_WEIGHT
+        self.capped = False
+
+    def refresh(self, routes, interfaces, addresses):
+        # Returns True when the interface, address or gateway changed
+        interface = self.fixed or uplink_interface(self.kind)
+        index = (interfaces.get(interface) or {}).get("index")
+        address = next(iter(addresses.get(index, {}).get("ipv4", [])), None)
+        gateway = next((route["gateway"] for route in routes if route["ifindex"] == index), None)
+        changed = (interface, address, gateway) != (self.interface, self.address, self.gateway)
+        if interface != self.interface:
+            # Counters of another interface say nothing about this one
+            self.counters = None
+        self.interface, self.address, self.gateway = interface, address, gateway
+        return changed
+
+    def usable(self):
+        return self.address is not None and not self.capped
+
+    def nexthop(self):
+        # Point-to-point links (wwan0 in raw-ip mode) have no gateway
+        via = ["via", self.gateway] if self.gateway else []
+        return [*via, "dev", self.interface]
+
+
+class MultipathEngine:
+    def __init__(self, toggle, cap=None, policies=(), interval=INTERVAL, interfaces=None, report=print):
+        # toggle provides enable_wifi/enable_mobile_data (see network_toggle_cli.py);
+        # cap: bytes allowed on 4G; interfaces: {kind: stand-in interface}
+        self.toggle = toggle
+        self.cap = cap
+        self.policies = [parse_policy(policy) for policy in policies]
+        self.interval = interval
+        self.report = report
+        interfaces = interfaces or {}
+        self.links = {kind: Link(kind, interfaces.get(kind)) for kind in UPLINKS}
+        # (links, weights) of the installed rules and route
+        self.applied = None
+        self.hash_policy = None
+        self.started = None
+        self.sampled = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def ip(self, *args):
+        # True when the ip command succeeded
+        return executor.run_command(["sudo", "ip", *args], quiet=True) is not None
+
+    def _delete_rules(self, *priorities):
+        for priority in priorities:
+            while self.ip("rule", "del", "priority", str(priority)):
+                pass
+
+    def _policy_priorities(self):
+        return [PRIORITY_POLICY + index for index in range(len(self.policies))]
+
+    def _refresh(self):
+        # Kinds of the links whose interface, address or gateway changed
+        routes = net_status.read_default_routes()
+        interfaces = net_status.read_interfaces()
+        addresses = net_status.read_addresses_or_empty()
+        return [kind for kind, link in self.links.items() if link.refresh(routes, interfaces, addresses)]
+
+    def _links_addressed(self):
+        # Re-reads the links; True once every one of them has an address
+        self._refresh()
+        return all(link.address for link in self.links.values())
+
+    # Setup and teardown
+
+    def setup(self):
+        # Bring up both links and install the rules; False when neither has an address
+        for kind, link in self.links.items():
+            if link.fixed:
+                continue
+            enable = self.toggle.enable_wifi if kind == "wifi" else self.toggle.enable_mobile_data
+            if enable() is False:
+                self.report(f"Could not bring up {kind}; continuing without it")
+        wait_until(lambda: self.stopped.is_set() or self._links_addressed(), LINK_TIMEOUT, interval=1)
+        if self.stopped.is_set():
+            return False
+        if not any(link.address for link in self.links.values()):
+            self.report("Neither uplink has an address")
+            return False
+        self.hash_policy = executor.run_command(["sysctl", "-n", HASH_POLICY], quiet=True)
+        executor.run_command(["sudo", "sysctl", "-q", f"{HASH_POLICY}=1"], quiet=True)
+        self._delete_rules(PRIORITY_MAIN, PRIORITY_SOURCE, PRIORITY_MULTIPATH, *self._policy_priorities())
+        self.ip("rule", "add", "priority", str(PRIORITY_MAIN), "lookup", "main", "suppress_prefixlength", "0")
+        self.ip("rule", "add", "priority", str(PRIORITY_MULTIPATH), "lookup", str(MULTIPATH_TABLE))
+        self.started = time.time()
+        self.sample()
+        self.apply()
+        self.save()
+        return True
+
+    def teardown(self):
+        # Remove the rules and tables; the links stay up
+        self._delete_rules(PRIORITY_MAIN, PRIORITY_SOURCE, PRIORITY_MULTIPATH, *self._policy_priorities())
+        for table in (MULTIPATH_TABLE, *LINK_TABLES.values()):
+            self.ip("route", "flush", "table", str(table))
+        if self.hash_policy is not None:
+            executor.run_command(["sudo", "sysctl", "-q", f"{HASH_POLICY}={self.hash_policy}"], quiet=True)
+        self.applied = None
+        self.save()
+        self.report("Multipath stopped")
+
+    # Rules and routes
+
+    def _install_links(self):
+        # Link tables, source rules and policy rules
+        self._delete_rules(PRIORITY_SOURCE, *self._policy_priorities())
+        for kind, link in self.links.items():
+            table = str(LINK_TABLES[kind])
+            self.ip("route", "flush", "table", table)
+            if link.address:
+                self.ip("route", "replace", "default", *link.nexthop(), "table", table)
+                self.ip("rule", "add", "priority", str(PRIORITY_SOURCE), "from", link.address, "lookup", table)
+        for priority, (kind, value, target) in zip(self._policy_priorities(), self.policies):
+            if self.links[target].usable():
+                for selector in rule_selectors(kind, value):
+                    self.ip("rule", "add", "priority", str(priority), *selector, "lookup", str(LINK_TABLES[target]))
+
+    def _install_route(self):
+        usable = [link for link in self.links.values() if link.usable()]
+        table = str(MULTIPATH_TABLE)
+        if not usable:
+            self.ip("route", "flush", "table", table)
+        elif len(usable) == 1:
+            self.ip("route", "replace", "default", *usable[0].nexthop(), "table", table)
+        else:
+            nexthops = []
+            for link in usable:
+                nexthops += ["nexthop", *link.nexthop(), "weight", str(link.weight)]
+            self.ip("route", "replace", "default", "table", table, *nexthops)
+
+    def apply(self):
+        # Update what changed since the last call; True when anything was
+        links = {kind: (link.interface, link.address, link.gateway, link.usable()) for kind, link in self.links.items()}
+        weights = {kind: link.weight for kind, link in self.links.items()}
+        if self.applied is None or links != self.applied[0]:
+            self._install_links()
+            self._install_route()
+        elif any(abs(weight - self.applied[1][kind]) > WEIGHT_HYSTERESIS * self.applied[1][kind]
+                 for kind, weight in weights.items() if self.links[kind].usable()):
+            self._install_route()
+        else:
+            return False
+        self.applied = (links, weights)
+        self.report("Multipath: " + ", ".join(
+            f"{kind} on {link.interface} weight {link.weight}" if link.usable() else f"{kind} unused"
+            for kind, link in self.links.items()))
+        return True
+
+    # Measurement
+
+    def sample(self, counters=None):
+        # Count the bytes of each link since the last sample and update the weights
+        counters = usage_meter.read_counters() if counters is None else counters
+        now = time.monotonic()
+        elapsed = now - self.sampled if self.sampled is not None else None
+        self.sampled = now
+        for link in self.links.values():
+            current = counters.get(link.interface)
+            if current is not None and link.counters is not None and elapsed:
+                delta = sum(usage_meter.counter_delta(before, after) for before, after in zip(link.counters, current))
+                link.bytes += delta
+                link.rate = max(link.rate * DECAY ** elapsed, delta / elapsed)
+            link.counters = current
+        mobile = self.links["mobile"]
+        if self.cap is not None and not mobile.capped and mobile.bytes >= self.cap:
+            mobile.capped = True
+            self.report(f"4G cap of {usage_meter.format_bytes(self.cap)} reached; new connections use WiFi only")
+        fastest = max(max(link.rate, MIN_RATE) for link in self.links.values())
+        for link in self.links.values():
+            link.weight = max(MIN_WEIGHT, round(MAX_WEIGHT * max(link.rate, MIN_RATE) / fastest))
+
+    def state(self):
+        return {
+            "active": self.applied is not None,
+            "started": self.started,
+            "cap": self.cap,
+            "links": {kind: {"interface": link.interface, "bytes": link.bytes, "rate": round(link.rate),
+                             "weight": link.weight if link.usable() else 0, "capped": link.capped}
+                      for kind, link in self.links.items()},
+        }
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+            tmp_path = f"{STATE_PATH}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state(), f)
+            os.replace(tmp_path, STATE_PATH)
+        except OSError as e:
+            print(f"Could not save the multipath state: {e}")
+
+    def step(self):
+        # Refresh first, so the counters are read from the link's current interface
+        self._refresh()
+        self.sample()
+        self.apply()
+        self.save()
+
+    def run(self):
+        # Set up as one network operation (see operations.py), then follow the links until stopped
+        if not operations.run("multipath on", self.setup, report=self.report):
+            return False
+        try:
+            while not self.stopped.wait(self.interval):
+                self.step()
+        finally:
+            self.teardown()
+        return True
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        # Started with start(): returns once the rules are removed
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+if __name__ == "__main__":
+    import signal
+
+    parser = argparse.ArgumentParser(description="Use WiFi and 4G at the same time")
+    parser.add_argument("--cap", type=float, metavar="MB", help="4G data after which it gets no new connections")
+    parser.add_argument("--policy", action="append", default=[], metavar="SELECTOR=LINK",
+                        help="pin traffic to a link: uid:UID, port:PORT or to:PREFIX, then =wifi or =mobile")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="seconds between weight updates")
+    parser.add_argument("--wifi", metavar="IFACE", help="use IFACE as the WiFi link as it is (for testing)")
+    parser.add_argument("--mobile", metavar="IFACE", help="use IFACE as the 4G link as it is (for testing)")
+    parser.add_argument("--status", action="store_true", help="show the per-link split and exit")
+    args = parser.parse_args()
+    if args.status:
+        state = read_state()
+        print(f"Multipath: {'on' if state.get('active') else 'off'}")
+        if state.get("links"):
+            print(f"Split: {describe(state)}")
+        sys.exit(0)
+    if args.interval <= 0:
+        parser.error("--interval must be positive")
+    try:
+        for policy in args.policy:
+            parse_policy(policy)
+    except ValueError as e:
+        parser.error(str(e))
+    from network_toggle_cli import NetworkToggleCLI
+
+    engine = MultipathEngine(NetworkToggleCLI(use_daemon=False), args.cap * 1024 ** 2 if args.cap else None,
+                             args.policy, args.interval, {"wifi": args.wifi, "mobile": args.mobile})
+    # "systemctl stop" removes the rules like Ctrl+C does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        ok = engine.run()
+    except KeyboardInterrupt:
+        ok = True
+    sys.exit(0 if ok else 1)
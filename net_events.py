@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# Event subscriptions for status updates.
+# Listens to rtnetlink link/address/route notifications and to the
+# NetworkManager/ModemManager PropertiesChanged and StateChanged signals, and
+# calls back once per burst of events (after a short quiet period) instead of
+# having the front ends poll. Both listeners block in the kernel while idle,
+# so an idle GUI costs no CPU and no wakeups.
+import os
+import select
+import socket
+import threading
+
+import net_status
+
+try:
+    import dbus
+    from dbus.mainloop.glib import DBusGMainLoop
+    from gi.repository import GLib
+except ImportError:
+    dbus = None
+
+# rtnetlink multicast groups (linux/rtnetlink.h)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_DELADDR = 21
+RTM_DELROUTE = 25
+
+NETLINK_SOURCES = {
+    RTM_NEWLINK: "link",
+    RTM_DELLINK: "link",
+    net_status.RTM_NEWADDR: "address",
+    RTM_DELADDR: "address",
+    net_status.RTM_NEWROUTE: "route",
+    RTM_DELROUTE: "route",
+}
+
+NM = "org.freedesktop.NetworkManager"
+MM = "org.freedesktop.ModemManager1"
+
+# Interfaces whose PropertiesChanged signals can change the status. Access points
+# (signal strength during every scan) and the other objects are left out, so
+# they do not wake the front ends.
+PROPERTY_INTERFACES = {
+    NM: (NM, f"{NM}.Device", f"{NM}.Connection.Active"),
+    MM: (f"{MM}.Modem",),
+}
+# Modem properties that change on their own all the time; the status does not show them
+IGNORED_PROPERTIES = {"SignalQuality", "AccessTechnologies"}
+
+
+class NetworkEventMonitor:
+    def __init__(self, callback, debounce=0.2):
+        # callback(sources) is called from a background thread with the set of
+        # event sources ("link", "address", "route", "networkmanager",
+        # "modemmanager") seen during the burst
+        self.callback = callback
+        self.debounce = debounce
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.timer = None
+        self.netlink_socket = None
+        # Pipe whose write end wakes the netlink thread on stop()
+        self.wakeup = None
+        self.bus = None
+        self.mainloop = None
+        self.threads = []
+        self.sources = []
+
+    @property
+    def active(self):
+        return bool(self.sources)
+
+    def start(self):
+        # Start every listener that is available; returns True if at least one is running
+        if self._start_netlink():
+            self.sources.append("netlink")
+        if self._start_dbus():
+            self.sources.append("dbus")
+        return self.active
+
+    def stop(self):
+        # Closing the socket would not wake a thread blocked on it, the pipe does
+        if self.wakeup is not None:
+            os.write(self.wakeup[1], b"\0")
+        if self.mainloop is not None:
+            self.mainloop.quit()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.netlink_socket is not None:
+            self.netlink_socket.close()
+            self.netlink_socket = None
+            for fd in self.wakeup:
+                os.close(fd)
+            self.wakeup = None
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
+        self.mainloop = None
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        self.sources = []
+
+    def notify(self, source):
+        # Coalesce bursts: the callback fires once, debounce seconds after the
+        # first event of a burst, with every source seen in the meantime
+        with self.lock:
+            self.pending.add(source)
+            if self.timer is None:
+                self.timer = threading.Timer(self.debounce, self._flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _flush(self):
+        with self.lock:
+            sources = self.pending
+            self.pending = set()
+            self.timer = None
+        if sources:
+            self.callback(sources)
+
+    # rtnetlink
+
+    def _start_netlink(self):
+        groups = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR | RTMGRP_IPV4_ROUTE
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, groups))
+        except (OSError, AttributeError):
+            return False
+        self.netlink_socket = sock
+        self.wakeup = os.pipe()
+        self._thread(self._netlink_loop, sock, self.wakeup[0])
+        return True
+
+    def _thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _netlink_loop(self, sock, wakeup):
+        while True:
+            try:
+                ready, _, _ = select.select([sock, wakeup], [], [])
+                if wakeup in ready:
+                    return
+                data = sock.recv(65536)
+            except OSError:
+                return
+            offset = 0
+            while offset + net_status.NLMSGHDR.size <= len(data):
+                length, kind, _, _, _ = net_status.NLMSGHDR.unpack_from(data, offset)
+                if length < net_status.NLMSGHDR.size:
+                    break
+                if kind in NETLINK_SOURCES:
+                    self.notify(NETLINK_SOURCES[kind])
+                offset += (length + 3) & ~3
+
+    # D-Bus signals
+
+    def _start_dbus(self):
+        if dbus is None:
+            return False
+        try:
+            bus = dbus.SystemBus(private=True, mainloop=DBusGMainLoop())
+            for service, source in ((NM, "networkmanager"), (MM, "modemmanager")):
+                def handler(*args, source=source):
+                    self.notify(source)
+
+                def properties_changed(interface, changed, invalidated, source=source):
+                    if (set(changed) | set(invalidated)) - IGNORED_PROPERTIES:
+                        self.notify(source)
+
+                for interface in PROPERTY_INTERFACES[service]:
+                    bus.add_signal_receiver(properties_changed, signal_name="PropertiesChanged",
+                                            dbus_interface="org.freedesktop.DBus.Properties", bus_name=service,
+                                            arg0=interface)
+                bus.add_signal_receiver(handler, signal_name="StateChanged", bus_name=service)
+                bus.add_signal_receiver(handler, signal_name="InterfacesAdded",
+                                        dbus_interface="org.freedesktop.DBus.ObjectManager", bus_name=service)
+                bus.add_signal_receiver(handler, signal_name="InterfacesRemoved",
+                                        dbus_interface="org.freedesktop.DBus.ObjectManager", bus_name=service)
+        except dbus.exceptions.DBusException:
+            return False
+        self.bus = bus
+        self.mainloop = GLib.MainLoop()
+        self._thread(self.mainloop.run)
+        return True
+
+
+if __name__ == "__main__":
+    import time
+    monitor = NetworkEventMonitor(lambda sources: print(f"{time.strftime('%H:%M:%S')} changed: {', '.join(sorted(sources))}"))
+    if not monitor.start():
+        print("No event source available")
+    else:
+        print(f"Listening on: {', '.join(monitor.sources)} (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            monitor.stop()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# Fork-free network status snapshot.
+# Interface state, addresses and the default route come straight from the kernel
+# over an rtnetlink socket, and the rest from /sys/class/net, /sys/class/rfkill
+# and /sys/bus/usb. The CLI tools are only used as a fallback for facts the
+# kernel cannot give us (e.g. the WiFi radio state when there is no rfkill switch).
+import glob
+import ipaddress
+import os
+import socket
+import struct
+
+# rtnetlink constants (linux/netlink.h, linux/rtnetlink.h)
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_GETROUTE = 26
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+RT_TABLE_MAIN = 254
+RT_SCOPE_HOST = 254
+
+NLMSGHDR = struct.Struct("=IHHII")
+IFADDRMSG = struct.Struct("=BBBBI")
+RTMSG = struct.Struct("=BBBBBBBBI")
+RTATTR = struct.Struct("=HH")
+
+# USB vendor IDs of the 4G extension (SIMCom and the Qualcomm chipset inside it)
+MODEM_USB_VENDORS = ("1e0e", "05c6")
+
+# Interface name prefixes used by the 4G module
+MOBILE_PREFIXES = ("wwan", "ppp", "usb")
+
+
+def _parse_attrs(data, offset):
+    attrs = {}
+    while offset + RTATTR.size <= len(data):
+        length, kind = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[kind] = data[offset + RTATTR.size:offset + length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+def _netlink_dump(msg_type, payload):
+    # Send a dump request and yield (type, body) for every message in the reply
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    try:
+        sock.bind((0, 0))
+        header = NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        sock.send(header + payload)
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + NLMSGHDR.size <= len(data):
+                length, kind, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+                if kind == NLMSG_DONE:
+                    return
+                if kind == NLMSG_ERROR:
+                    raise OSError("rtnetlink dump failed")
+                yield kind, data[offset + NLMSGHDR.size:offset + length]
+                offset += (length + 3) & ~3
+    finally:
+        sock.close()
+
+
+def read_addresses():
+    # Returns {ifindex: {"ipv4": [...], "ipv6": [...]}}
+    addresses = {}
+    for kind, body in _netlink_dump(RTM_GETADDR, IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)):
+        if kind != RTM_NEWADDR:
+            continue
+        family, prefixlen, _, scope, index = IFADDRMSG.unpack_from(body)
+        attrs = _parse_attrs(body, IFADDRMSG.size)
+        raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+        if raw is None or scope == RT_SCOPE_HOST:
+            continue
+        entry = addresses.setdefault(index, {"ipv4": [], "ipv6": []})
+        if family == socket.AF_INET:
+            entry["ipv4"].append(socket.inet_ntop(socket.AF_INET, raw))
+        elif family == socket.AF_INET6:
+            address = socket.inet_ntop(socket.AF_INET6, raw)
+            if not ipaddress.IPv6Address(address).is_link_local:
+                entry["ipv6"].append(address)
+    return addresses
+
+
+def read_default_routes():
+    # Returns the IPv4 default routes of the main table, lowest metric first
+    routes = []
+    for kind, body in _netlink_dump(RTM_GETROUTE, RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)):
+        if kind != RTM_NEWROUTE:
+            continue
+        _, dst_len, _, _, table, _, _, _, _ = RTMSG.unpack_from(body)
+        attrs = _parse_attrs(body, RTMSG.size)
+        if RTA_TABLE in attrs:
+            table = struct.unpack("=I", attrs[RTA_TABLE])[0]
+        if dst_len != 0 or table != RT_TABLE_MAIN or RTA_OIF not in attrs:
+            continue
+        routes.append({
+            "ifindex": struct.unpack("=I", attrs[RTA_OIF])[0],
+            "gateway": socket.inet_ntop(socket.AF_INET, attrs[RTA_GATEWAY]) if RTA_GATEWAY in attrs else None,
+            "metric": struct.unpack("=I", attrs[RTA_PRIORITY])[0] if RTA_PRIORITY in attrs else 0,
+        })
+    routes.sort(key=lambda route: route["metric"])
+    return routes
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def interface_kind(name):
+    if name == "lo":
+        return "loopback"
+    if os.path.exists(f"/sys/class/net/{name}/wireless") or os.path.exists(f"/sys/class/net/{name}/phy80211"):
+        return "wifi"
+    if name.startswith(MOBILE_PREFIXES):
+        return "mobile"
+    return "ethernet"
+
+
+def read_interfaces():
+    # Returns {name: {...}} for every interface in /sys/class/net
+    interfaces = {}
+    for path in glob.glob("/sys/class/net/*"):
+        name = os.path.basename(path)
+        index = _read(f"{path}/ifindex")
+        if index is None:
+            continue
+        interfaces[name] = {
+            "index": int(index),
+            "kind": interface_kind(name),
+            "operstate": _read(f"{path}/operstate", "unknown"),
+            "carrier": _read(f"{path}/carrier") == "1",
+            "ipv4": [],
+            "ipv6": [],
+        }
+    return interfaces
+
+
+def read_rfkill():
+    # Returns {type: {"soft": bool, "hard": bool}} from /sys/class/rfkill
+    switches = {}
+    for path in glob.glob("/sys/class/rfkill/rfkill*"):
+        kind = _read(f"{path}/type")
+        if kind is None:
+            continue
+        state = switches.setdefault(kind, {"soft": False, "hard": False})
+        state["soft"] = state["soft"] or _read(f"{path}/soft") == "1"
+        state["hard"] = state["hard"] or _read(f"{path}/hard") == "1"
+    return switches
+
+
+def modem_present(run_command=None, backend=None):
+    # A module in standby (see standby.py) is powered but counts as off. Imported
+    # here so that this module depends on nothing else of the toggle.
+    import standby
+
+    if standby.active():
+        return False
+    if not os.path.isdir("/sys/bus/usb/devices"):
+        if backend:
+            return backend.modem_detected()
+        if run_command:
+            output = run_command(["mmcli", "-L"])
+            return bool(output) and ("SIMCOM_SIM7600G-H" in output or "QUALCOMM" in output)
+    for path in glob.glob("/sys/bus/usb/devices/*/idVendor"):
+        if _read(path) in MODEM_USB_VENDORS:
+            return True
+    return False
+
+
+def read_links():
+    # Interfaces from /sys/class/net plus the IPv4 default route
+    interfaces = read_interfaces()
+    by_index = {info["index"]: name for name, info in interfaces.items()}
+    try:
+        routes = read_default_routes()
+    except OSError:
+        routes = []
+    default_route = None
+    for route in routes:
+        if route["ifindex"] in by_index:
+            default_route = dict(route, interface=by_index[route["ifindex"]])
+            break
+    return {"interfaces": interfaces, "default_route": default_route}
+
+
+def read_wifi(run_command=None, backend=None):
+    # WiFi radio state from rfkill; backend (a NetworkBackend) or run_command
+    # are only used when there is no rfkill switch for the WiFi chip
+    rfkill = read_rfkill()
+    if "wlan" in rfkill:
+        enabled = not rfkill["wlan"]["soft"] and not rfkill["wlan"]["hard"]
+    elif backend:
+        enabled = backend.wifi_enabled()
+    elif run_command:
+        enabled = run_command(["nmcli", "radio", "wifi"]) == "enabled"
+    else:
+        enabled = any(info["kind"] == "wifi" and info["operstate"] == "up" for info in read_interfaces().values())
+    return {"enabled": enabled, "rfkill": rfkill}
+
+
+def compose(links, addresses, wifi, modem):
+    # Build the status dictionary from the separately read parts
+    interfaces = {name: dict(info) for name, info in links["interfaces"].items()}
+    by_index = {info["index"]: name for name, info in interfaces.items()}
+    for index, entry in addresses.items():
+        if index in by_index:
+            interfaces[by_index[index]].update(entry)
+    default_route = links["default_route"]
+    if default_route and default_route["interface"] not in interfaces:
+        default_route = None
+
+    current_connection = "None"
+    if default_route:
+        kind = interfaces[default_route["interface"]]["kind"]
+        if kind == "wifi":
+            current_connection = "WiFi"
+        elif kind == "mobile":
+            current_connection = "Mobile Data"
+        else:
+            current_connection = "Ethernet"
+
+    # Prefer the address of the interface carrying the default route
+    current_ip = "Not connected"
+    names = ([default_route["interface"]] if default_route else []) + sorted(interfaces)
+    for name in names:
+        ipv4 = [ip for ip in interfaces[name]["ipv4"] if not ip.startswith("127.")]
+        if ipv4:
+            current_ip = ipv4[0]
+            break
+
+    return {
+        "interfaces": interfaces,
+        "default_route": default_route,
+        "rfkill": wifi["rfkill"],
+        "wifi_enabled": wifi["enabled"],
+        "modem_present": modem,
+        "current_connection": current_connection,
+        "current_ip": current_ip,
+    }
+
+
+def read_addresses_or_empty():
+    try:
+        return read_addresses()
+    except OSError:
+        return {}
+
+
+def snapshot(run_command=None, backend=None):
+    # Collect the full status. backend (a NetworkBackend) or run_command are
+    # only used for fallbacks.
+    return compose(read_links(), read_addresses_or_empty(), read_wifi(run_command, backend),
+                   modem_present(run_command, backend))
+
+
+if __name__ == "__main__":
+    import json
+    print(json.dumps(snapshot(), indent=2))
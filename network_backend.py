@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# Network backend shared by the CLI and the GUIs.
+# Talks to NetworkManager and ModemManager over one long-lived system D-Bus
+# connection, with object paths for the modem, devices and connection profiles
+# cached between calls. When D-Bus is not available (python3-dbus missing, the
+# bus is down, or polkit refuses a call) every operation falls back to the
+# nmcli/mmcli commands run through run_command.
+import re
+
+try:
+    import dbus
+except ImportError:
+    dbus = None
+
+NM = "org.freedesktop.NetworkManager"
+NM_PATH = "/org/freedesktop/NetworkManager"
+NM_SETTINGS_PATH = "/org/freedesktop/NetworkManager/Settings"
+MM = "org.freedesktop.ModemManager1"
+MM_PATH = "/org/freedesktop/ModemManager1"
+MM_MODEM = "org.freedesktop.ModemManager1.Modem"
+PROPERTIES = "org.freedesktop.DBus.Properties"
+OBJECT_MANAGER = "org.freedesktop.DBus.ObjectManager"
+
+NM_ACTIVE_CONNECTION_STATE_ACTIVATED = 2
+NM_WIRELESS = "org.freedesktop.NetworkManager.Device.Wireless"
+NM_ACCESS_POINT = "org.freedesktop.NetworkManager.AccessPoint"
+MM_MODEM_STATE_CONNECTED = 11
+MM_BEARER_IP_FAMILY_IPV4 = 1
+# Bearer IP families by the ip_type names of apn_db.py
+MM_BEARER_IP_FAMILIES = {"ipv4": 1, "ipv6": 2, "ipv4v6": 4}
+MM_SIM = "org.freedesktop.ModemManager1.Sim"
+# Signal quality keys reported by ModemManager, and the names used here
+MM_SIGNAL_KEYS = {"rssi": "rssi", "rsrp": "rsrp", "rsrq": "rsrq", "snr": "sinr", "s/n": "sinr"}
+
+# Model strings reported for the 4G extension
+MODEM_MODELS = ("SIMCOM_SIM7600G-H", "QUALCOMM")
+
+# NetworkManager connection types, as nmcli prints them
+CONNECTION_TYPES = {"802-11-wireless": "wifi", "gsm": "gsm", "802-3-ethernet": "ethernet"}
+
+
+class DBusClient:
+    def __init__(self):
+        self.bus = dbus.SystemBus()
+        # Cached object paths: "modem", "device:<iface>", "profile:<name>"
+        self.paths = {}
+
+    def _object(self, service, path):
+        return self.bus.get_object(service, path)
+
+    def get(self, service, path, interface, name):
+        return self._object(service, path).Get(interface, name, dbus_interface=PROPERTIES)
+
+    def get_all(self, service, path, interface):
+        return self._object(service, path).GetAll(interface, dbus_interface=PROPERTIES)
+
+    def set(self, service, path, interface, name, value):
+        self._object(service, path).Set(interface, name, value, dbus_interface=PROPERTIES)
+
+    def call(self, service, path, interface, method, *args):
+        return getattr(self._object(service, path), method)(*args, dbus_interface=interface)
+
+    def cached(self, key, lookup):
+        # Return a cached object path, looking it up on first use
+        if key not in self.paths:
+            path = lookup()
+            if path is None:
+                return None
+            self.paths[key] = path
+        return self.paths[key]
+
+    def forget(self, key=None):
+        if key is None:
+            self.paths.clear()
+        else:
+            self.paths.pop(key, None)
+
+    # NetworkManager
+
+    def device_path(self, iface):
+        return self.cached(f"device:{iface}", lambda: self.call(NM, NM_PATH, NM, "GetDeviceByIpIface", iface))
+
+    def profile_path(self, name):
+        def lookup():
+            for path in self.call(NM, NM_SETTINGS_PATH, f"{NM}.Settings", "ListConnections"):
+                settings = self.call(NM, path, f"{NM}.Settings.Connection", "GetSettings")
+                if settings["connection"]["id"] == name:
+                    return path
+            return None
+        return self.cached(f"profile:{name}", lookup)
+
+    def active_connections(self):
+        connections = []
+        for path in self.get(NM, NM_PATH, NM, "ActiveConnections"):
+            props = self.get_all(NM, path, f"{NM}.Connection.Active")
+            devices = [str(self.get(NM, device, f"{NM}.Device", "Interface")) for device in props["Devices"]]
+            connections.append({
+                "path": path,
+                "name": str(props["Id"]),
+                "type": CONNECTION_TYPES.get(str(props["Type"]), str(props["Type"])),
+                "activated": props["State"] == NM_ACTIVE_CONNECTION_STATE_ACTIVATED,
+                "device": devices[0] if devices else "",
+                "ip4config": props.get("Ip4Config", "/"),
+            })
+        return connections
+
+    # ModemManager
+
+    def modem_path(self):
+        def lookup():
+            objects = self.call(MM, MM_PATH, OBJECT_MANAGER, "GetManagedObjects")
+            for path, interfaces in objects.items():
+                if MM_MODEM in interfaces:
+                    return path
+            return None
+        return self.cached("modem", lookup)
+
+    def modem(self, name):
+        path = self.modem_path()
+        if path is None:
+            return None
+        return self.get(MM, path, MM_MODEM, name)
+
+
+def connect():
+    # Open the shared D-Bus client, or return None if D-Bus is unavailable
+    if dbus is None:
+        return None
+    try:
+        return DBusClient()
+    except dbus.exceptions.DBusException:
+        return None
+
+
+class NetworkBackend:
+    def __init__(self, run_command):
+        self.run_command = run_command
+        self.client = connect()
+
+    def _dbus(self, operation):
+        # Run a D-Bus operation; returns (True, result) or (False, None) so the
+        # caller can fall back to the command-line tools.
+        if self.client is None:
+            return False, None
+        for attempt in range(2):
+            try:
+                return True, operation(self.client)
+            except dbus.exceptions.DBusException as e:
+                # A cached path may have gone away (modem re-enumerated,
+                # profile deleted); drop the cache and retry once.
+                if attempt == 0 and "UnknownObject" in (e.get_dbus_name() or ""):
+                    self.client.forget()
+                    continue
+                return False, None
+            except (KeyError, TypeError):
+                return False, None
+        return False, None
+
+    # WiFi radio
+
+    def wifi_enabled(self):
+        ok, result = self._dbus(lambda c: bool(c.get(NM, NM_PATH, NM, "WirelessEnabled")))
+        if ok:
+            return result
+        return self.run_command(["nmcli", "radio", "wifi"]) == "enabled"
+
+    def set_wifi_enabled(self, enabled):
+        ok, _ = self._dbus(lambda c: c.set(NM, NM_PATH, NM, "WirelessEnabled", dbus.Boolean(enabled)))
+        if not ok:
+            self.run_command(["nmcli", "radio", "wifi", "on" if enabled else "off"])
+
+    # WiFi scanning and association
+
+    def wifi_request_scan(self, iface, ssid=None):
+        # Start a scan; with ssid, a directed probe for that network. NetworkManager
+        # rejects scans while one is running, which is fine: its results will do.
+        def request(c):
+            options = {"ssids": dbus.Array([dbus.ByteArray(ssid.encode())], signature="ay")} if ssid else {}
+            c.call(NM, c.device_path(iface), NM_WIRELESS, "RequestScan", dbus.Dictionary(options, signature="sv"))
+        ok, _ = self._dbus(request)
+        if not ok:
+            self.run_command(["nmcli", "device", "wifi", "rescan", "ifname", iface] + (["ssid", ssid] if ssid else []))
+
+    def wifi_access_points(self, iface):
+        # Networks NetworkManager currently knows about, without scanning:
+        # a list of {"ssid", "bssid", "frequency" (MHz), "signal" (%), "in_use"}
+        def list_access_points(c):
+            device = c.device_path(iface)
+            active = c.get(NM, device, NM_WIRELESS, "ActiveAccessPoint")
+            access_points = []
+            for path in c.call(NM, device, NM_WIRELESS, "GetAccessPoints"):
+                props = c.get_all(NM, path, NM_ACCESS_POINT)
+                access_points.append({
+                    "ssid": bytes(props["Ssid"]).decode(errors="replace"),
+                    "bssid": str(props["HwAddress"]).upper(),
+                    "frequency": int(props["Frequency"]),
+                    "signal": int(props["Strength"]),
+                    "in_use": path == active,
+                })
+            return access_points
+        ok, result = self._dbus(list_access_points)
+        if ok:
+            return result
+        output = self.run_command(["nmcli", "-t", "-f", "IN-USE,SSID,BSSID,FREQ,SIGNAL", "device", "wifi", "list",
+                                   "ifname", iface, "--rescan", "no"])
+        access_points = []
+        for line in (output or "").split('\n'):
+            # Terse mode escapes the colons inside values
+            fields = [field.replace("\\:", ":") for field in re.split(r"(?<!\\):", line)]
+            if len(fields) == 5 and fields[4].isdigit():
+                in_use, ssid, bssid, frequency, signal = fields
+                access_points.append({
+                    "ssid": ssid,
+                    "bssid": bssid.upper(),
+                    "frequency": int(frequency.split()[0]),
+                    "signal": int(signal),
+                    "in_use": in_use.strip() == "*",
+                })
+        return access_points
+
+    def wifi_connect(self, name, iface, bssid=None):
+        # Activate the WiFi profile name on iface, on the access point bssid if given.
+        # Returns False when the activation could not even be started.
+        def activate(c):
+            device = c.device_path(iface)
+            specific = dbus.ObjectPath("/")
+            if bssid:
+                for path in c.call(NM, device, NM_WIRELESS, "GetAccessPoints"):
+                    if str(c.get(NM, path, NM_ACCESS_POINT, "HwAddress")).upper() == bssid.upper():
+                        specific = path
+                        break
+                else:
+                    return False
+            c.call(NM, NM_PATH, NM, "ActivateConnection", c.profile_path(name), device, specific)
+            return True
+        ok, result = self._dbus(activate)
+        if ok:
+            return result
+        command = ["nmcli", "connection", "up", name, "ifname", iface] + (["ap", bssid] if bssid else [])
+        return self.run_command(command) is not None
+
+    def wifi_autoconnect(self, iface):
+        # Let NetworkManager pick the best known network for iface
+        def activate(c):
+            c.call(NM, NM_PATH, NM, "ActivateConnection", dbus.ObjectPath("/"), c.device_path(iface), dbus.ObjectPath("/"))
+            return True
+        ok, result = self._dbus(activate)
+        if ok:
+            return result
+        return self.run_command(["nmcli", "device", "connect", iface]) is not None
+
+    # Connections
+
+    def active_connections(self):
+        # Returns a list of {"name", "type", "activated", "device"}
+        ok, result = self._dbus(lambda c: c.active_connections())
+        if ok:
+            return result
+        connections = []
+        output = self.run_command(["nmcli", "-t", "-f", "NAME,TYPE,STATE,DEVICE", "connection", "show", "--active"])
+        if output:
+            for line in output.split('\n'):
+                fields = line.rsplit(':', 3)
+                if len(fields) == 4:
+                    name, kind, state, device = fields
+                    connections.append({
+                        "name": name,
+                        "type": CONNECTION_TYPES.get(kind, kind),
+                        "activated": state == "activated",
+                        "device": device,
+                    })
+        return connections
+
+    def active_wifi_connections(self):
+        return [conn["name"] for conn in self.active_connections() if conn["type"] == "wifi"]
+
+    def profile_exists(self, name):
+        ok, result = self._dbus(lambda c: c.profile_path(name) is not None)
+        if ok:
+            return result
+        output = self.run_command(["nmcli", "-t", "-f", "NAME", "connection", "show"])
+        return bool(output) and name in output.split('\n')
+
+    def connection_up(self, name, on_line=None):
+        # on_line gets nmcli's progress output line by line (run_command must accept on_line)
+        def activate(c):
+            c.call(NM, NM_PATH, NM, "ActivateConnection", c.profile_path(name), dbus.ObjectPath("/"), dbus.ObjectPath("/"))
+        ok, _ = self._dbus(activate)
+        if not ok:
+            command = ["sudo", "nmcli", "connection", "up", name]
+            if on_line is None:
+                self.run_command(command)
+            else:
+                self.run_command(command, on_line=on_line)
+
+    def connection_down(self, name):
+        def deactivate(c):
+            for conn in c.active_connections():
+                if conn["name"] == name:
+                    c.call(NM, NM_PATH, NM, "DeactivateConnection", conn["path"])
+        ok, _ = self._dbus(deactivate)
+        if not ok:
+            self.run_command(["nmcli", "connection", "down", name])
+
+    def set_route_metric(self, iface, metric):
+        # Change the metric of the routes NetworkManager installs for iface.
+        # Only the applied connection is changed (the profile is not saved), so
+        # the next activation uses the profile's own metric again.
+        def reapply(c):
+            device = c.device_path(iface)
+            settings, version = c.call(NM, device, f"{NM}.Device", "GetAppliedConnection", dbus.UInt32(0))
+            for family in ("ipv4", "ipv6"):
+                if family in settings:
+                    # Deprecated duplicates of address-data/route-data
+                    settings[family].pop("addresses", None)
+                    settings[family].pop("routes", None)
+                    settings[family]["route-metric"] = dbus.Int64(metric)
+            c.call(NM, device, f"{NM}.Device", "Reapply", settings, version, dbus.UInt32(0))
+        ok, _ = self._dbus(reapply)
+        if not ok:
+            self.run_command(["sudo", "nmcli", "device", "modify", iface,
+                              "ipv4.route-metric", str(metric), "ipv6.route-metric", str(metric)])
+
+    def add_gsm_profile(self, name, port, apn, username="", password="", ip_type="ipv4v6"):
+        gsm = {"apn": apn}
+        if username and password:
+            gsm.update({"username": username, "password": password})
+        ipv4_method = "disabled" if ip_type == "ipv6" else "auto"
+        ipv6_method = "ignore" if ip_type == "ipv4" else "auto"
+        settings = {
+            "connection": {"id": name, "type": "gsm", "interface-name": port},
+            "gsm": gsm,
+            "ipv4": {"method": ipv4_method},
+            "ipv6": {"method": ipv6_method},
+        }
+
+        def add(c):
+            c.paths[f"profile:{name}"] = c.call(NM, NM_SETTINGS_PATH, f"{NM}.Settings", "AddConnection", settings)
+        ok, _ = self._dbus(add)
+        if not ok:
+            cmd = ["sudo", "nmcli", "connection", "add", "type", "gsm", "ifname", port, "con-name", name, "apn", apn]
+            if username and password:
+                cmd += ["gsm.username", username, "gsm.password", password]
+            cmd += ["ipv4.method", ipv4_method, "ipv6.method", ipv6_method]
+            self.run_command(cmd)
+
+    def profile_apn(self, name):
+        # APN of a gsm profile, or None
+        def apn(c):
+            path = c.profile_path(name)
+            if path is None:
+                return None
+            settings = c.call(NM, path, f"{NM}.Settings.Connection", "GetSettings")
+            return str(settings.get("gsm", {}).get("apn", "")) or None
+        ok, result = self._dbus(apn)
+        if ok:
+            return result
+        return self.run_command(["nmcli", "-g", "gsm.apn", "connection", "show", name]) or None
+
+    def delete_profile(self, name):
+        def delete(c):
+            path = c.profile_path(name)
+            if path is not None:
+                c.call(NM, path, f"{NM}.Settings.Connection", "Delete")
+                c.forget(f"profile:{name}")
+        ok, _ = self._dbus(delete)
+        if not ok:
+            self.run_command(["sudo", "nmcli", "connection", "delete", name])
+
+    def connection_ip(self, name):
+        def address(c):
+            for conn in c.active_connections():
+                if conn["name"] == name and conn["ip4config"] != "/":
+                    data = c.get(NM, conn["ip4config"], f"{NM}.IP4Config", "AddressData")
+                    if data:
+                        return f"{data[0]['address']}/{data[0]['prefix']}"
+            return None
+        ok, result = self._dbus(address)
+        if ok:
+            return result
+        return self.run_command(["nmcli", "-g", "IP4.ADDRESS", "connection", "show", name]) or None
+
+    # Modem
+
+    def modem_detected(self):
+        def detected(c):
+            if c.modem_path() is None:
+                return False
+            description = f"{c.modem('Manufacturer')} {c.modem('Model')}".upper()
+            return any(model in description for model in MODEM_MODELS)
+        ok, result = self._dbus(detected)
+        if ok:
+            return result
+        output = self.run_command(["mmcli", "-L"])
+        return bool(output) and any(model in output for model in MODEM_MODELS)
+
+    def modem_index(self):
+        ok, result = self._dbus(lambda c: c.modem_path())
+        if ok:
+            return str(result).split('/')[-1] if result else None
+        output = self.run_command(["mmcli", "-L"])
+        match = re.search(r'/Modem/(\d+)', output or "")
+        return match.group(1) if match else None
+
+    def modem_primary_port(self):
+        ok, result = self._dbus(lambda c: c.modem("PrimaryPort"))
+        if ok:
+            return str(result) if result else None
+        output = self.run_command('mmcli -m any | grep "primary port"', shell=True)
+        match = re.search(r'(ttyUSB\d+|cdc-wdm\d+)', output or "")
+        return match.group(1) if match else None
+
+    def modem_connected(self):
+        ok, result = self._dbus(lambda c: c.modem("State") == MM_MODEM_STATE_CONNECTED)
+        if ok:
+            return bool(result)
+        index = self.modem_index()
+        if index is None:
+            return False
+        output = self.run_command(["mmcli", "-m", index])
+        return bool(output) and re.search(r'\bstate:\s*(\x1b\[[0-9;]*m)?connected', output) is not None
+
+    def modem_enable(self, enabled):
+        # Returns False when the modem could not be enabled/disabled
+        ok, _ = self._dbus(lambda c: c.call(MM, c.modem_path(), MM_MODEM, "Enable", dbus.Boolean(enabled)))
+        if ok:
+            return True
+        index = self.modem_index()
+        if index is None:
+            return False
+        return self.run_command(["mmcli", "-m", index, "--enable" if enabled else "--disable"]) is not None
+
+    def modem_set_initial_bearer(self, apn, ip_type="ipv4"):
+        def configure(c):
+            settings = {"apn": apn, "ip-type": dbus.UInt32(MM_BEARER_IP_FAMILIES.get(ip_type, MM_BEARER_IP_FAMILY_IPV4))}
+            c.call(MM, c.modem_path(), f"{MM_MODEM}.Modem3gpp", "SetInitialEpsBearerSettings", settings)
+        ok, _ = self._dbus(configure)
+        if not ok:
+            index = self.modem_index()
+            if index is not None:
+                self.run_command(["mmcli", "-m", index, f"--3gpp-set-initial-eps-bearer-settings=apn={apn},ip-type={ip_type}"])
+
+    def modem_simple_connect(self, apn, username="", password=""):
+        # Returns False when no bearer could be connected
+        settings = {"apn": apn}
+        if username and password:
+            settings.update({"user": username, "password": password})
+        ok, _ = self._dbus(lambda c: c.call(MM, c.modem_path(), f"{MM_MODEM}.Simple", "Connect", settings))
+        if ok:
+            return True
+        index = self.modem_index()
+        if index is None:
+            return False
+        return self.run_command(["mmcli", "-m", index, "--simple-connect=" + ",".join(f"{key}={value}" for key, value in settings.items())]) is not None
+
+    def modem_sim(self):
+        # {"imsi", "iccid", "spn", "gid1"} of the SIM as ModemManager read it, or
+        # None when ModemManager does not know the modem (AT commands then; see apn_db.py)
+        def read(c):
+            path = c.modem("Sim") if c.modem_path() else None
+            if not path or path == "/":
+                return None
+            props = c.get_all(MM, path, MM_SIM)
+            gid1 = bytes(props.get("Gid1", b"")).hex()
+            return {"imsi": str(props.get("Imsi", "")), "iccid": str(props.get("SimIdentifier", "")),
+                    "spn": str(props.get("OperatorName", "")), "gid1": gid1.rstrip("f")}
+        ok, result = self._dbus(read)
+        return result if ok else None
+
+    def modem_signal(self, rate):
+        # Extended signal quality of the serving cell as {"rssi": dBm, "rsrp": dBm,
+        # "rsrq": dB, "sinr": dB}; ModemManager refreshes it every rate seconds
+        def read(c):
+            path = c.modem_path()
+            if path is None:
+                return None
+            interface = f"{MM_MODEM}.Signal"
+            if c.get(MM, path, interface, "Rate") != rate:
+                c.call(MM, path, interface, "Setup", dbus.UInt32(rate))
+            for technology in ("Lte", "Umts", "Gsm"):
+                values = c.get(MM, path, interface, technology)
+                if values:
+                    return {MM_SIGNAL_KEYS[key]: float(value) for key, value in values.items() if key in MM_SIGNAL_KEYS}
+            return {}
+        ok, result = self._dbus(read)
+        if ok:
+            return result
+        index = self.modem_index()
+        if index is None:
+            return None
+        output = self.run_command(["mmcli", "-m", index, "--signal-get"]) or ""
+        match = re.search(r"refresh rate:\s*(\d+)", output)
+        if match is None or int(match.group(1)) != rate:
+            self.run_command(["mmcli", "-m", index, f"--signal-setup={rate}"])
+        values = {}
+        for key, value in re.findall(r"\b(rssi|rsrp|rsrq|s/n):\s*(-?[\d.]+)", output):
+            values.setdefault(MM_SIGNAL_KEYS[key], float(value))
+        return values
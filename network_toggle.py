@@ -1,17 +1,31 @@
 #!/usr/bin/env python3
 import tkinter as tk
 from tkinter import ttk, messagebox
-import subprocess
-import os
-import time
+import argparse
 import threading
-import re
+
+import executor
+import network_toggle_client
+import operations
+import probe_cache
+import signal_history
+import standby
+import tracing
+import usage_meter
+from bringup import MobileBringUp, WifiBringUp
+from network_backend import NetworkBackend
+from status_cache import StatusCache
+
+# Seconds between updates of the data usage and signal lines, while mobile
+# data is up and the window is shown; otherwise they are not updated at all
+USAGE_REFRESH = 2
+
 
 class NetworkToggle:
-    def __init__(self, root):
+    def __init__(self, root, quota=None):
         self.root = root
         self.root.title("uConsole Network Toggle")
-        self.root.geometry("400x300")
+        self.root.geometry("400x360")
         self.root.resizable(False, False)
         
         # Set dark theme colors
@@ -27,17 +41,42 @@ class NetworkToggle:
         self.is_4g_enabled = False
         self.is_wifi_enabled = False
         self.current_ip = tk.StringVar(value="Not connected")
+        self.usage_text = tk.StringVar(value="")
+        self.signal_text = tk.StringVar(value="")
         
-        # APN settings for Digi Spain
-        self.apn = "internet.digimobil.es"
+        # APN settings; None to use the SIM operator's (see apn_db.py)
+        self.apn = None
         self.username = ""  # Leave empty if not required
         self.password = ""  # Leave empty if not required
         
+        # Long-lived D-Bus connection to NetworkManager/ModemManager (falls back to nmcli/mmcli)
+        self.backend = NetworkBackend(self.run_command)
+        
+        # Model command, PID mode and ports found on earlier runs (see probe_cache.py)
+        self.probe_cache = probe_cache.ProbeCache()
+        
+        # Mobile data usage, used while the daemon is not running (see usage_meter.py)
+        self.usage_meter = usage_meter.UsageMeter(quota=quota, on_alert=self.quota_alert)
+        # Signal quality history, likewise (see signal_history.py)
+        self.signal_sampler = signal_history.SignalSampler(self.backend)
+        
         # Create UI
         self.create_widgets()
         
+        # Refresh the status on network events instead of after every action
+        self.last_status = None
+        self.busy = False
+        self.status_cache = StatusCache(self.run_command, self.backend,
+                                        on_change=lambda sources: self.check_status(quiet=True))
+        
         # Start status check
         self.check_status()
+        # The meters only run while mobile data is up and the window is shown
+        self.visible = True
+        self.meters_wake = threading.Event()
+        self.root.bind("<Map>", lambda event: self._set_visible(event, True), add="+")
+        self.root.bind("<Unmap>", lambda event: self._set_visible(event, False), add="+")
+        threading.Thread(target=self._meters_thread, daemon=True).start()
 
     def create_widgets(self):
         # Main frame
@@ -111,6 +150,22 @@ class NetworkToggle:
         )
         ip_label.pack(anchor=tk.W)
         
+        usage_label = tk.Label(
+            status_frame, 
+            textvariable=self.usage_text,
+            bg=self.bg_color,
+            fg=self.fg_color
+        )
+        usage_label.pack(anchor=tk.W, pady=(10, 0))
+        
+        signal_label = tk.Label(
+            status_frame, 
+            textvariable=self.signal_text,
+            bg=self.bg_color,
+            fg=self.fg_color
+        )
+        signal_label.pack(anchor=tk.W)
+        
         # Action buttons
         button_frame = tk.Frame(main_frame, bg=self.bg_color)
         button_frame.pack(fill=tk.X, pady=20)
@@ -130,7 +185,7 @@ class NetworkToggle:
         refresh_button = tk.Button(
             button_frame,
             text="Refresh Status",
-            command=self.check_status,
+            command=self.refresh_status,
             bg=self.bg_color,
             fg=self.fg_color,
             padx=10,
@@ -139,59 +194,41 @@ class NetworkToggle:
         )
         refresh_button.pack(side=tk.RIGHT)
 
-    def run_command(self, command, shell=False):
-        try:
-            if shell:
-                result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            else:
-                result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            return result.stdout.strip()
-        except subprocess.CalledProcessError as e:
-            print(f"Command failed: {e}")
-            print(f"Error output: {e.stderr}")
-            return None
+    def run_command(self, command, shell=False, on_line=None):
+        return executor.run_command(command, shell, on_line=on_line)
+
+    def refresh_status(self):
+        self.status_cache.invalidate()
+        self.check_status()
 
-    def check_status(self):
+    def check_status(self, quiet=False):
         # Run in a separate thread to avoid freezing the UI
-        threading.Thread(target=self._check_status_thread, daemon=True).start()
+        threading.Thread(target=self._check_status_thread, args=(quiet,), daemon=True).start()
 
-    def _check_status_thread(self):
-        self.status_text.set("Checking network status...")
-        self.toggle_button.config(state=tk.DISABLED)
-        
-        # Check WiFi status
-        wifi_output = self.run_command(["nmcli", "radio", "wifi"])
-        self.is_wifi_enabled = wifi_output == "enabled"
-        
-        # Check 4G status
-        modem_output = self.run_command(["mmcli", "-L"])
-        self.is_4g_enabled = "SIMCOM_SIM7600G-H" in modem_output or "QUALCOMM" in modem_output
+    def _check_status_thread(self, quiet=False):
+        # Ask the resident daemon for its in-memory status, or use the local cache
+        response = network_toggle_client.request("status")
+        if response is not None and response["ok"]:
+            status = response["status"]
+        else:
+            status = self.status_cache.status()
+        current = (status["wifi_enabled"], status["modem_present"], status["current_connection"], status["current_ip"])
         
-        # Check current connection and IP
-        connection_info = self.run_command(["nmcli", "-t", "-f", "TYPE,STATE,DEVICE", "connection", "show", "--active"])
+        # Event-driven refreshes only update the UI when something changed,
+        # and never while a toggle is showing its progress
+        if quiet and (self.busy or current == self.last_status):
+            return
+        self.last_status = current
         
-        current_connection = "None"
-        if connection_info:
-            for line in connection_info.split('\n'):
-                if "gsm:activated" in line:
-                    current_connection = "Mobile Data"
-                    break
-                elif "wifi:activated" in line:
-                    current_connection = "WiFi"
-                    break
+        if not quiet:
+            self.status_text.set("Checking network status...")
+            self.toggle_button.config(state=tk.DISABLED)
         
-        # Get IP address
-        ip_info = self.run_command("ip -4 addr show | grep -oP '(?<=inet\\s)\\d+(\\.\\d+){3}'", shell=True)
-        if ip_info:
-            ip_addresses = ip_info.split('\n')
-            # Filter out localhost
-            ip_addresses = [ip for ip in ip_addresses if not ip.startswith("127.")]
-            if ip_addresses:
-                self.current_ip.set(ip_addresses[0])
-            else:
-                self.current_ip.set("Not connected")
-        else:
-            self.current_ip.set("Not connected")
+        self.is_wifi_enabled = status["wifi_enabled"]
+        self.is_4g_enabled = status["modem_present"]
+        self.meters_wake.set()
+        current_connection = status["current_connection"]
+        self.current_ip.set(status["current_ip"])
         
         # Update status text
         if current_connection == "WiFi":
@@ -200,11 +237,46 @@ class NetworkToggle:
         elif current_connection == "Mobile Data":
             self.status_text.set("Connected to Mobile Data")
             self.connection_type.set("mobile")
+        elif current_connection == "Ethernet":
+            self.status_text.set("Connected to Ethernet")
         else:
             self.status_text.set("Not connected")
         
         self.toggle_button.config(state=tk.NORMAL)
 
+    def _set_visible(self, event, visible):
+        # <Map>/<Unmap> of the window itself, not of its widgets
+        if event.widget is self.root:
+            self.visible = visible
+            self.meters_wake.set()
+
+    def _meters_thread(self):
+        # Data usage and signal from the daemon, or from our own samplers while it is not
+        # running. Idle (no polling, no samplers) until mobile data is up and the window shown;
+        # status changes and mapping the window wake it.
+        while True:
+            active = self.is_4g_enabled and self.visible
+            response = network_toggle_client.request("status")
+            if response is not None and response["ok"] and "usage" in response["status"]:
+                usage = response["status"]["usage"]
+                signal = response["status"].get("signal", {})
+            else:
+                if active and self.usage_meter.thread is None:
+                    self.usage_meter.start()
+                    self.signal_sampler.start()
+                elif not active and self.usage_meter.thread is not None:
+                    self.usage_meter.stop()
+                    self.signal_sampler.stop()
+                usage = self.usage_meter.summary()
+                signal = self.signal_sampler.store.summary()
+            self.usage_text.set(f"Mobile data: {usage_meter.describe(usage)}")
+            self.signal_text.set(f"Signal: {signal_history.describe(signal)}" if signal else "")
+            self.meters_wake.wait(USAGE_REFRESH if active else None)
+            self.meters_wake.clear()
+
+    def quota_alert(self, message):
+        self.root.after(0, messagebox.showwarning, "Data usage", message)
+
     def on_connection_change(self):
         selected = self.connection_type.get()
         if selected == "wifi":
@@ -214,132 +286,93 @@ class NetworkToggle:
 
     def toggle_connection(self):
         # Run in a separate thread to avoid freezing the UI
-        threading.Thread(target=self._toggle_connection_thread, daemon=True).start()
+        threading.Thread(target=self._run_toggle, daemon=True).start()
+
+    def _run_toggle(self):
+        self.busy = True
+        try:
+            self._toggle_connection_thread()
+        finally:
+            self.busy = False
+            tracing.tracer.flush()
 
+    @tracing.traced("toggle")
     def _toggle_connection_thread(self):
         selected = self.connection_type.get()
         self.toggle_button.config(state=tk.DISABLED)
         
+        # Let the resident daemon do the work when it is running
+        enabled = self.is_wifi_enabled if selected == "wifi" else self.is_4g_enabled
+        self.status_text.set(f"{'Disabling' if enabled else 'Enabling'} {'WiFi' if selected == 'wifi' else 'Mobile Data'}...")
+        response = network_toggle_client.request(selected, state="off" if enabled else "on")
+        if response is not None:
+            if not response["ok"]:
+                messagebox.showerror("Error", response.get("error", "Operation failed"))
+            self.status_cache.invalidate_for(selected)
+            self.check_status()
+            return
+        
+        # A second click waits for the running toggle instead of starting another (see operations.py)
+        operations.run(f"{selected} {'off' if enabled else 'on'}", lambda: self._toggle_locally(selected),
+                       report=self.status_text.set)
+        
+        # Update status, re-reading only what the toggle affected
+        self.status_cache.invalidate_for(selected)
+        self.check_status()
+
+    def _toggle_locally(self, selected):
         if selected == "wifi":
             if self.is_wifi_enabled:
                 # Disable WiFi
                 self.status_text.set("Disabling WiFi...")
-                self.run_command(["nmcli", "radio", "wifi", "off"])
                 # Disable any active WiFi connection
-                wifi_connections = self.run_command(["nmcli", "-t", "-f", "NAME,TYPE", "connection", "show", "--active"])
-                if wifi_connections:
-                    for line in wifi_connections.split('\n'):
-                        if ":wifi" in line:
-                            conn_name = line.split(':')[0]
-                            self.run_command(["nmcli", "connection", "down", conn_name])
+                for conn_name in self.backend.active_wifi_connections():
+                    self.backend.connection_down(conn_name)
+                self.backend.set_wifi_enabled(False)
+                if self.backend.wifi_enabled():
+                    messagebox.showerror("Error", "Failed to disable WiFi.")
+                    return False
+                return True
             else:
-                # Enable WiFi
+                # Enable WiFi; the access point of the last connection is tried first (see bringup.py)
                 self.status_text.set("Enabling WiFi...")
-                self.run_command(["nmcli", "radio", "wifi", "on"])
-                # Try to connect to the last known WiFi
-                self.run_command(["nmcli", "device", "wifi", "connect"])
+                bringup = WifiBringUp(self, report=self.status_text.set)
+                if not bringup.run():
+                    messagebox.showerror("Error", bringup.error)
+                    return False
+                return True
         else:  # Mobile
             if self.is_4g_enabled:
                 # Disable 4G
                 self.status_text.set("Disabling Mobile Data...")
                 # Bring down the 4G connection if it exists
-                self.run_command(["nmcli", "connection", "down", "4gnet"], shell=False)
+                self.backend.connection_down("4gnet")
+                # Keep the module powered with its radio off when standby is on (see standby.py)
+                if standby.enabled() and standby.enter(self.backend, report=self.status_text.set):
+                    return True
                 # Power down the 4G module (depends on uConsole model)
-                try:
-                    self.run_command(["uconsole-4g-cm4", "disable"])
-                except:
-                    try:
-                        self.run_command(["uconsole-4g", "disable"])
-                    except:
-                        pass
+                return self.probe_cache.run_model_command("disable", report=self.status_text.set)
             else:
-                # Enable 4G
+                # Enable 4G, resuming at the first step that is not done yet (see bringup.py)
                 self.status_text.set("Enabling Mobile Data...")
-                
-                # First try to enable the 4G module (depends on uConsole model)
-                try:
-                    self.run_command(["uconsole-4g-cm4", "enable"])
-                except:
-                    try:
-                        self.run_command(["uconsole-4g", "enable"])
-                    except:
-                        messagebox.showerror("Error", "Failed to enable 4G module. Please check your uConsole model.")
-                        self.toggle_button.config(state=tk.NORMAL)
-                        return
-                
-                # Wait for the module to initialize
-                self.status_text.set("Waiting for 4G module to initialize...")
-                time.sleep(20)
-                
-                # Check the version of the 4G extension
-                version_output = self.run_command('echo -en "AT+CUSBPIDSWITCH?\\r\\n" | sudo socat - /dev/ttyUSB2,crnl', shell=True)
-                
-                if version_output and "9001" in version_output:
-                    # For version 9001, we need to use ModemManager
-                    self.status_text.set("Detected 4G module version 9001...")
-                    
-                    # Restart ModemManager to detect the modem
-                    self.run_command(["sudo", "systemctl", "restart", "ModemManager"])
-                    time.sleep(5)
-                    
-                    # Check if the modem is detected
-                    modem_output = self.run_command(["mmcli", "-L"])
-                    if not modem_output or "SIMCOM_SIM7600G-H" not in modem_output and "QUALCOMM" not in modem_output:
-                        messagebox.showerror("Error", "4G modem not detected. Please check your hardware.")
-                        self.toggle_button.config(state=tk.NORMAL)
-                        return
-                    
-                    # Find the primary port
-                    port_output = self.run_command('mmcli -m any | grep "primary port"', shell=True)
-                    if "cdc-wdm0" in port_output:
-                        # Blacklist some kernel modules as suggested in the documentation
-                        blacklist_cmd = 'sudo bash -c \'cat << EOF > /etc/modprobe.d/blacklist-qmi.conf\nblacklist qmi_wwan\nblacklist cdc_wdm\nEOF\''
-                        self.run_command(blacklist_cmd, shell=True)
-                        port = "ttyUSB2"  # Use ttyUSB2 as suggested
-                    elif "ttyUSB" in port_output:
-                        port = re.search(r'ttyUSB\d+', port_output).group(0)
-                    else:
-                        port = "ttyUSB2"  # Default to ttyUSB2
-                    
-                    # Create 4G connection with the APN
-                    self.status_text.set(f"Creating 4G connection with APN: {self.apn}...")
-                    
-                    # Check if the connection already exists
-                    conn_check = self.run_command(["nmcli", "connection", "show", "4gnet"])
-                    if conn_check and "not found" not in conn_check:
-                        # Connection exists, just bring it up
-                        self.run_command(["sudo", "nmcli", "connection", "up", "4gnet"])
-                    else:
-                        # Create new connection
-                        if self.username and self.password:
-                            cmd = ["sudo", "nmcli", "connection", "add", "type", "gsm", "ifname", port, "con-name", "4gnet", 
-                                  "apn", self.apn, "gsm.username", self.username, "gsm.password", self.password]
-                        else:
-                            cmd = ["sudo", "nmcli", "connection", "add", "type", "gsm", "ifname", port, "con-name", "4gnet", 
-                                  "apn", self.apn]
-                        
-                        self.run_command(cmd)
-                        time.sleep(2)
-                        
-                        # Bring up the connection
-                        self.run_command(["sudo", "nmcli", "connection", "up", "4gnet"])
+                bringup = MobileBringUp(self, report=self.status_text.set)
+                connected = bringup.run()
+                if not connected:
+                    messagebox.showerror("Error", bringup.error + "\n\n" + bringup.readiness.summary())
                 else:
-                    # For other versions (e.g., 9011), just check if usb0 is available
-                    self.status_text.set("Checking for usb0 interface...")
-                    time.sleep(5)
-                    ifconfig_output = self.run_command(["sudo", "ifconfig"])
-                    if "usb0" in ifconfig_output:
-                        self.status_text.set("Mobile data connection detected on usb0")
-                    else:
-                        messagebox.showerror("Error", "Failed to detect mobile data connection. Please check your SIM card and 4G module.")
-        
-        # Wait a bit for the connection to stabilize
-        time.sleep(5)
-        
-        # Update status
-        self.check_status()
+                    self.status_text.set(bringup.readiness.summary())
+                return connected
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="uConsole network toggle")
+    parser.add_argument("--quota", type=float, metavar="GB", help="monthly mobile data quota; warns at 80%% and 100%%")
+    parser.add_argument("--trace", metavar="FILE", help="record commands and phases as a JSON trace")
+    parser.add_argument("--metrics", metavar="FILE", help="write timings for the Prometheus textfile collector (*.prom)")
+    args = parser.parse_args()
+    if args.trace or args.metrics:
+        tracing.enable(args.trace, args.metrics)
     root = tk.Tk()
-    app = NetworkToggle(root)
+    app = NetworkToggle(root, args.quota * 1024 ** 3 if args.quota else None)
     root.mainloop()
+    app.usage_meter.stop()
+    app.signal_sampler.stop()
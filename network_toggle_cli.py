@@ -1,65 +1,123 @@
 #!/usr/bin/env python3
-import subprocess
-import os
-import time
-import re
+# uConsole network toggle CLI.
+# Without arguments it shows the interactive menu. Subcommands are meant for
+# scripts, status bars and cron:
+#   network_toggle_cli.py status [--json]
+#   network_toggle_cli.py wifi on|off
+#   network_toggle_cli.py mobile on|off
+#   network_toggle_cli.py handover wifi|mobile
+#   network_toggle_cli.py wait-online [--timeout SECONDS] [--check]
+#   network_toggle_cli.py signal [--window SECONDS] [--json]
+# Exit codes: 0 success, 1 operation failed, 2 usage error, 3 not online before the timeout
+# A status bar runs "status" every few seconds, so only what the daemon path
+# needs is imported at the top; everything else is imported where it is used.
+import argparse
+import functools
+import json
 import sys
 
+import network_toggle_client
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_OFFLINE = 3
+
+# Interval (seconds) at which wait-online re-reads the kernel state
+ONLINE_POLL_INTERVAL = 0.2
+
+
+def traced(name):
+    # tracing.traced, importing tracing only when the operation runs
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            import tracing
+
+            return tracing.traced(name)(func)(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def run_command(command, shell=False, quiet=False, on_line=None, timeout=None):
+    from executor import run_command
+
+    return run_command(command, shell, quiet, on_line, timeout)
+
+
 class NetworkToggleCLI:
-    def __init__(self):
-        # APN settings for Digi Spain
-        self.apn = "internet.digimobil.es"
+    def __init__(self, use_daemon=True, watch_events=True):
+        # D-Bus and GLib are slow to import; only load them when an operation needs them
+        import probe_cache
+        import signal_history
+        import usage_meter
+        from network_backend import NetworkBackend
+        from status_cache import StatusCache
+        
+        # APN settings; None to use the SIM operator's (see apn_db.py)
+        self.apn = None
         self.username = ""  # Leave empty if not required
         self.password = ""  # Leave empty if not required
         
         self.is_4g_enabled = False
         self.is_wifi_enabled = False
+        
+        # Long-lived D-Bus connection to NetworkManager/ModemManager (falls back to nmcli/mmcli)
+        self.backend = NetworkBackend(self.run_command)
+        
+        # Model command, PID mode and ports found on earlier runs (see probe_cache.py)
+        self.probe_cache = probe_cache.ProbeCache()
+        # Mobile data usage (see usage_meter.py)
+        self.usage_meter = usage_meter.UsageMeter()
+        # Signal quality history; the daemon samples it continuously (see signal_history.py)
+        self.signal_sampler = signal_history.SignalSampler(self.backend)
+        
+        # Status fields are cached and only re-read when stale or invalidated
+        self.status_cache = StatusCache(self.run_command, self.backend, use_events=watch_events)
+        
+        # Hand work to the resident daemon when it is running (network_toggled.py)
+        self.use_daemon = use_daemon
 
-    def run_command(self, command, shell=False):
-        try:
-            if shell:
-                result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            else:
-                result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            return result.stdout.strip()
-        except subprocess.CalledProcessError as e:
-            print(f"Command failed: {e}")
-            print(f"Error output: {e.stderr}")
+    def daemon_request(self, cmd, **args):
+        # Returns the daemon's response, or None to do the work standalone
+        if not self.use_daemon:
             return None
+        return network_toggle_client.request(cmd, **args)
 
+    def daemon_result(self, response, message):
+        if response["ok"]:
+            print(message)
+        else:
+            print(f"Error: {response.get('error', 'unknown error')}")
+        return response["ok"]
+
+    def run_command(self, command, shell=False, on_line=None):
+        return run_command(command, shell, on_line=on_line)
+
+    @traced("status")
     def check_status(self):
+        import signal_history
+        import usage_meter
+
         print("Checking network status...")
         
-        # Check WiFi status
-        wifi_output = self.run_command(["nmcli", "radio", "wifi"])
-        self.is_wifi_enabled = wifi_output == "enabled"
-        
-        # Check 4G status
-        modem_output = self.run_command(["mmcli", "-L"])
-        self.is_4g_enabled = "SIMCOM_SIM7600G-H" in modem_output or "QUALCOMM" in modem_output
-        
-        # Check current connection and IP
-        connection_info = self.run_command(["nmcli", "-t", "-f", "TYPE,STATE,DEVICE", "connection", "show", "--active"])
-        
-        current_connection = "None"
-        if connection_info:
-            for line in connection_info.split('\n'):
-                if "gsm:activated" in line:
-                    current_connection = "Mobile Data"
-                    break
-                elif "wifi:activated" in line:
-                    current_connection = "WiFi"
-                    break
-        
-        # Get IP address
-        ip_info = self.run_command("ip -4 addr show | grep -oP '(?<=inet\\s)\\d+(\\.\\d+){3}'", shell=True)
-        current_ip = "Not connected"
-        if ip_info:
-            ip_addresses = ip_info.split('\n')
-            # Filter out localhost
-            ip_addresses = [ip for ip in ip_addresses if not ip.startswith("127.")]
-            if ip_addresses:
-                current_ip = ip_addresses[0]
+        # Ask the daemon for its in-memory status, or use the local cache
+        response = self.daemon_request("status")
+        if response is not None and response["ok"]:
+            status = response["status"]
+        else:
+            status = self.status_cache.status()
+        # The daemon meters usage continuously; otherwise take one sample now
+        usage = status.get("usage")
+        if usage is None:
+            self.usage_meter.update()
+            usage = self.usage_meter.summary()
+        signal = status.get("signal")
+        if signal is None and status["modem_present"] and self.signal_sampler.sample():
+            signal = self.signal_sampler.store.summary()
+        self.is_wifi_enabled = status["wifi_enabled"]
+        self.is_4g_enabled = status["modem_present"]
+        current_connection = status["current_connection"]
+        current_ip = status["current_ip"]
         
         # Print status
         print("\n=== Network Status ===")
@@ -67,141 +125,126 @@ class NetworkToggleCLI:
         print(f"Mobile Data: {'Enabled' if self.is_4g_enabled else 'Disabled'}")
         print(f"Current Connection: {current_connection}")
         print(f"IP Address: {current_ip}")
+        print(f"Mobile Data Usage: {usage_meter.describe(usage)}")
+        if signal:
+            print(f"Signal: {signal_history.describe(signal)}")
         print("=====================\n")
         
         return current_connection
 
+    @traced("wifi on")
     def enable_wifi(self):
         print("Enabling WiFi...")
-        self.run_command(["nmcli", "radio", "wifi", "on"])
-        # Try to connect to the last known WiFi
+        response = self.daemon_request("wifi", state="on")
+        if response is not None:
+            return self.daemon_result(response, "WiFi enabled")
+        # One network operation at a time, across processes (see operations.py)
+        import operations
+
+        return operations.run("wifi on", self._enable_wifi)
+
+    def _enable_wifi(self):
+        # Radio on, then the access point of the last connection first (see bringup.py)
+        from bringup import WifiBringUp
+
         print("Attempting to connect to known WiFi networks...")
-        self.run_command(["nmcli", "device", "wifi", "connect"])
-        print("WiFi enabled. Use 'nmcli device wifi list' to see available networks")
+        bringup = WifiBringUp(self)
+        if bringup.run():
+            print("WiFi enabled.")
+            return True
+        print(bringup.error)
+        print("Use 'python3 wifi_reconnect.py --list' to see available networks")
         print("To connect to a specific network: nmcli device wifi connect SSID-Name password WIFI-PASSWORD")
+        return False
 
+    @traced("wifi off")
     def disable_wifi(self):
         print("Disabling WiFi...")
+        response = self.daemon_request("wifi", state="off")
+        if response is not None:
+            return self.daemon_result(response, "WiFi disabled")
+        import operations
+
+        return operations.run("wifi off", self._disable_wifi)
+
+    def _disable_wifi(self):
         # Disable any active WiFi connection
-        wifi_connections = self.run_command(["nmcli", "-t", "-f", "NAME,TYPE", "connection", "show", "--active"])
-        if wifi_connections:
-            for line in wifi_connections.split('\n'):
-                if ":wifi" in line:
-                    conn_name = line.split(':')[0]
-                    self.run_command(["nmcli", "connection", "down", conn_name])
-        self.run_command(["nmcli", "radio", "wifi", "off"])
+        for conn_name in self.backend.active_wifi_connections():
+            self.backend.connection_down(conn_name)
+        self.backend.set_wifi_enabled(False)
+        if self.backend.wifi_enabled():
+            print("Failed to disable WiFi.")
+            return False
         print("WiFi disabled")
+        return True
 
+    @traced("mobile on")
     def enable_mobile_data(self):
         print("Enabling Mobile Data...")
-        
-        # First try to enable the 4G module (prioritizing CM4 model since user has CM4-based uConsole)
-        try:
-            print("Using CM4 model command...")
-            self.run_command(["uconsole-4g-cm4", "enable"])
-        except:
-            try:
-                print("CM4 command failed, trying A06/R01 model command...")
-                self.run_command(["uconsole-4g", "enable"])
-            except:
-                print("Failed to enable 4G module. Please check your uConsole model.")
-                return False
-        
-        # Wait for the module to initialize
-        print("Waiting for 4G module to initialize (20 seconds)...")
-        time.sleep(20)
-        
-        # Check the version of the 4G extension
-        print("Checking 4G module version...")
-        version_output = self.run_command('echo -en "AT+CUSBPIDSWITCH?\\r\\n" | sudo socat - /dev/ttyUSB2,crnl', shell=True)
-        
-        if version_output and "9001" in version_output:
-            # For version 9001, we need to use ModemManager
-            print("Detected 4G module version 9001")
-            
-            # Restart ModemManager to detect the modem
-            print("Restarting ModemManager...")
-            self.run_command(["sudo", "systemctl", "restart", "ModemManager"])
-            time.sleep(5)
-            
-            # Check if the modem is detected
-            modem_output = self.run_command(["mmcli", "-L"])
-            if not modem_output or "SIMCOM_SIM7600G-H" not in modem_output and "QUALCOMM" not in modem_output:
-                print("4G modem not detected. Please check your hardware.")
-                return False
-            
-            # Find the primary port
-            print("Finding primary port...")
-            port_output = self.run_command('mmcli -m any | grep "primary port"', shell=True)
-            if "cdc-wdm0" in port_output:
-                # Blacklist some kernel modules as suggested in the documentation
-                print("Detected cdc-wdm0 port, blacklisting kernel modules...")
-                blacklist_cmd = 'sudo bash -c \'cat << EOF > /etc/modprobe.d/blacklist-qmi.conf\nblacklist qmi_wwan\nblacklist cdc_wdm\nEOF\''
-                self.run_command(blacklist_cmd, shell=True)
-                port = "ttyUSB2"  # Use ttyUSB2 as suggested
-            elif "ttyUSB" in port_output:
-                port = re.search(r'ttyUSB\d+', port_output).group(0)
-                print(f"Using port: {port}")
-            else:
-                port = "ttyUSB2"  # Default to ttyUSB2
-                print(f"No port detected, defaulting to: {port}")
-            
-            # Create 4G connection with the APN
-            print(f"Creating 4G connection with APN: {self.apn}...")
-            
-            # Check if the connection already exists
-            conn_check = self.run_command(["nmcli", "connection", "show", "4gnet"])
-            if conn_check and "not found" not in conn_check:
-                # Connection exists, just bring it up
-                print("Connection already exists, bringing it up...")
-                self.run_command(["sudo", "nmcli", "connection", "up", "4gnet"])
-            else:
-                # Create new connection
-                print("Creating new connection...")
-                if self.username and self.password:
-                    cmd = ["sudo", "nmcli", "connection", "add", "type", "gsm", "ifname", port, "con-name", "4gnet", 
-                          "apn", self.apn, "gsm.username", self.username, "gsm.password", self.password]
-                else:
-                    cmd = ["sudo", "nmcli", "connection", "add", "type", "gsm", "ifname", port, "con-name", "4gnet", 
-                          "apn", self.apn]
-                
-                self.run_command(cmd)
-                time.sleep(2)
-                
-                # Bring up the connection
-                print("Bringing up the connection...")
-                self.run_command(["sudo", "nmcli", "connection", "up", "4gnet"])
-        else:
-            # For other versions (e.g., 9011), just check if usb0 is available
-            print("Checking for usb0 interface...")
-            time.sleep(5)
-            ifconfig_output = self.run_command(["sudo", "ifconfig"])
-            if "usb0" in ifconfig_output:
-                print("Mobile data connection detected on usb0")
-            else:
-                print("Failed to detect mobile data connection. Please check your SIM card and 4G module.")
-                return False
-        
-        # Wait a bit for the connection to stabilize
-        print("Waiting for connection to stabilize...")
-        time.sleep(5)
-        return True
+        response = self.daemon_request("mobile", state="on")
+        if response is not None:
+            return self.daemon_result(response, "Mobile data enabled")
+        import operations
+
+        return operations.run("mobile on", self._enable_mobile_data)
 
-    def disable_mobile_data(self):
+    def _enable_mobile_data(self):
+        # Resumes at the first step that is not done yet (see bringup.py)
+        from bringup import MobileBringUp
+
+        bringup = MobileBringUp(self)
+        connected = bringup.run()
+        if not connected:
+            print(bringup.error)
+        print(bringup.readiness.summary())
+        return connected
+
+    @traced("mobile off")
+    def disable_mobile_data(self, standby_minutes=None):
+        # standby_minutes: standby time for this call instead of the configured one (see standby.py)
         print("Disabling Mobile Data...")
+        args = {} if standby_minutes is None else {"standby": standby_minutes}
+        response = self.daemon_request("mobile", state="off", **args)
+        if response is not None:
+            return self.daemon_result(response, "Mobile data disabled")
+        import operations
+
+        return operations.run("mobile off", lambda: self._disable_mobile_data(standby_minutes))
+
+    def _disable_mobile_data(self, standby_minutes=None):
+        import standby
+        import tracing
+
         # Bring down the 4G connection if it exists
-        self.run_command(["nmcli", "connection", "down", "4gnet"], shell=False)
-        # Power down the 4G module (prioritizing CM4 model)
-        try:
-            print("Using CM4 model command...")
-            self.run_command(["uconsole-4g-cm4", "disable"])
-        except:
-            try:
-                print("CM4 command failed, trying A06/R01 model command...")
-                self.run_command(["uconsole-4g", "disable"])
-            except:
+        self.backend.connection_down("4gnet")
+        minutes = standby.STANDBY_MINUTES if standby_minutes is None else standby_minutes
+        if minutes > 0:
+            # Keep the module powered with its radio off for a quick "mobile on" (see standby.py)
+            with tracing.span("module standby"):
+                if standby.enter(self.backend, minutes=minutes):
+                    print("Mobile data disabled")
+                    return True
+        # Power down the 4G module, starting with the model command that worked last
+        with tracing.span("module power-off"):
+            if not self.probe_cache.run_model_command("disable"):
                 print("Failed to disable 4G module.")
+                return False
         print("Mobile data disabled")
+        return True
+
+    @traced("handover")
+    def switch_uplink(self, kind):
+        # Make-before-break: the current uplink is released only after kind carries the traffic
+        print(f"Switching to {'WiFi' if kind == 'wifi' else 'Mobile Data'} without dropping connections...")
+        response = self.daemon_request("handover", to=kind)
+        if response is not None:
+            if "handover" in response:
+                print(f"Outage: {response['handover']['outage_ms']} ms")
+            return self.daemon_result(response, "Handover completed")
+        import operations
+        from handover import Handover
+
+        return operations.run(f"handover {kind}", lambda: Handover(self).run(kind))
 
     def show_menu(self):
         print("\nuConsole Network Toggle CLI")
@@ -211,35 +254,190 @@ class NetworkToggleCLI:
         print("3. Enable Mobile Data (4G)")
         print("4. Disable Mobile Data (4G)")
         print("5. Check Status")
-        print("6. Exit")
-        choice = input("\nEnter your choice (1-6): ")
+        print("6. Switch Uplink (WiFi <-> 4G, no outage)")
+        print("7. Exit")
+        choice = input("\nEnter your choice (1-7): ")
         return choice
 
     def run(self):
+        import tracing
+
         while True:
             self.check_status()
             choice = self.show_menu()
             
             if choice == '1':
                 self.enable_wifi()
+                self.status_cache.invalidate_for("wifi")
             elif choice == '2':
                 self.disable_wifi()
+                self.status_cache.invalidate_for("wifi")
             elif choice == '3':
                 self.enable_mobile_data()
+                self.status_cache.invalidate_for("mobile")
             elif choice == '4':
                 self.disable_mobile_data()
+                self.status_cache.invalidate_for("mobile")
             elif choice == '5':
-                # Status is already shown at the beginning of the loop
-                pass
+                # Re-read everything; the status is shown at the beginning of the loop
+                self.status_cache.invalidate()
             elif choice == '6':
+                current = self.check_status()
+                self.switch_uplink("wifi" if current == "Mobile Data" else "mobile")
+                self.status_cache.invalidate_for("wifi")
+                self.status_cache.invalidate_for("mobile")
+            elif choice == '7':
                 print("Exiting...")
                 break
             else:
                 print("Invalid choice. Please try again.")
+            tracing.tracer.flush()
             
             # Pause to let the user read the output
             input("\nPress Enter to continue...")
 
+
+def quick_status():
+    # The daemon's in-memory status, or a single read of the kernel state
+    response = network_toggle_client.request("status")
+    if response is not None and response["ok"]:
+        return response["status"]
+    import net_status
+    import usage_meter
+
+    status = net_status.snapshot(lambda command: run_command(command, quiet=True))
+    meter = usage_meter.UsageMeter()
+    meter.update()
+    status["usage"] = meter.summary()
+    return status
+
+
+def online_interface(check=False):
+    # Interface carrying the default route once it has an address; with check,
+    # only once the internet is also reachable through it
+    import net_status
+
+    route = net_status.read_links()["default_route"]
+    if route is None or not net_status.read_addresses_or_empty().get(route["ifindex"], {}).get("ipv4"):
+        return None
+    if check:
+        # asyncio and ssl are only loaded for the reachability check (see connectivity.py)
+        import connectivity
+
+        if connectivity.Verifier().check()["state"] != connectivity.ONLINE:
+            return None
+    return route["interface"]
+
+
+def command_status(args):
+    import tracing
+
+    with tracing.span("status"):
+        status = quick_status()
+    if args.json:
+        print(json.dumps(status))
+    else:
+        network_toggle_client.print_status(status)
+    return EXIT_OK
+
+
+def command_toggle(args):
+    app = NetworkToggleCLI(watch_events=False)
+    actions = {
+        ("wifi", "on"): app.enable_wifi,
+        ("wifi", "off"): app.disable_wifi,
+        ("mobile", "on"): app.enable_mobile_data,
+        # --standby goes to the daemon with the request when it does the work
+        ("mobile", "off"): lambda: app.disable_mobile_data(getattr(args, "standby", None)),
+    }
+    return EXIT_OK if actions[(args.command, args.state)]() is True else EXIT_FAILED
+
+
+def command_handover(args):
+    app = NetworkToggleCLI(watch_events=False)
+    return EXIT_OK if app.switch_uplink(args.target) else EXIT_FAILED
+
+
+def command_wait_online(args):
+    from modem_ready import wait_until
+
+    interface, elapsed = wait_until(lambda: online_interface(args.check), args.timeout, ONLINE_POLL_INTERVAL)
+    if interface is None:
+        print(f"Not online after {elapsed:.1f}s")
+        return EXIT_OFFLINE
+    print(f"Online via {interface} after {elapsed:.1f}s")
+    return EXIT_OK
+
+
+def command_signal(args):
+    # The daemon's history, or a single sample when it is not running
+    import signal_history
+
+    response = network_toggle_client.request("signal", window=args.window)
+    if response is not None and response["ok"]:
+        summary = response["signal"]
+    else:
+        sampler = signal_history.SignalSampler(NetworkToggleCLI(watch_events=False).backend)
+        if sampler.sample() is None:
+            print("No modem found")
+            return EXIT_FAILED
+        summary = sampler.store.summary(args.window)
+    if args.json:
+        print(json.dumps(response if response is not None and response["ok"] else {"signal": summary}))
+    else:
+        for metric in summary:
+            print(signal_history.describe(summary, metric))
+    return EXIT_OK
+
+
+COMMANDS = {
+    "status": command_status,
+    "wifi": command_toggle,
+    "mobile": command_toggle,
+    "handover": command_handover,
+    "wait-online": command_wait_online,
+    "signal": command_signal,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="uConsole network toggle CLI (interactive menu without a command)")
+    parser.add_argument("--trace", metavar="FILE", help="record commands and phases as a JSON trace")
+    parser.add_argument("--metrics", metavar="FILE", help="write timings for the Prometheus textfile collector (*.prom)")
+    subparsers = parser.add_subparsers(dest="command")
+    status_parser = subparsers.add_parser("status", help="show the current connection")
+    status_parser.add_argument("--json", action="store_true", help="print the full status as JSON")
+    for name in ("wifi", "mobile"):
+        subparsers.add_parser(name, help=f"turn {name} on or off").add_argument("state", choices=("on", "off"))
+    subparsers.choices["mobile"].add_argument("--standby", type=float, metavar="MINUTES",
+                                              help="off: keep the module in low-power standby this long (see standby.py)")
+    subparsers.add_parser("handover", help="switch uplinks without dropping connections").add_argument(
+        "target", choices=("wifi", "mobile"))
+    wait_parser = subparsers.add_parser("wait-online", help="wait until there is a default route with an address")
+    wait_parser.add_argument("--timeout", type=float, default=30, help="seconds to wait (default: 30)")
+    wait_parser.add_argument("--check", action="store_true", help="also wait until the internet is reachable")
+    signal_parser = subparsers.add_parser("signal", help="show the 4G signal quality history")
+    signal_parser.add_argument("--window", type=float, default=3600, help="seconds of history (default: 3600)")
+    signal_parser.add_argument("--json", action="store_true", help="print the summary and the samples as JSON")
+    args = parser.parse_args(argv)
+    if args.command == "mobile" and args.state == "on" and args.standby is not None:
+        parser.error("--standby only applies to mobile off")
+
+    if args.trace or args.metrics:
+        import tracing
+
+        tracing.enable(args.trace, args.metrics)
+    try:
+        if args.command is None:
+            NetworkToggleCLI().run()
+            return EXIT_OK
+        return COMMANDS[args.command](args)
+    finally:
+        # Only an operation that ran can have left spans behind
+        tracing = sys.modules.get("tracing")
+        if tracing is not None:
+            tracing.tracer.flush()
+
+
 if __name__ == "__main__":
-    app = NetworkToggleCLI()
-    app.run()
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Client for the resident network toggle daemon (network_toggled.py).
+# Sends one JSON request per line over the daemon's Unix socket and reads one
+# JSON response line back. When the daemon is not running, request() returns
+# None so the caller can fall back to doing the work itself. A daemon that took
+# the request but gave no answer gets a failed response instead: the operation
+# may still be running there and must not be started a second time.
+# Usage: python3 network_toggle_client.py status|wifi on|off|mobile on|off|handover wifi|mobile|signal
+# Exit codes: 0 success, 1 operation failed, 2 daemon not available
+import json
+import os
+import socket
+import sys
+
+SOCKET_PATH = os.environ.get("UCONSOLE_NETWORK_SOCKET", "/run/uconsole-network-toggle.sock")
+
+# Seconds to wait for an answer; operations can take as long as a 4G bring-up
+STATUS_TIMEOUT = 2
+OPERATION_TIMEOUT = 300
+
+
+def request(cmd, timeout=None, **args):
+    if timeout is None:
+        timeout = STATUS_TIMEOUT if cmd == "status" else OPERATION_TIMEOUT
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(SOCKET_PATH)
+        except OSError:
+            return None
+        try:
+            sock.sendall(json.dumps(dict(args, cmd=cmd)).encode() + b"\n")
+            data = b""
+            while not data.endswith(b"\n"):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            return json.loads(data)
+        except socket.timeout:
+            return {"ok": False, "error": f"no answer from the daemon within {timeout} s"}
+        except (OSError, ValueError):
+            return {"ok": False, "error": "the daemon stopped without answering"}
+
+
+def print_status(status):
+    # Only loaded here, so a request does not wait for them
+    import signal_history
+    import standby
+    import usage_meter
+
+    print("=== Network Status ===")
+    print(f"WiFi: {'Enabled' if status['wifi_enabled'] else 'Disabled'}")
+    print(f"Mobile Data: {'Enabled' if status['modem_present'] else 'Disabled'}")
+    print(f"Current Connection: {status['current_connection']}")
+    print(f"IP Address: {status['current_ip']}")
+    if "usage" in status:
+        print(f"Mobile Data Usage: {usage_meter.describe(status['usage'])}")
+    if status.get("signal"):
+        print(f"Signal: {signal_history.describe(status['signal'])}")
+    if status.get("standby", {}).get("enabled"):
+        print(f"4G Standby: {standby.describe(status['standby'])}")
+    if status.get("multipath", {}).get("active"):
+        import multipath
+
+        print(f"Multipath: {multipath.describe(status['multipath'])}")
+    running = status.get("operations", {}).get("running")
+    if running:
+        queued = len(status["operations"]["queue"])
+        print(f"Running: {running['op']} for {running['seconds']}s, {queued} more queued")
+    print("=====================")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args == ["status"]:
+        response = request("status")
+    elif len(args) == 2 and args[0] in ("wifi", "mobile") and args[1] in ("on", "off"):
+        response = request(args[0], state=args[1])
+    elif len(args) == 2 and args[0] == "handover" and args[1] in ("wifi", "mobile"):
+        response = request("handover", to=args[1])
+    elif args == ["signal"]:
+        response = request("signal")
+    else:
+        print(f"Usage: {sys.argv[0]} status|wifi on|off|mobile on|off|handover wifi|mobile|signal")
+        sys.exit(1)
+
+    if response is None:
+        sys.exit(2)
+    if not response.get("ok"):
+        print(f"Error: {response.get('error', 'unknown error')}")
+    if "handover" in response:
+        print(f"Outage: {response['handover']['outage_ms']} ms")
+    if "status" in response:
+        print_status(response["status"])
+    if response.get("signal"):
+        import signal_history
+
+        for metric in response["signal"]:
+            print(signal_history.describe(response["signal"], metric))
+    sys.exit(0 if response.get("ok") else 1)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# Resident network toggle daemon.
+# Owns the NetworkManager/ModemManager state in memory, keeps it fresh through
+# netlink/D-Bus events, runs one operation at a time together with the other
+# tools (see operations.py; identical requests share one run), and serves a compact JSON protocol over a Unix socket:
+#   {"cmd": "status"}                  -> {"ok": true, "status": {...}}
+#   {"cmd": "wifi", "state": "on"}     -> {"ok": true, "status": {...}}
+#   {"cmd": "mobile", "state": "off"}  -> {"ok": true, "status": {...}}
+#     (optionally with "standby": MINUTES, overriding --standby for this request)
+#   {"cmd": "handover", "to": "mobile"} -> {"ok": true, "status": {...}, "handover": {...}}
+#   {"cmd": "signal", "window": 3600}  -> {"ok": true, "signal": {...}, "history": {...}}
+# Usage: sudo python3 network_toggled.py [--socket PATH] [--group GROUP] [--failover [wifi|mobile] | --multipath [--cap MB] [--policy SELECTOR=LINK]...] [--quota GB] [--standby MINUTES]
+import argparse
+import grp
+import json
+import os
+import signal
+import socketserver
+import sys
+import time
+
+import network_toggle_client
+import operations
+import signal_history
+import standby
+import tracing
+import usage_meter
+from failover import FailoverEngine, check_probes
+from handover import UPLINKS, Handover
+from multipath import MultipathEngine, parse_policy
+from network_toggle_cli import NetworkToggleCLI
+
+
+class NetworkToggleDaemon:
+    def __init__(self, failover=None, quota=None, multipath=None):
+        # The CLI class does the actual work; it must not call back into the daemon
+        self.toggle = NetworkToggleCLI(use_daemon=False)
+        # Kept fresh by netlink/D-Bus events (see status_cache.py)
+        self.status_cache = self.toggle.status_cache
+        # Automatic switching, preferring the given uplink (see failover.py)
+        self.failover = FailoverEngine(self.toggle, failover) if failover else None
+        # WiFi and 4G at the same time, given {"cap", "policies"} (see multipath.py)
+        self.multipath = MultipathEngine(self.toggle, **multipath) if multipath is not None else None
+        # Throughput and data usage, sampled in the background (see usage_meter.py)
+        self.usage_meter = usage_meter.UsageMeter(quota=quota)
+        # Signal quality history of the modem (see signal_history.py)
+        self.signal_sampler = self.toggle.signal_sampler
+
+    def start(self):
+        self.status_cache.status()
+        if self.failover:
+            self.failover.start()
+        if self.multipath:
+            self.multipath.start()
+        self.usage_meter.start()
+        self.signal_sampler.start()
+
+    def stop(self):
+        if self.failover:
+            self.failover.stop()
+        if self.multipath:
+            self.multipath.stop()
+        self.usage_meter.stop()
+        self.signal_sampler.stop()
+
+    def get_status(self):
+        status = dict(self.status_cache.status(), usage=self.usage_meter.summary(),
+                      signal=self.signal_sampler.store.summary(), operations=operations.coordinator.status(),
+                      standby=standby.summary())
+        if self.multipath:
+            status["multipath"] = self.multipath.state()
+        return status
+
+    def signal(self, window):
+        store = self.signal_sampler.store
+        since = time.time() - window
+        history = {metric: store.query(metric, since) for metric in signal_history.METRICS}
+        return {"ok": True, "signal": store.summary(window), "history": history}
+
+    def handle(self, message):
+        cmd = message.get("cmd")
+        if cmd == "status":
+            return {"ok": True, "status": self.get_status()}
+        if cmd == "handover" and message.get("to") in UPLINKS:
+            return self.handover(message["to"])
+        if cmd == "signal":
+            return self.signal(float(message.get("window", 3600)))
+        if cmd not in ("wifi", "mobile") or message.get("state") not in ("on", "off"):
+            return {"ok": False, "error": f"unknown request: {message}"}
+        # "mobile off" may bring its own standby time (network_toggle_cli.py mobile off --standby)
+        standby_minutes = message.get("standby")
+        if standby_minutes is not None and (not isinstance(standby_minutes, (int, float)) or standby_minutes < 0):
+            return {"ok": False, "error": f"invalid standby time: {standby_minutes!r}"}
+
+        # One operation at a time; a request identical to the running one gets its result
+        def work():
+            tracing.tracer.reset()
+            if cmd == "wifi":
+                result = self.toggle.enable_wifi() if message["state"] == "on" else self.toggle.disable_wifi()
+            else:
+                result = (self.toggle.enable_mobile_data() if message["state"] == "on"
+                          else self.toggle.disable_mobile_data(standby_minutes))
+            self.status_cache.invalidate_for(cmd)
+            tracing.tracer.flush()
+            return result
+
+        result = operations.run(f"{cmd} {message['state']}", work)
+        status = self.get_status()
+        response = {"ok": result is True, "status": status}
+        if result is not True:
+            response["error"] = f"{cmd} {message['state']} failed"
+        return response
+
+    def handover(self, kind):
+        handover = Handover(self.toggle)
+
+        def work():
+            tracing.tracer.reset()
+            switched = handover.run(kind)
+            self.status_cache.invalidate_for("wifi")
+            self.status_cache.invalidate_for("mobile")
+            tracing.tracer.flush()
+            return switched
+
+        switched = operations.run(f"handover {kind}", work) is True
+        status = self.get_status()
+        response = {"ok": switched, "status": status, "handover": handover.result}
+        if not switched:
+            response["error"] = f"handover to {kind} failed"
+        return response
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.daemon.handle(json.loads(line))
+            except ValueError:
+                response = {"ok": False, "error": "invalid JSON"}
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, group=None, failover=None, quota=None, multipath=None):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    daemon = NetworkToggleDaemon(failover, quota, multipath)
+    daemon.start()
+    server = DaemonServer(socket_path, RequestHandler)
+    server.daemon = daemon
+    # Let members of the network group use the socket; without one, only root may
+    if group:
+        os.chown(socket_path, -1, grp.getgrnam(group).gr_gid)
+        os.chmod(socket_path, 0o660)
+    else:
+        os.chmod(socket_path, 0o600)
+        print("No netdev group: only root can use the socket. Pass --group GROUP to let its members use it.",
+              file=sys.stderr)
+    print(f"Listening on {socket_path}")
+    # Remove the socket on "systemctl stop" as well as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        daemon.stop()
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def default_group():
+    try:
+        grp.getgrnam(operations.GROUP)
+        return operations.GROUP
+    except KeyError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="uConsole network toggle daemon")
+    parser.add_argument("--socket", default=network_toggle_client.SOCKET_PATH)
+    parser.add_argument("--group", default=default_group(), help="group allowed to use the socket (default: netdev)")
+    parser.add_argument("--failover", nargs="?", const="wifi", choices=("wifi", "mobile"),
+                        help="switch uplinks automatically, preferring the given one (default: wifi)")
+    parser.add_argument("--multipath", action="store_true",
+                        help="use WiFi and 4G at the same time, spreading new connections over both")
+    parser.add_argument("--cap", type=float, metavar="MB", help="with --multipath, 4G data after which it gets no new connections")
+    parser.add_argument("--policy", action="append", default=[], metavar="SELECTOR=LINK",
+                        help="with --multipath, pin traffic to a link: uid:UID, port:PORT or to:PREFIX, then =wifi or =mobile")
+    parser.add_argument("--quota", type=float, metavar="GB", help="monthly mobile data quota; warns at 80%% and 100%%")
+    parser.add_argument("--standby", type=float, metavar="MINUTES",
+                        help="on mobile off, keep the 4G module in low-power standby this long before powering it off")
+    parser.add_argument("--trace", metavar="FILE", help="write a JSON trace of the last operation")
+    parser.add_argument("--metrics", metavar="FILE", help="write timings of the last operation for the Prometheus textfile collector")
+    args = parser.parse_args()
+    if args.failover and args.multipath:
+        parser.error("--failover and --multipath cannot be combined")
+    if args.failover and check_probes():
+        parser.error(check_probes())
+    if args.group:
+        try:
+            grp.getgrnam(args.group)
+        except KeyError:
+            parser.error(f"no such group: {args.group}")
+    # The operation and standby state files are shared with the same group
+    operations.GROUP = args.group
+    try:
+        for policy in args.policy:
+            parse_policy(policy)
+    except ValueError as e:
+        parser.error(str(e))
+    multipath = {"cap": args.cap * 1024 ** 2 if args.cap else None, "policies": args.policy} if args.multipath else None
+    if args.trace or args.metrics:
+        tracing.enable(args.trace, args.metrics)
+    if args.standby is not None:
+        standby.configure(args.standby)
+    try:
+        serve(args.socket, args.group, args.failover, args.quota * 1024 ** 3 if args.quota else None, multipath)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# Coordination of network operations across threads and processes.
+# Operations (wifi on/off, mobile on/off, handover wifi/mobile) run under an
+# exclusive flock on LOCK_PATH. The GUIs, the CLI, the daemon, cron jobs and
+# toggle_network.sh (which takes the same lock with flock(1)) therefore never
+# run two at once.
+# - Identical requests coalesce. A second "mobile on" in the same process
+#   waits for the running one and gets its result. In another process it
+#   waits for the lock and takes the result of the same operation if that
+#   finished after it asked.
+# - A request for the other state of the same thing (mobile off while mobile
+#   on runs) preempts: the running operation is asked to cancel and stops at
+#   its next bring-up step or readiness poll. Everything else queues, first
+#   come first served.
+# - The state file next to the lock lists the running operation and the queue
+#   with their wait times; the daemon includes it in its status. Only root and
+#   the members of GROUP may write it (and so cancel an operation); without
+#   the group, only the user who created it.
+# Usage: python3 operations.py   (shows the running operation and the queue)
+import fcntl
+import grp
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+LOCK_PATH = os.environ.get("UCONSOLE_LOCK_PATH") or os.path.join(
+    "/run/lock" if os.access("/run/lock", os.W_OK) else tempfile.gettempdir(), "uconsole-network-toggle.lock")
+
+# Group allowed to write the shared files, as for the daemon's socket (network_toggled.py --group)
+GROUP = "netdev"
+
+POLL_INTERVAL = 0.1  # seconds between lock attempts while queued
+REPORT_INTERVAL = 5  # seconds between "still waiting" messages
+
+
+class Cancelled(Exception):
+    pass
+
+
+def preempts(op, running):
+    # "mobile off" preempts "mobile on", "handover wifi" preempts "handover mobile"
+    return op.split()[0] == running.split()[0] and op != running
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _open(path, flags, mode=0o660):
+    # The files are shared by root and the members of GROUP; a new one gets mode,
+    # without group write when it cannot belong to GROUP. An existing file is
+    # opened without O_CREAT, which protected_regular refuses for other users'
+    # files in sticky directories such as /run/lock.
+    try:
+        return os.open(path, flags)
+    except FileNotFoundError:
+        try:
+            fd = os.open(path, flags | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            return os.open(path, flags)
+        try:
+            os.fchown(fd, -1, grp.getgrnam(GROUP).gr_gid)
+        except (KeyError, TypeError, PermissionError):
+            # No such group (or None), or this user is not a member
+            mode &= 0o744
+        os.fchmod(fd, mode)
+        return fd
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        # The exception the operation raised, passed on to the coalesced callers
+        self.error = None
+
+
+class Coordinator:
+    def __init__(self, path=LOCK_PATH):
+        self.path = path
+        self.state_path = f"{path}.state"
+        self.lock = threading.Lock()
+        # Operations in flight in this process, by name
+        self.flights = {}
+        self.local = threading.local()
+        # Id of the operation this process is running, if any
+        self.current = None
+        self.ids = itertools.count(1)
+
+    # State file: {"running": entry, "queue": [entry], "last": {...}, "cancel": id}
+
+    def _state(self, change=None):
+        # The state, after applying change(state) to it when given
+        try:
+            fd = _open(self.state_path, os.O_RDWR)
+        except OSError:
+            return {"queue": []}
+        with os.fdopen(fd, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if change else fcntl.LOCK_SH)
+            try:
+                state = json.loads(f.read() or "{}")
+            except ValueError:
+                state = {}
+            state.setdefault("queue", [])
+            if change:
+                state["queue"] = [entry for entry in state["queue"] if _alive(entry["pid"])]
+                change(state)
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+        return state
+
+    def status(self):
+        # {"running": {"op", "pid", "seconds"} or None, "queue": [{"op", "pid", "waiting"}]}
+        state = self._state()
+        now = time.time()
+        running = state.get("running")
+        if running and _alive(running["pid"]):
+            running = {"op": running["op"], "pid": running["pid"], "seconds": round(now - running["started"], 1)}
+        else:
+            running = None
+        queue = [{"op": entry["op"], "pid": entry["pid"], "waiting": round(now - entry["since"], 1)}
+                 for entry in state["queue"] if _alive(entry["pid"])]
+        return {"running": running, "queue": queue}
+
+    # Cancellation, polled by long-running operations
+
+    def cancelled(self):
+        return self.current is not None and self._state().get("cancel") == self.current
+
+    def check_cancelled(self):
+        # Raises Cancelled when another request preempted the running operation
+        if self.cancelled():
+            raise Cancelled(f"preempted by {self._state().get('cancelled_by', 'another request')}")
+
+    # Running operations
+
+    def run(self, op, func, report=print):
+        # Run func() as operation op ("mobile on", ...); returns its result, or
+        # False when it was cancelled. An exception from func() is raised in
+        # every caller waiting for it. Operations nested in a running one (the
+        # handover enabling a link) run directly.
+        if getattr(self.local, "held", False):
+            return func()
+        with self.lock:
+            flight = self.flights.get(op)
+            owner = flight is None
+            if owner:
+                flight = self.flights[op] = _Flight()
+        if not owner:
+            report(f"{op} is already running; waiting for it to finish")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._run_exclusive(op, func, report)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[op]
+            flight.done.set()
+        return flight.result
+
+    def _run_exclusive(self, op, func, report):
+        entry = {"op": op, "pid": os.getpid(), "id": f"{os.getpid()}-{next(self.ids)}", "since": time.time()}
+        self._state(lambda state: state["queue"].append(entry))
+        ran = False
+        result = None
+        # Everyone may wait for the lock; only the state file is restricted
+        fd = _open(self.path, os.O_RDONLY, 0o644)
+        try:
+            self._acquire(fd, entry, report)
+            self.local.held = True
+
+            def start(state):
+                state["queue"] = [queued for queued in state["queue"] if queued["id"] != entry["id"]]
+                state.update(running=dict(entry, started=time.time()), cancel=None)
+
+            state = self._state(start)
+            waited = time.time() - entry["since"]
+            last = state.get("last")
+            if last and last["op"] == op and last["finished"] >= entry["since"]:
+                report(f"{op} just finished in another process (pid {last['pid']}); not running it again")
+                return last["ok"]
+            if waited >= 1:
+                report(f"Waited {waited:.1f}s for other network operations")
+            self.current = entry["id"]
+            ran = True
+            try:
+                result = func()
+            except Cancelled as e:
+                report(f"{op} cancelled: {e}")
+                result = False
+            except Exception:
+                # Recorded as failed for the callers in other processes
+                result = False
+                raise
+            return result
+        finally:
+            self.current = None
+            self.local.held = False
+
+            def finish(state):
+                state["queue"] = [queued for queued in state["queue"] if queued["id"] != entry["id"]]
+                state["running"] = None
+                if ran:
+                    state["last"] = {"op": op, "ok": result is True, "pid": entry["pid"], "finished": time.time()}
+
+            self._state(finish)
+            os.close(fd)
+
+    def _acquire(self, fd, entry, report):
+        # Take the lock once every earlier request got its turn, preempting a conflicting operation
+        asked_cancel = False
+        next_report = 0
+        while True:
+            state = self._state()
+            ahead = [queued for queued in state["queue"]
+                     if queued["since"] < entry["since"] and queued["id"] != entry["id"] and _alive(queued["pid"])]
+            if not ahead:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return
+                except BlockingIOError:
+                    pass
+            running = state.get("running")
+            now = time.time()
+            if running and _alive(running["pid"]):
+                if not asked_cancel and preempts(entry["op"], running["op"]):
+                    self._state(lambda state: state.update(cancel=running["id"], cancelled_by=entry["op"]))
+                    report(f"Cancelling {running['op']} (pid {running['pid']}) in favour of {entry['op']}...")
+                    asked_cancel = True
+                elif now >= next_report:
+                    report(f"Waiting for {running['op']} (pid {running['pid']}, running for "
+                           f"{now - running['started']:.0f}s); {len(ahead)} more request(s) ahead")
+                    next_report = now + REPORT_INTERVAL
+            time.sleep(POLL_INTERVAL)
+
+
+coordinator = Coordinator()
+
+
+def run(op, func, report=print):
+    return coordinator.run(op, func, report)
+
+
+def check_cancelled():
+    coordinator.check_cancelled()
+
+
+if __name__ == "__main__":
+    status = coordinator.status()
+    if status["running"]:
+        running = status["running"]
+        print(f"Running: {running['op']} (pid {running['pid']}, {running['seconds']}s)")
+    else:
+        print("Running: nothing")
+    for entry in status["queue"]:
+        print(f"Queued:  {entry['op']} (pid {entry['pid']}, waiting {entry['waiting']}s)")
+    sys.exit(0)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Persistent cache of hardware probe results.
+# Facts such as the module's USB PID mode (9001/9011), the model command, the
+# primary and AT ports and whether the "4gnet" profile was set up almost never
+# change on a given unit. They are stored per modem, keyed by the USB identity
+# (vendor:product:serial from sysfs), so a repeat enable can skip the version
+# query, the ModemManager restart, port discovery and the profile probe. A
+# different fingerprint (new module, PID switched) simply misses the cache.
+# For WiFi it keeps, per known profile, the access point (BSSID, channel, band)
+# of the last successful association, and the last scan results with their age.
+import glob
+import json
+import os
+import shutil
+import time
+
+import executor
+import net_status
+
+CACHE_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                          "uconsole-network-toggle", "probe.json")
+
+# Power-control commands, CM4 first (see How-to-use-the-4G-extension.md)
+MODEL_COMMANDS = ("uconsole-4g-cm4", "uconsole-4g")
+
+
+def usb_identity():
+    # Returns {"vendor", "product", "serial"} of the 4G module, or None when it
+    # is not on the USB bus (e.g. still powered off)
+    for path in sorted(glob.glob("/sys/bus/usb/devices/*/idVendor")):
+        vendor = net_status._read(path)
+        if vendor in net_status.MODEM_USB_VENDORS:
+            directory = os.path.dirname(path)
+            return {
+                "vendor": vendor,
+                "product": net_status._read(f"{directory}/idProduct", ""),
+                "serial": net_status._read(f"{directory}/serial", ""),
+            }
+    return None
+
+
+def usb_fingerprint():
+    identity = usb_identity()
+    if identity is None:
+        return None
+    return f"{identity['vendor']}:{identity['product']}:{identity['serial']}"
+
+
+class ProbeCache:
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data.setdefault("modems", {})
+        data.setdefault("wifi", {})
+        return data
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save probe cache: {e}")
+
+    def model_command(self):
+        # The cached command is validated with a PATH lookup, which is cheap
+        cached = self.data.get("model_command")
+        if cached and shutil.which(cached):
+            return cached
+        for command in MODEL_COMMANDS:
+            if shutil.which(command):
+                self.data["model_command"] = command
+                self.save()
+                return command
+        return None
+
+    def model_commands(self):
+        # Installed power-control commands, the one that worked last first
+        cached = self.data.get("model_command")
+        return sorted((command for command in MODEL_COMMANDS if shutil.which(command)), key=lambda c: c != cached)
+
+    def run_model_command(self, action, report=print):
+        # "<model command> enable|disable"; on failure the next installed command is tried
+        for command in self.model_commands():
+            report(f"Using {command}...")
+            try:
+                executor.check_command([command, action])
+            except executor.CommandError as e:
+                report(f"{command} {action} failed: {e}")
+                continue
+            if self.data.get("model_command") != command:
+                self.data["model_command"] = command
+                self.save()
+            return True
+        return False
+
+    def modem(self, fingerprint):
+        if fingerprint is None:
+            return None
+        return self.data["modems"].get(fingerprint)
+
+    def update_modem(self, fingerprint, **facts):
+        if fingerprint is None:
+            return
+        entry = self.data["modems"].setdefault(fingerprint, {})
+        entry.update(facts, updated=int(time.time()))
+        self.save()
+
+    def forget_modem(self, fingerprint):
+        if self.data["modems"].pop(fingerprint, None) is not None:
+            self.save()
+
+    def wifi_networks(self):
+        # {profile: facts}, most recently connected first
+        return dict(sorted(self.data["wifi"].items(), key=lambda item: item[1].get("updated", 0), reverse=True))
+
+    def update_wifi(self, profile, **facts):
+        entry = self.data["wifi"].setdefault(profile, {})
+        entry.update(facts, updated=int(time.time()))
+        self.save()
+
+    def forget_wifi(self, profile):
+        if self.data["wifi"].pop(profile, None) is not None:
+            self.save()
+
+    def wifi_scan(self, max_age):
+        # Access points from a scan at most max_age seconds old, or None
+        scan = self.data.get("wifi_scan")
+        if scan is None or time.time() - scan["time"] > max_age:
+            return None
+        return scan["access_points"]
+
+    def save_wifi_scan(self, access_points):
+        self.data["wifi_scan"] = {"time": time.time(), "access_points": access_points}
+        self.save()
+
+
+if __name__ == "__main__":
+    cache = ProbeCache()
+    print(f"Cache: {cache.path}")
+    print(f"USB fingerprint: {usb_fingerprint() or 'modem not on the USB bus'}")
+    print(json.dumps(cache.data, indent=2))
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# Signal quality history of the 4G modem.
+# A sampler reads RSSI/RSRP/RSRQ/SINR from ModemManager's extended signal
+# information. When ModemManager does not manage the modem, it sends AT+CSQ and
+# AT+CPSI? in one round trip instead; while ModemManager does, the AT port is
+# left to it. Samples go into a bounded store made of tiers of fixed
+# arrays: raw samples for the last hour, 1-minute averages for a day and
+# 15-minute averages for a month. Older data is only kept in downsampled form,
+# so memory use stays constant (about 200 KB).
+# While no modem is present the sampler only checks for one every minute.
+# ModemManager does its own polling at the same rate we read.
+# Usage: python3 signal_history.py [--watch] [--interval SECONDS] [--window SECONDS]
+import argparse
+import array
+import math
+import re
+import sys
+import threading
+import time
+
+import at_channel
+
+METRICS = ("rssi", "rsrp", "rsrq", "sinr")
+UNITS = {"rssi": "dBm", "rsrp": "dBm", "rsrq": "dB", "sinr": "dB"}
+
+SAMPLE_INTERVAL = 10  # seconds between samples while a modem is present
+IDLE_INTERVAL = 60  # seconds between checks for a modem
+# (bucket seconds, buckets kept) from finest to coarsest
+TIERS = ((SAMPLE_INTERVAL, 360), (60, 1440), (900, 2880))
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+SPARK_WIDTH = 30
+
+
+class Tier:
+    # Ring of per-bucket averages; NaN marks a metric without a value
+    def __init__(self, step, size):
+        self.step = step
+        self.size = size
+        self.times = array.array("d", [math.nan]) * size
+        self.values = {metric: array.array("d", [math.nan]) * size for metric in METRICS}
+        self.count = 0
+        self.bucket = None
+        self.sums = {}
+
+    def add(self, when, values):
+        bucket = int(when // self.step)
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+        for metric, value in values.items():
+            total, count = self.sums.get(metric, (0.0, 0))
+            self.sums[metric] = (total + value, count + 1)
+
+    def flush(self):
+        if self.bucket is None:
+            return
+        index = self.count % self.size
+        self.times[index] = self.bucket * self.step
+        for metric in METRICS:
+            total, count = self.sums.get(metric, (0.0, 0))
+            self.values[metric][index] = total / count if count else math.nan
+        self.count += 1
+        self.bucket = None
+        self.sums = {}
+
+    def oldest(self):
+        if self.count == 0:
+            return math.inf
+        return self.times[self.count % self.size if self.count > self.size else 0]
+
+    def points(self, metric, since):
+        # (time, value) pairs at or after since, oldest first
+        points = []
+        for offset in range(max(0, self.count - self.size), self.count):
+            index = offset % self.size
+            value = self.values[metric][index]
+            if self.times[index] >= since and not math.isnan(value):
+                points.append((self.times[index], value))
+        if self.bucket is not None and metric in self.sums:
+            total, count = self.sums[metric]
+            points.append((self.bucket * self.step, total / count))
+        return points
+
+
+class SignalStore:
+    def __init__(self, tiers=TIERS):
+        self.tiers = [Tier(step, size) for step, size in tiers]
+        self.lock = threading.Lock()
+        self.latest = None
+
+    def add(self, values, when=None):
+        when = time.time() if when is None else when
+        values = {metric: value for metric, value in values.items() if metric in METRICS}
+        with self.lock:
+            for tier in self.tiers:
+                tier.add(when, values)
+            self.latest = (when, values)
+
+    def query(self, metric, since, until=None):
+        # Samples of metric between since and until from the finest tier reaching back far enough
+        until = time.time() if until is None else until
+        with self.lock:
+            # A tier that has not wrapped yet still holds everything since the first sample
+            tier = next((tier for tier in self.tiers if tier.count <= tier.size or tier.oldest() <= since),
+                        self.tiers[-1])
+            return [(when, value) for when, value in tier.points(metric, since) if when <= until]
+
+    def summary(self, window=3600):
+        # {metric: {"last", "min", "max", "mean", "spark"}} for the last window seconds
+        since = time.time() - window
+        with self.lock:
+            latest = dict(self.latest[1]) if self.latest else {}
+        result = {}
+        for metric in METRICS:
+            values = [value for _, value in self.query(metric, since)]
+            if not values:
+                continue
+            result[metric] = {
+                "last": latest.get(metric),
+                "min": min(values),
+                "max": max(values),
+                "mean": round(sum(values) / len(values), 1),
+                "spark": sparkline(values),
+            }
+        return result
+
+
+def sparkline(values, width=SPARK_WIDTH):
+    # Block characters scaled between the minimum and maximum; longer series are averaged down
+    if len(values) > width:
+        step = len(values) / width
+        values = [sum(chunk) / len(chunk) for chunk in
+                  (values[int(i * step):int((i + 1) * step)] for i in range(width)) if chunk]
+    low, high = min(values), max(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low) if high > low else 0
+    return "".join(SPARK_CHARS[int((value - low) * scale)] for value in values)
+
+
+def describe(summary, metric=None):
+    # One line for status displays, e.g. "RSRP -95 dBm (-110..-88) ▂▃▅▆"
+    metric = metric or next((m for m in ("rsrp", "rssi") if m in summary), None)
+    if metric is None:
+        return "no samples"
+    info = summary[metric]
+    last = info["last"] if info["last"] is not None else info["mean"]
+    return f"{metric.upper()} {last:.0f} {UNITS[metric]} ({info['min']:.0f}..{info['max']:.0f}) {info['spark']}"
+
+
+# Reading the modem
+
+def parse_csq(line):
+    # "+CSQ: 18,99" -> {"rssi": -77}; 99 means not known
+    match = re.match(r"\+CSQ:\s*(\d+),", line)
+    if match is None or int(match.group(1)) == 99:
+        return {}
+    return {"rssi": -113 + 2 * int(match.group(1))}
+
+
+def parse_cpsi(line):
+    # SIMCom "+CPSI: LTE,Online,...,RSRQ,RSRP,RSSI,RSSNR" with the first three in tenths of a dB
+    if not line.startswith("+CPSI: LTE"):
+        return {}
+    fields = line.split(",")
+    try:
+        rsrq, rsrp, rssi, sinr = (int(field) for field in fields[-4:])
+    except ValueError:
+        return {}
+    return {"rsrq": rsrq / 10, "rsrp": rsrp / 10, "rssi": rssi / 10, "sinr": float(sinr)}
+
+
+def read_at(port=at_channel.AT_PORT):
+    try:
+        responses = at_channel.get_channel(port).query(["AT+CSQ", "AT+CPSI?"])
+    except (OSError, at_channel.ATError):
+        at_channel.get_channel(port).close()
+        return None
+    values = {}
+    for line in at_channel.response_lines(responses["AT+CSQ"]):
+        values.update(parse_csq(line))
+    for line in at_channel.response_lines(responses["AT+CPSI?"]):
+        # CPSI has the better RSSI figure on LTE
+        values.update(parse_cpsi(line))
+    return values
+
+
+class SignalSampler:
+    def __init__(self, backend, store=None, interval=SAMPLE_INTERVAL):
+        # backend is a network_backend.NetworkBackend; None reads only the AT port
+        self.backend = backend
+        self.store = store or SignalStore()
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def read(self):
+        # Current values, or None when there is no modem to ask. The AT port is
+        # only used when ModemManager does not have the modem: otherwise it owns
+        # the port, and empty values just mean it has no reading yet.
+        values = self.backend.modem_signal(int(self.interval)) if self.backend else None
+        if values is None:
+            values = read_at()
+        return values
+
+    def sample(self):
+        values = self.read()
+        if values:
+            self.store.add(values)
+        return values
+
+    def run(self):
+        while not self.stopped.is_set():
+            values = self.sample()
+            self.stopped.wait(self.interval if values is not None else IDLE_INTERVAL)
+
+    def start(self):
+        # May be called again after stop()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+
+if __name__ == "__main__":
+    from network_backend import NetworkBackend
+    from executor import run_command
+
+    parser = argparse.ArgumentParser(description="Sample and show the 4G signal quality")
+    parser.add_argument("--watch", action="store_true", help="keep sampling and print a line per sample")
+    parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL)
+    parser.add_argument("--window", type=float, default=3600, help="seconds shown in the sparklines")
+    args = parser.parse_args()
+    sampler = SignalSampler(NetworkBackend(lambda command, shell=False: run_command(command, shell, quiet=True)),
+                            interval=args.interval)
+    if sampler.sample() is None:
+        print("No modem found")
+        sys.exit(1)
+    try:
+        while True:
+            summary = sampler.store.summary(args.window)
+            for metric in METRICS:
+                if metric in summary:
+                    print(describe(summary, metric))
+            if not args.watch:
+                break
+            print()
+            time.sleep(args.interval)
+            sampler.sample()
+    except KeyboardInterrupt:
+        pass
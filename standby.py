@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# Warm standby of the 4G module.
+# With standby on (UCONSOLE_STANDBY_MINUTES, or --standby MINUTES on the daemon
+# and "mobile off"), "mobile off" takes the connection down and puts the module
+# into low-power mode instead of cutting its power: ModemManager disables it
+# (radio off, AT+CFUN=4), or AT+CFUN=4 is sent directly in 9011 mode. The
+# module stays on the USB bus and known to ModemManager, and the 4gnet profile
+# stays in place, so "mobile on" only has to turn the radio on, register and
+# connect; the power-on wait and the port discovery are skipped.
+# A watcher process cuts the power once the module has been in standby for the
+# configured time, or earlier when the battery is discharging below
+# MIN_BATTERY percent. While it waits it samples the battery draw, and after the
+# power-off it samples it again for BASELINE_TIME, so the cost of standby is
+# measured on the device. Switch-on times are recorded separately for starts
+# from standby and from a powered-off module.
+# Whether the module is in standby is kept in a file next to the operations
+# lock (see operations.py), shared by the daemon running as root and the tools
+# run by members of operations.GROUP; the switch-on times and draw samples are kept per user.
+# Usage: python3 standby.py   (shows the standby state, switch-on times and standby cost)
+import fcntl
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+import operations
+
+# {"since", "minutes"} of the current standby
+STATE_PATH = os.environ.get("UCONSOLE_STANDBY_STATE") or f"{operations.LOCK_PATH}.standby"
+# {"switch_on": {start: [count, seconds]}, "draw": {state: [count, mW]}}
+STATS_PATH = os.path.join(os.environ.get("XDG_STATE_HOME", os.path.expanduser("~/.local/state")),
+                          "uconsole-network-toggle", "standby.json")
+
+
+def _env_number(name, default):
+    # A non-negative number from the environment; a malformed one is reported and ignored
+    text = os.environ.get(name)
+    if text is None:
+        return default
+    try:
+        value = float(text)
+    except ValueError:
+        value = None
+    if value is None or not 0 <= value < float("inf"):
+        print(f"{name}: ignoring {text!r} (expected a number)", file=sys.stderr)
+        return default
+    return value
+
+
+# Minutes in standby before the power is cut; 0 powers the module off at once
+STANDBY_MINUTES = _env_number("UCONSOLE_STANDBY_MINUTES", 0.0)
+MIN_BATTERY = _env_number("UCONSOLE_STANDBY_MIN_BATTERY", 25.0)  # percent
+CHECK_INTERVAL = 30  # seconds between the watcher's checks and draw samples
+BASELINE_TIME = 120  # seconds of draw samples after the power-off
+
+
+def configure(minutes):
+    # Standby time for this process and the watchers it starts
+    global STANDBY_MINUTES
+    STANDBY_MINUTES = minutes
+    os.environ["UCONSOLE_STANDBY_MINUTES"] = str(minutes)
+
+
+def enabled():
+    return STANDBY_MINUTES > 0
+
+
+def _state(change=None, path=None):
+    # The shared state (or the file at path), after applying change(state) to it when given
+    try:
+        if not change:
+            f = open(path or STATE_PATH)
+        elif path is None:
+            # Written by root and by members of operations.GROUP, like the operations state
+            f = os.fdopen(operations._open(STATE_PATH, os.O_RDWR), "r+")
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = open(path, "a+")
+    except OSError:
+        return {}
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX if change else fcntl.LOCK_SH)
+        f.seek(0)
+        try:
+            state = json.loads(f.read() or "{}")
+        except ValueError:
+            state = {}
+        if change:
+            change(state)
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+    return state
+
+
+def _stats(change=None):
+    return _state(change, STATS_PATH)
+
+
+def _add(state, group, key, value):
+    count, total = state.setdefault(group, {}).get(key, (0, 0.0))
+    state[group][key] = (count + 1, total + value)
+
+
+def active():
+    # Whether the module is in standby; a cheap file read
+    return _state().get("since") is not None
+
+
+def battery():
+    # {"capacity": percent, "discharging": bool, "draw_mw": mW or None}, or None without a battery
+    for directory in sorted(glob.glob("/sys/class/power_supply/*")):
+        try:
+            with open(f"{directory}/type") as f:
+                if f.read().strip() != "Battery":
+                    continue
+            with open(f"{directory}/capacity") as f:
+                capacity = float(f.read())
+            with open(f"{directory}/status") as f:
+                discharging = f.read().strip() == "Discharging"
+        except (OSError, ValueError):
+            continue
+        draw = None
+        try:
+            with open(f"{directory}/power_now") as f:
+                draw = abs(int(f.read())) / 1000
+        except (OSError, ValueError):
+            try:
+                with open(f"{directory}/current_now") as f, open(f"{directory}/voltage_now") as g:
+                    draw = abs(int(f.read())) * int(g.read()) / 1e9
+            except (OSError, ValueError):
+                pass
+        return {"capacity": capacity, "discharging": discharging, "draw_mw": draw}
+    return None
+
+
+def enter(backend, report=print, minutes=None):
+    # Radio off with the module powered; starts the watcher that powers it off
+    # after minutes (default: STANDBY_MINUTES)
+    import at_channel
+
+    minutes = STANDBY_MINUTES if minutes is None else minutes
+
+    if backend.modem_detected():
+        radio_off = backend.modem_enable(False)
+    else:
+        radio_off = at_channel.send("AT+CFUN=4") is not None
+    if not radio_off:
+        # The caller powers the module off instead
+        report("The 4G module did not accept low-power mode")
+        return False
+    since = time.time()
+    _state(lambda state: state.update(since=since, minutes=minutes))
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), "watch"], stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    report(f"4G module in standby; powered off after {minutes:g} min or below {MIN_BATTERY:g}% battery")
+    return True
+
+
+def wake(backend, report=print):
+    # Radio on again; registration and the connection follow
+    import at_channel
+
+    report("Waking the 4G module from standby...")
+    if backend.modem_detected():
+        if not backend.modem_enable(True):
+            return False
+    elif at_channel.send("AT+CFUN=1") is None:
+        return False
+    _state(lambda state: state.update(since=None))
+    return True
+
+
+def record_switch_on(start, seconds):
+    # start: "standby" or "cold"
+    _stats(lambda stats: _add(stats, "switch_on", start, seconds))
+
+
+def summary():
+    state = _state()
+    stats = _stats()
+    averages = {group: {key: round(total / count, 2) for key, (count, total) in stats.get(group, {}).items() if count}
+                for group in ("switch_on", "draw")}
+    draw = averages["draw"]
+    return {
+        "enabled": enabled(),
+        "minutes": STANDBY_MINUTES,
+        "standby_for": round(time.time() - state["since"]) if state.get("since") else None,
+        "switch_on": averages["switch_on"],
+        "draw_mw": draw,
+        "cost_mw": round(draw["standby"] - draw["off"], 1) if "standby" in draw and "off" in draw else None,
+    }
+
+
+def describe(stats):
+    parts = [f"in standby for {stats['standby_for'] // 60} min" if stats["standby_for"] is not None
+             else "not in standby"]
+    parts += [f"switch-on from {start} {seconds:.1f} s" for start, seconds in sorted(stats["switch_on"].items())]
+    if stats["cost_mw"] is not None:
+        parts.append(f"standby costs {stats['cost_mw']:.0f} mW")
+    return ", ".join(parts)
+
+
+def _sample(key):
+    status = battery()
+    if status and status["discharging"] and status["draw_mw"] is not None:
+        _stats(lambda stats: _add(stats, "draw", key, status["draw_mw"]))
+
+
+def _power_off():
+    # Cut the module's power unless mobile data was turned on meanwhile
+    import probe_cache
+
+    def off():
+        if not active():
+            return False
+        probe_cache.ProbeCache().run_model_command("disable", report=lambda message: None)
+        _state(lambda state: state.update(since=None))
+        return True
+
+    # Not "mobile off": that would preempt a "mobile on" (see operations.py)
+    return operations.run("standby power-off", off, report=lambda message: None) is True
+
+
+def watch():
+    # Run by enter() in the background
+    since = _state().get("since")
+    if since is None:
+        # Woken before this watcher ran
+        return
+    while True:
+        time.sleep(CHECK_INTERVAL)
+        state = _state()
+        if state.get("since") != since:
+            # Woken up, or a newer standby has its own watcher
+            return
+        _sample("standby")
+        status = battery()
+        low = status is not None and status["discharging"] and status["capacity"] < MIN_BATTERY
+        if time.time() - since >= state.get("minutes", STANDBY_MINUTES) * 60 or low:
+            break
+    if _power_off():
+        for _ in range(int(BASELINE_TIME // CHECK_INTERVAL)):
+            time.sleep(CHECK_INTERVAL)
+            _sample("off")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["watch"]:
+        watch()
+        sys.exit(0)
+    stats = summary()
+    print(f"Standby: {'on, ' + format(stats['minutes'], 'g') + ' min' if stats['enabled'] else 'off'}")
+    print(f"State: {describe(stats)}")
+    for key, draw in sorted(stats["draw_mw"].items()):
+        print(f"Battery draw with the module {key}: {draw:.0f} mW")
+    sys.exit(0)
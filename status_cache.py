@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Cached status model shared by the CLI, the GUIs and the daemon.
+# Every field (WiFi radio, modem presence, links/default route, addresses) has
+# its own time-to-live and is dropped early by netlink/D-Bus events or by our
+# own actions. status() only re-reads the fields that went stale, all at once,
+# so redrawing a menu is a memory read and a toggle refreshes just the fields it
+# affected in the time of the slowest one.
+import threading
+import time
+
+import executor
+import net_status
+from net_events import NetworkEventMonitor
+
+# Seconds each field stays valid without an invalidating event
+FIELD_TTLS = {
+    "wifi": 30,
+    "modem": 30,
+    "links": 10,
+    "addresses": 10,
+}
+
+# Fields invalidated by each event source (see net_events.NetworkEventMonitor)
+EVENT_FIELDS = {
+    "link": ("links", "addresses", "modem"),
+    "address": ("addresses",),
+    "route": ("links",),
+    "networkmanager": ("wifi", "links"),
+    "modemmanager": ("modem",),
+}
+
+# Fields invalidated by our own actions
+ACTION_FIELDS = {
+    "wifi": ("wifi", "links", "addresses"),
+    "mobile": ("modem", "links", "addresses"),
+}
+
+
+class StatusCache:
+    def __init__(self, run_command=None, backend=None, on_change=None, use_events=True, ttls=None):
+        self.loaders = {
+            "wifi": lambda: net_status.read_wifi(run_command, backend),
+            "modem": lambda: net_status.modem_present(run_command, backend),
+            "links": net_status.read_links,
+            "addresses": net_status.read_addresses_or_empty,
+        }
+        self.ttls = dict(FIELD_TTLS, **(ttls or {}))
+        self.values = {}
+        self.expires = {}
+        # Bumped by every invalidation, so a load that an event overtook is not kept
+        self.generations = dict.fromkeys(self.loaders, 0)
+        self.lock = threading.Lock()
+        # on_change(sources) is called after events invalidated some fields
+        self.on_change = on_change
+        self.monitor = NetworkEventMonitor(self._on_events) if use_events else None
+        if self.monitor:
+            self.monitor.start()
+
+    @property
+    def events_active(self):
+        return self.monitor is not None and self.monitor.active
+
+    def _on_events(self, sources):
+        fields = set()
+        for source in sources:
+            fields.update(EVENT_FIELDS.get(source, ()))
+        self.invalidate(*fields)
+        if self.on_change:
+            self.on_change(sources)
+
+    def invalidate(self, *fields):
+        # Drop the given fields (all of them when called without arguments)
+        with self.lock:
+            for field in fields or list(self.loaders):
+                self.expires.pop(field, None)
+                self.generations[field] += 1
+
+    def invalidate_for(self, action):
+        self.invalidate(*ACTION_FIELDS[action])
+
+    def get(self, field):
+        now = time.monotonic()
+        with self.lock:
+            if self.expires.get(field, 0) > now:
+                return self.values[field]
+            generation = self.generations[field]
+        value = self.loaders[field]()
+        with self.lock:
+            # Invalidated while loading: the value may predate the event, so the next get() reads again
+            if self.generations[field] == generation:
+                self.values[field] = value
+                self.expires[field] = time.monotonic() + self.ttls[field]
+        return value
+
+    def stale_fields(self):
+        now = time.monotonic()
+        with self.lock:
+            return [field for field in self.loaders if self.expires.get(field, 0) <= now]
+
+    def status(self):
+        # Stale fields are re-read concurrently (the WiFi and modem fallbacks run commands)
+        executor.call_all([lambda field=field: self.get(field) for field in self.stale_fields()])
+        return net_status.compose(self.get("links"), self.get("addresses"), self.get("wifi"), self.get("modem"))
+
+    def stop(self):
+        if self.monitor:
+            self.monitor.stop()
@@ -0,0 +1,93 @@
+# Shared fixtures: the system tools are replaced by the benchmark's stand-ins
+# (see benchmark.py), with no latency, and the AT port is its fake modem.
+# The environment is set up before any module under test is imported, since
+# they read their paths and ports from it at import time.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+
+_environment = None
+
+
+def pytest_configure(config):
+    # Runs when this file is loaded, before the test modules are imported
+    global _environment
+    _environment = benchmark.Environment({}, {}, "9001")
+
+
+def pytest_unconfigure(config):
+    if _environment is not None:
+        _environment.cleanup()
+
+
+@pytest.fixture(scope="session")
+def environment():
+    return _environment
+
+
+@pytest.fixture
+def env(environment):
+    # WiFi up, 4G module off, nothing cached
+    environment.reset()
+    yield environment
+    environment.reset()
+
+
+def calls(env):
+    # Tool invocations logged by the stand-ins so far
+    try:
+        with open(os.path.join(env.state_dir, "calls.log")) as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+
+@pytest.fixture
+def usb_modem(env, monkeypatch):
+    # The 4G module appears on the USB bus while the stand-in keeps it powered
+    import probe_cache
+
+    def identity():
+        if os.path.exists(os.path.join(env.state_dir, "modem")):
+            return {"vendor": "1e0e", "product": "9001", "serial": "0123456789"}
+        return None
+
+    monkeypatch.setattr(probe_cache, "usb_identity", identity)
+
+
+@pytest.fixture
+def cli(env):
+    from network_toggle_cli import NetworkToggleCLI
+
+    toggle = NetworkToggleCLI(use_daemon=False, watch_events=False)
+    # Only the stand-ins may be used, never a real NetworkManager on the bus
+    toggle.backend.client = None
+    yield toggle
+    toggle.status_cache.stop()
+
+
+@pytest.fixture
+def daemon(env):
+    # The daemon serving on the environment's socket, as network_toggled.serve() does
+    import threading
+
+    import network_toggle_client
+    import network_toggled
+
+    instance = network_toggled.NetworkToggleDaemon()
+    instance.toggle.backend.client = None
+    instance.start()
+    server = network_toggled.DaemonServer(network_toggle_client.SOCKET_PATH, network_toggled.RequestHandler)
+    server.daemon = instance
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield instance
+    server.shutdown()
+    server.server_close()
+    os.unlink(network_toggle_client.SOCKET_PATH)
+    instance.stop()
+    instance.status_cache.stop()
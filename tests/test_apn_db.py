@@ -0,0 +1,78 @@
+import pytest
+
+import apn_db
+
+BUILTIN = """# key\tmatch\tapn\tauth\tusername\tpassword\tip_type\toperator
+23410\t-\tmobile.o2.co.uk\tpap\to2web\tpassword\tipv4\tO2 (GB)
+23410\tspn:Tesco Mobile\tprepay.tesco-mobile.com\tpap\ttescowap\tpassword\tipv4\tTesco Mobile (GB)
+23410\tgid1:5a\tgid.example\t-\t-\t-\t-\tGID operator (GB)
+310260\t-\tfast.t-mobile.com\tnone\t-\t-\tipv4v6\tT-Mobile (US)
+31026\t-\tfive.digit.example\tnone\t-\t-\tipv4\tShort MNC
+"""
+
+
+@pytest.fixture
+def database(tmp_path):
+    (tmp_path / "apn_db.tsv").write_text(BUILTIN)
+    return apn_db.APNDatabase(str(tmp_path / "apn_db.tsv"), str(tmp_path / "apns.tsv"))
+
+
+def test_load_skips_comments_and_short_lines_and_fills_defaults(tmp_path):
+    path = tmp_path / "apns.tsv"
+    path.write_text("# comment\n\n20404\tonly two\n"
+                    "20416\t-\tsmartsites.t-mobile\n"
+                    "23410\tSPN:Giffgaff\tgiffgaff.com\tpap\tgiffgaff\t-\tipv4\tgiffgaff (GB)\n")
+    assert apn_db._load(str(path)) == {
+        "20416": {"apn": "smartsites.t-mobile", "auth": "none", "username": "", "password": "",
+                  "ip_type": "ipv4", "operator": ""},
+        "23410 spn:giffgaff": {"apn": "giffgaff.com", "auth": "pap", "username": "giffgaff", "password": "",
+                               "ip_type": "ipv4", "operator": "giffgaff (GB)"},
+    }
+    assert apn_db._load(str(tmp_path / "missing.tsv")) == {}
+
+
+def test_decode_bcd():
+    # Swapped nibbles; for an odd number of digits the last byte is F and the digit
+    assert apn_db._decode_bcd("98441100000012F5") == "894411000000215"
+    assert apn_db._decode_bcd("981049FFFF") == "890194"
+
+
+def test_spn():
+    assert apn_db._spn("00" + b"giffgaff".hex() + "ffffff") == "giffgaff"
+    assert apn_db._spn("01ffffffff") is None
+
+
+def test_lookup_without_an_imsi_is_the_default(database):
+    assert database.lookup({}) == dict(apn_db.DEFAULT, source="default")
+
+
+def test_lookup_prefers_the_spn_and_gid1_entries(database):
+    assert database.lookup({"imsi": "234101234567890"})["apn"] == "mobile.o2.co.uk"
+    assert database.lookup({"imsi": "234101234567890", "spn": "TESCO MOBILE"})["apn"] == "prepay.tesco-mobile.com"
+    assert database.lookup({"imsi": "234101234567890", "gid1": "5A"})["apn"] == "gid.example"
+    assert database.lookup({"imsi": "234101234567890", "spn": "unknown"})["apn"] == "mobile.o2.co.uk"
+    assert database.needs_match("234101234567890")
+    assert not database.needs_match("310260123456789")
+
+
+def test_lookup_tries_the_three_digit_mnc_first(database):
+    settings = database.lookup({"imsi": "310260123456789"})
+    assert (settings["apn"], settings["source"]) == ("fast.t-mobile.com", "database")
+    assert database.lookup({"imsi": "310269123456789"})["apn"] == "five.digit.example"
+
+
+def test_lookup_unknown_network(database):
+    settings = database.lookup({"imsi": "999991234567890"})
+    assert (settings["apn"], settings["source"]) == (apn_db.UNKNOWN_APN, "unknown")
+    assert settings["operator"] == "unknown operator 99999"
+
+
+def test_overrides_come_first_and_may_name_one_sim(database, tmp_path):
+    (tmp_path / "apns.tsv").write_text("23410\t-\toverride.example\tnone\t-\t-\tipv4\tMine\n"
+                                       "234109999999999\t-\timsi.example\tnone\t-\t-\tipv4\tOne SIM\n"
+                                       "8944110000002143\t-\ticcid.example\tnone\t-\t-\tipv4\tOne card\n")
+    # An override for the network wins even over a more specific built-in entry
+    settings = database.lookup({"imsi": "234101234567890", "spn": "Tesco Mobile"})
+    assert (settings["apn"], settings["source"]) == ("override.example", "override")
+    assert database.lookup({"imsi": "234109999999999"})["apn"] == "imsi.example"
+    assert database.lookup({"imsi": "234101234567890", "iccid": "8944110000002143"})["apn"] == "iccid.example"
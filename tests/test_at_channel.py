@@ -0,0 +1,124 @@
+import os
+import pty
+import threading
+import time
+import tty
+
+import pytest
+
+import at_channel
+
+
+@pytest.fixture
+def modem(env):
+    # The benchmark's fake modem, powered on
+    with open(os.path.join(env.state_dir, "modem"), "w"):
+        pass
+    channel = at_channel.ATChannel(env.modem.port)
+    yield channel
+    channel.close()
+
+
+class ScriptedModem:
+    # A pty that answers each command line with a fixed reply, for the cases
+    # the fake modem does not produce (URCs, errors)
+    def __init__(self, replies, delays=None):
+        self.replies = replies
+        # Seconds to wait before answering a command
+        self.delays = delays or {}
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.commands = []
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        buffer = b""
+        while True:
+            try:
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                return
+            while b"\r" in buffer:
+                line, buffer = buffer.split(b"\r", 1)
+                command = line.strip().decode()
+                self.commands.append(command)
+                time.sleep(self.delays.get(command, 0))
+                os.write(self.master, self.replies.get(command, "\r\nOK\r\n").encode())
+
+
+def test_query_is_one_round_trip(modem):
+    responses = modem.query(["AT+CSQ", "AT+CPIN?", "AT+CIMI"])
+    assert responses == {"AT+CSQ": ["+CSQ: 20,99"], "AT+CPIN?": ["+CPIN: READY"], "AT+CIMI": ["214220123456789"]}
+
+
+def test_command_keeps_the_port_open(modem):
+    assert modem.command("AT+CSQ") == ["+CSQ: 20,99"]
+    fd = modem.fd
+    assert modem.command("AT+CPIN?") == ["+CPIN: READY"]
+    assert modem.fd == fd
+
+
+def test_silent_modem_times_out(env):
+    # Powered off: the port exists but nothing answers
+    channel = at_channel.ATChannel(env.modem.port)
+    try:
+        with pytest.raises(at_channel.ATTimeout):
+            channel.command("AT", timeout=0.2)
+    finally:
+        channel.close()
+    assert at_channel.send("AT", port=env.modem.port, timeout=0.2) is None
+    assert at_channel.get_channel(env.modem.port).fd is None
+
+
+def test_urcs_are_set_aside():
+    scripted = ScriptedModem({"AT+CSQ": "\r\n+CREG: 1\r\n+CSQ: 18,99\r\n\r\nOK\r\n"})
+    with at_channel.ATChannel(scripted.port) as channel:
+        assert channel.command("AT+CSQ") == ["+CSQ: 18,99"]
+        assert list(channel.urcs) == ["+CREG: 1"]
+
+
+def test_failing_command_in_a_query_is_retried_alone():
+    scripted = ScriptedModem({
+        "AT+CSQ;+CPSI?": "\r\nERROR\r\n",
+        "AT+CSQ": "\r\n+CSQ: 18,99\r\n\r\nOK\r\n",
+        "AT+CPSI?": "\r\n+CME ERROR: 4\r\n",
+    })
+    with at_channel.ATChannel(scripted.port) as channel:
+        responses = channel.query(["AT+CSQ", "AT+CPSI?"])
+    assert responses["AT+CSQ"] == ["+CSQ: 18,99"]
+    # The error is not mistaken for a response line
+    assert isinstance(responses["AT+CPSI?"], at_channel.ATError)
+    assert str(responses["AT+CPSI?"]) == "AT+CPSI?: +CME ERROR: 4"
+    assert at_channel.response_lines(responses["AT+CPSI?"]) == []
+    assert scripted.commands == ["AT+CSQ;+CPSI?", "AT+CSQ", "AT+CPSI?"]
+
+
+def test_late_reply_is_not_read_as_the_next_answer():
+    scripted = ScriptedModem({"AT+CPSI?": "\r\n+CPSI: LTE,Online\r\n\r\nOK\r\n",
+                              "AT+CSQ": "\r\n+CSQ: 18,99\r\n\r\nOK\r\n"}, delays={"AT+CPSI?": 0.3})
+    with at_channel.ATChannel(scripted.port) as channel:
+        with pytest.raises(at_channel.ATTimeout):
+            channel.query(["AT+CPSI?"], timeout=0.1)
+        time.sleep(0.5)
+        assert channel.command("AT+CSQ") == ["+CSQ: 18,99"]
+        assert list(channel.urcs) == []
+
+
+def test_close_waits_for_a_running_exchange(modem):
+    # The signal sampler closes the shared channel after an error while
+    # bring-up may be waiting for an answer on it
+    errors = []
+
+    def query():
+        try:
+            for _ in range(20):
+                modem.query(["AT+CSQ"])
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=query)
+    thread.start()
+    while thread.is_alive():
+        modem.close()
+    thread.join()
+    assert errors == []
@@ -0,0 +1,89 @@
+import time
+
+from conftest import calls
+
+
+def test_cold_enable_after_disable_uses_probe_cache(env, usb_modem, cli, capsys):
+    assert cli.enable_mobile_data() is True
+    assert cli.probe_cache.modem("1e0e:9001:0123456789")["pid_mode"] == "9001"
+    cli.disable_mobile_data()
+    assert not cli.backend.connection_ip("4gnet")
+    capsys.readouterr()
+    before = len(calls(env))
+
+    assert cli.enable_mobile_data() is True
+    output = capsys.readouterr().out
+    assert "Using cached probe results for 1e0e:9001:0123456789" in output
+    assert "Checking 4G module version" not in output
+    assert not any("systemctl restart ModemManager" in call for call in calls(env)[before:])
+
+
+def test_enable_is_a_single_check_when_connected(env, usb_modem, cli, capsys):
+    assert cli.enable_mobile_data() is True
+    capsys.readouterr()
+    assert cli.enable_mobile_data() is True
+    output = capsys.readouterr().out
+    assert "Creating 4G connection" not in output
+    assert "Bringing up the connection" not in output
+
+
+def test_enable_when_connected_is_well_under_a_second(env, usb_modem, cli):
+    assert cli.enable_mobile_data() is True
+    start = time.monotonic()
+    assert cli.enable_mobile_data() is True
+    assert time.monotonic() - start < 0.5
+
+
+def test_enable_resumes_a_half_finished_bring_up(env, usb_modem, cli, capsys):
+    # Powered, with its profile, but the connection went down
+    assert cli.enable_mobile_data() is True
+    cli.backend.connection_down("4gnet")
+    capsys.readouterr()
+    before = len(calls(env))
+    assert cli.enable_mobile_data() is True
+    output = capsys.readouterr().out
+    for step in ("module power-on", "ModemManager", "profile creation", "radio on"):
+        assert f"{step}: already done" in output
+    assert "Bringing up the connection" in output
+    assert not any("connection add" in call or "systemctl restart ModemManager" in call
+                   for call in calls(env)[before:])
+
+
+def test_radio_on_does_not_vouch_for_a_powered_off_module(env, usb_modem, cli):
+    # Not in standby, but not powered either: both steps still have to run
+    from bringup import MobileBringUp, plan
+
+    bringup = MobileBringUp(cli, report=lambda message: None)
+    assert plan([bringup.power_steps()[0], bringup.radio_step()]) == set()
+
+
+def test_unbound_reachability_is_not_taken_as_done(monkeypatch):
+    # Without CAP_NET_RAW the quick check would have gone over the other uplink
+    import bringup
+    import connectivity
+
+    monkeypatch.setattr(bringup, "uplink_interface", lambda kind: "wwan0")
+    monkeypatch.setattr(connectivity.Verifier, "check",
+                        lambda self, ifname=None: {"state": connectivity.ONLINE, "bound": False})
+    step = bringup.reachability_step("mobile", ())
+    assert not step.done()
+    monkeypatch.setattr(connectivity.Verifier, "check",
+                        lambda self, ifname=None: {"state": connectivity.ONLINE, "bound": True})
+    assert step.done()
+
+
+def test_guessed_apn_keeps_a_configured_profile(env, usb_modem, cli, monkeypatch):
+    # The SIM cannot be read, so the APN would only be the generic default
+    import apn_db
+
+    monkeypatch.setattr(apn_db, "read_sim", lambda backend=None, run_command=None, port=None: {})
+    cli.backend.add_gsm_profile("4gnet", "ttyUSB2", "hand.configured")
+    assert cli.enable_mobile_data() is True
+    assert cli.backend.profile_apn("4gnet") == "hand.configured"
+    assert not any("connection delete" in call for call in calls(env))
+
+
+def test_sim_apn_replaces_the_profile_of_another_sim(env, usb_modem, cli):
+    cli.backend.add_gsm_profile("4gnet", "ttyUSB2", "other.sim")
+    assert cli.enable_mobile_data() is True
+    assert cli.backend.profile_apn("4gnet") != "other.sim"
@@ -0,0 +1,114 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import connectivity
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port(kind):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(params=[False, True], ids=["open", "portal"])
+def stand_ins(request):
+    dns_port, http_port = free_port(socket.SOCK_DGRAM), free_port(socket.SOCK_STREAM)
+    servers = connectivity.start_stand_ins("127.0.0.1", request.param, dns_port, http_port)
+    yield request.param, dns_port, http_port
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_stand_ins_decide_the_state(stand_ins):
+    portal, dns_port, http_port = stand_ins
+    verifier = connectivity.Verifier([("127.0.0.1", dns_port)], [("127.0.0.1", http_port)],
+                                     f"http://check.test:{http_port}/generate_204", timeout=1)
+    result = verifier.check()
+    # The HTTP answer is conclusive either way
+    assert result["probe"] == "http"
+    if portal:
+        assert result["state"] == connectivity.PORTAL
+        assert "redirected to http://portal.test/login" in result["detail"]
+    else:
+        assert result["state"] == connectivity.ONLINE
+
+
+def test_nothing_answering_is_offline():
+    dns_port, http_port = free_port(socket.SOCK_DGRAM), free_port(socket.SOCK_STREAM)
+    verifier = connectivity.Verifier([("127.0.0.1", dns_port)], [("127.0.0.1", http_port)],
+                                     f"http://check.test:{http_port}/generate_204", timeout=0.5)
+    result = verifier.wait(timeout=0.5)
+    assert result["state"] == connectivity.OFFLINE
+    assert result["seconds"] < 1
+
+
+def test_dns_answer_parsing():
+    ident, query = connectivity.dns_query("check.test")
+    answer = (query[:2] + b"\x81\x80" + query[4:6] + b"\x00\x01\x00\x00\x00\x00" + query[12:]
+              + b"\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x3c\x00\x04" + socket.inet_aton("10.99.0.1"))
+    assert connectivity.parse_dns_answer(answer, ident) == ["10.99.0.1"]
+
+
+# The stand-ins in their own network namespace behind a veth pair, as in the
+# header of connectivity.py. Runs in a user namespace, so it needs no root.
+NAMESPACE_SCRIPT = """
+import json, subprocess, sys, time
+import connectivity
+
+def sh(*commands):
+    for command in commands:
+        subprocess.run(command, check=True)
+
+upstream = subprocess.Popen(["unshare", "-n", "sleep", "60"])
+time.sleep(0.2)
+ns = ["nsenter", "-t", str(upstream.pid), "-n"]
+try:
+    sh(["ip", "link", "set", "lo", "up"],
+       ["ip", "link", "add", "veth0", "type", "veth", "peer", "name", "veth1"],
+       ["ip", "link", "set", "veth1", "netns", str(upstream.pid)],
+       ["ip", "addr", "add", "10.99.0.2/24", "dev", "veth0"],
+       ["ip", "link", "set", "veth0", "up"],
+       ns + ["ip", "addr", "add", "10.99.0.1/24", "dev", "veth1"],
+       ns + ["ip", "link", "set", "veth1", "up"])
+    results = {}
+    for portal, port in ((False, 8080), (True, 8081)):
+        server = subprocess.Popen(ns + [sys.executable, "connectivity.py", "--serve", "10.99.0.1", "--http-port", str(port)]
+                                  + (["--portal"] if portal else []), stdout=subprocess.DEVNULL)
+        time.sleep(0.5)
+        verifier = connectivity.Verifier([("10.99.0.1", 53)], [("10.99.0.1", port)],
+                                         f"http://check.test:{port}/generate_204", timeout=1)
+        # The upstream is only reachable through veth0
+        results["portal" if portal else "open"] = {"veth0": verifier.check("veth0"), "lo": verifier.check("lo")}
+        server.kill()
+        server.wait()
+    print(json.dumps(results))
+finally:
+    upstream.kill()
+"""
+
+
+def test_verifier_through_a_veth_pair(env):
+    # The real ip, not the benchmark's stand-in
+    path = os.pathsep.join(entry for entry in os.environ["PATH"].split(os.pathsep) if entry != env.bin_dir)
+    environ = dict(os.environ, PATH=path)
+    try:
+        subprocess.run(["unshare", "-rn", "ip", "link", "add", "veth0", "type", "veth", "peer", "name", "veth1"],
+                       check=True, capture_output=True, env=environ)
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("no user or network namespaces with veth support")
+    output = subprocess.run(["unshare", "-rn", sys.executable, "-c", NAMESPACE_SCRIPT], cwd=ROOT, env=environ,
+                            check=True, capture_output=True, text=True, timeout=30).stdout
+    results = json.loads(output)
+    assert results["open"]["veth0"]["state"] == connectivity.ONLINE
+    assert results["open"]["veth0"]["bound"] is True
+    assert results["portal"]["veth0"]["state"] == connectivity.PORTAL
+    # Bound to another interface, the probes must not find the upstream
+    assert results["open"]["lo"]["state"] == connectivity.OFFLINE
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+import executor
+from conftest import calls
+
+
+def test_timeout_overrides():
+    assert executor._parse_timeouts("mmcli=5 nmcli=20.5") == {"mmcli": 5.0, "nmcli": 20.5}
+
+
+def test_malformed_timeout_overrides_are_skipped(capsys):
+    assert executor._parse_timeouts("mmcli=5 nmcli ip=fast =3 socat=0 lsusb=nan") == {"mmcli": 5.0}
+    warnings = capsys.readouterr().err.splitlines()
+    assert len(warnings) == 5
+    assert "ignoring 'ip=fast'" in warnings[1]
+
+
+def alive(pid):
+    # A zombie waiting for its parent counts as gone
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except OSError:
+        return False
+
+
+def test_deadline_kills_the_whole_process_group(tmp_path):
+    pids = tmp_path / "pids"
+    start = time.monotonic()
+    with pytest.raises(executor.CommandTimeout):
+        executor.check_command(f"echo $$ > {pids}; sleep 30 & echo $! >> {pids}; sleep 30", shell=True, timeout=0.5)
+    assert time.monotonic() - start < 5
+    shell, background = (int(pid) for pid in pids.read_text().split())
+    deadline = time.monotonic() + 2
+    while (alive(shell) or alive(background)) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not alive(shell)
+    assert not alive(background)
+
+
+def test_transient_failure_is_retried_with_backoff(env, monkeypatch):
+    delays = []
+    monkeypatch.setattr(executor, "backoff", lambda attempt: delays.append(attempt) or 0.01)
+    # The stand-in's "couldn't find modem" until the module is powered
+    with pytest.raises(executor.CommandFailed) as failure:
+        executor.check_command(["mmcli", "-m", "0"])
+    assert failure.value.transient
+    assert delays[:executor.RETRIES] == [1, 2]
+    assert sum(call.startswith("mmcli") for call in calls(env)) == executor.RETRIES + 1
+
+
+def test_backoff_does_not_run_past_the_deadline(env, monkeypatch):
+    monkeypatch.setattr(executor, "backoff", lambda attempt: 10)
+    start = time.monotonic()
+    with pytest.raises(executor.CommandFailed):
+        executor.check_command(["mmcli", "-m", "0"], timeout=2)
+    assert time.monotonic() - start < 1
+    assert sum(call.startswith("mmcli") for call in calls(env)) == 1
+
+
+def test_permanent_failure_is_not_retried(env):
+    with pytest.raises(executor.CommandFailed) as failure:
+        executor.check_command(["nmcli", "connection", "up", "4gnet"])
+    assert not failure.value.transient
+    assert failure.value.returncode == 4
+    assert sum(call.startswith("nmcli") for call in calls(env)) == 1
+
+
+def test_missing_tool_is_not_found(env):
+    with pytest.raises(executor.CommandNotFound):
+        executor.check_command(["uconsole-no-such-tool"])
+    assert executor.run_command(["uconsole-no-such-tool"], quiet=True) is None
+
+
+def test_run_many_runs_concurrently():
+    start = time.monotonic()
+    assert executor.run_many(["sleep 0.5; echo 1", "sleep 0.5; echo 2", ["sleep", "0.5"], "sleep 0.5"]) == ["1", "2", "", ""]
+    assert time.monotonic() - start < 1.5
@@ -0,0 +1,93 @@
+import failover
+import handover
+
+
+class Links:
+    # Scripted uplinks: the interface of each kind, its next probe results and the default route
+    def __init__(self):
+        self.interfaces = {"wifi": "wlan0", "mobile": "wwan0"}
+        self.rtts = {"wlan0": 0.05, "wwan0": 0.08}
+        self.default = "wlan0"
+        self.switches = []
+
+    def install(self, monkeypatch, engine):
+        monkeypatch.setattr(handover, "uplink_interface", lambda kind: self.interfaces[kind])
+        monkeypatch.setattr(handover, "connect_time", lambda interface: self.rtts[interface])
+        monkeypatch.setattr(handover, "default_interface", lambda: self.default)
+        links = self
+
+        class Handover:
+            def __init__(self, toggle, report=print, keep_old=False):
+                # The link left behind must stay up to be measured
+                assert keep_old
+
+            def run(self, kind):
+                links.switches.append(kind)
+                links.default = links.interfaces[kind]
+                return True
+
+        monkeypatch.setattr(handover, "Handover", Handover)
+
+
+def engine(monkeypatch, hold_down=60):
+    links = Links()
+    instance = failover.FailoverEngine(None, "wifi", hold_down=hold_down, report=lambda message: None)
+    links.install(monkeypatch, instance)
+    return instance, links
+
+
+def steps(instance, count):
+    return [instance.step() for _ in range(count)]
+
+
+def test_no_switch_while_the_active_uplink_is_good(monkeypatch):
+    instance, links = engine(monkeypatch)
+    assert steps(instance, 20) == [None] * 20
+    assert links.switches == []
+
+
+def test_fails_over_after_consecutive_bad_windows(monkeypatch):
+    instance, links = engine(monkeypatch)
+    steps(instance, failover.MIN_SAMPLES)
+    links.rtts["wlan0"] = None
+    results = steps(instance, failover.WINDOW)
+    assert results.count("mobile") == 1
+    # Not on the first lost probe: the window must turn bad FAIL_COUNT times in a row
+    assert results.index("mobile") >= failover.FAIL_COUNT - 1
+    assert links.switches == ["mobile"]
+
+
+def test_hold_down_and_recovery(monkeypatch):
+    instance, links = engine(monkeypatch)
+    links.rtts["wlan0"] = None
+    steps(instance, failover.WINDOW)
+    assert links.switches == ["mobile"]
+
+    # WiFi recovers at once, but the hold-down keeps mobile for now
+    links.rtts["wlan0"] = 0.05
+    steps(instance, failover.WINDOW)
+    assert links.switches == ["mobile"]
+
+    # Once it ends, the standby WiFi (still up, so still measured) is taken back
+    instance.hold_until = 0
+    assert instance.step() == "wifi"
+    assert links.switches == ["mobile", "wifi"]
+
+
+def test_no_failover_to_a_bad_standby(monkeypatch):
+    instance, links = engine(monkeypatch)
+    links.rtts["wlan0"] = links.rtts["wwan0"] = None
+    assert steps(instance, failover.WINDOW) == [None] * failover.WINDOW
+    assert links.switches == []
+
+
+def test_jittery_standby_is_not_good_enough_to_return_to(monkeypatch):
+    instance, links = engine(monkeypatch, hold_down=0)
+    links.rtts["wlan0"] = None
+    steps(instance, failover.WINDOW)
+    assert links.switches == ["mobile"]
+    jitter = iter([0.05, 0.45] * failover.WINDOW)
+    monkeypatch.setattr(handover, "connect_time",
+                        lambda interface: next(jitter) if interface == "wlan0" else 0.08)
+    steps(instance, failover.WINDOW)
+    assert links.switches == ["mobile"]
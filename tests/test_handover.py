@@ -0,0 +1,93 @@
+import os
+
+import connectivity
+import handover
+
+
+class Toggle:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.metrics = {}
+        self.backend = self
+
+    def enable_mobile_data(self):
+        return self.enabled
+
+    def disable_wifi(self):
+        return True
+
+    def set_route_metric(self, iface, metric):
+        self.metrics[iface] = metric
+
+
+class Verifier:
+    result = {}
+
+    def wait(self, ifname=None, timeout=None):
+        return dict(self.result)
+
+
+class Meter:
+    def start(self):
+        pass
+
+    def stop(self):
+        return 0.0
+
+
+def setup(monkeypatch, result):
+    monkeypatch.setattr(handover, "OutageMeter", Meter)
+    monkeypatch.setattr(handover, "default_interface", lambda: "wlan0")
+    monkeypatch.setattr(handover, "uplink_interface", lambda kind: "wwan0")
+    monkeypatch.setattr(handover.connectivity, "Verifier", Verifier)
+    monkeypatch.setattr(Verifier, "result", result)
+
+
+def test_unbound_check_keeps_the_old_uplink(monkeypatch):
+    # Without CAP_NET_RAW the probes went out over wlan0, so wwan0 is unchecked
+    setup(monkeypatch, {"state": connectivity.ONLINE, "detail": "", "seconds": 0.1, "bound": False})
+    toggle = Toggle()
+    assert handover.Handover(toggle, report=lambda message: None).run("mobile") is False
+    assert toggle.metrics == {}
+
+
+def test_failed_enable_ends_the_handover_at_once(monkeypatch):
+    setup(monkeypatch, {})
+    monkeypatch.setattr(handover, "uplink_interface", lambda kind: 1 / 0)
+    assert handover.Handover(Toggle(enabled=False), report=lambda message: None).run("mobile") is False
+
+
+def gui_app(env):
+    # The link operations of the simple GUI, over the stand-ins, without a window
+    import executor
+    import gui_network_toggle
+    from network_backend import NetworkBackend
+
+    app = gui_network_toggle.NetworkToggleApp.__new__(gui_network_toggle.NetworkToggleApp)
+    app.apn = "internet"
+    app.backend = NetworkBackend(executor.run_command)
+    app.backend.client = None
+    return app
+
+
+def test_gui_handover_to_mobile(env, monkeypatch):
+    setup(monkeypatch, {"state": connectivity.ONLINE, "detail": "", "seconds": 0.1, "bound": True})
+    app = gui_app(env)
+    metrics = {}
+    monkeypatch.setattr(app.backend, "set_route_metric", lambda iface, metric: metrics.update({iface: metric}))
+    monkeypatch.setattr(handover, "default_interface", lambda: "wwan0" if metrics else "wlan0")
+    monkeypatch.setattr(handover.net_status, "interface_kind", lambda name: "wifi" if name == "wlan0" else "mobile")
+    with open(os.path.join(env.state_dir, "modem"), "w"):
+        pass
+    assert handover.Handover(app, report=lambda message: None, drain=0).run("mobile") is True
+    assert metrics == {"wwan0": handover.PREFERRED_METRIC}
+    # The old uplink was released through the GUI too
+    assert app.backend.wifi_enabled() is False
+
+
+def test_gui_handover_without_modem_fails(env, monkeypatch):
+    setup(monkeypatch, {})
+    app = gui_app(env)
+    assert app.enable_mobile_data() is False
+    assert handover.Handover(app, report=lambda message: None).run("mobile") is False
+    assert app.backend.wifi_enabled() is True
@@ -0,0 +1,89 @@
+import os
+import threading
+
+import executor
+import modem_ready
+
+
+def power_on_after(env, seconds):
+    # The stand-in module comes up on its own a little later, as a real one does
+    def power_on():
+        with open(os.path.join(env.state_dir, "modem"), "w"):
+            pass
+    timer = threading.Timer(seconds, power_on)
+    timer.start()
+    return timer
+
+
+def readiness(reports):
+    return modem_ready.ModemReadiness(lambda command, shell=False: executor.run_command(command, shell),
+                                      report=reports.append)
+
+
+def test_wait_until_returns_as_soon_as_the_condition_holds():
+    answers = iter([None, None, "ready"])
+    result, elapsed = modem_ready.wait_until(lambda: next(answers), timeout=5, interval=0.01)
+    assert result == "ready"
+    assert elapsed < 1
+
+
+def test_wait_until_gives_up_at_the_deadline():
+    result, elapsed = modem_ready.wait_until(lambda: None, timeout=0.2, interval=0.05)
+    assert result is None
+    assert 0.2 <= elapsed < 1
+
+
+def test_at_port_wait_ends_when_the_modem_answers(env):
+    reports = []
+    wait = readiness(reports)
+    timer = power_on_after(env, 0.5)
+    try:
+        assert wait.wait_for_at(timeout=10)
+    finally:
+        timer.cancel()
+    # Polled once a second, so well before the deadline
+    assert wait.timings["AT port"] < 3
+    assert reports[-1].startswith("AT port ready after")
+
+
+def test_at_port_wait_times_out_without_a_modem(env):
+    reports = []
+    wait = readiness(reports)
+    assert not wait.wait_for_at(timeout=1)
+    assert reports[-1].startswith("Timed out waiting for AT port")
+
+
+def test_modemmanager_wait_sees_the_exported_modem(env):
+    reports = []
+    wait = readiness(reports)
+    assert not wait.modem_exported()
+    timer = power_on_after(env, 0.5)
+    try:
+        assert wait.wait_for_modemmanager(timeout=10)
+    finally:
+        timer.cancel()
+    assert wait.timings["ModemManager modem"] < 3
+    assert "ModemManager modem" in wait.summary()
+
+
+def test_time_to_connected_follows_the_modem(env, usb_modem, cli, monkeypatch):
+    # The power-on command returns at once and the module comes up later on its own;
+    # the bring-up waits for it, not for a fixed time
+    import time
+
+    import probe_cache
+
+    elapsed = {}
+    for delay in (0.5, 2.5):
+        env.reset()
+        cli.probe_cache = probe_cache.ProbeCache()
+        timers = []
+        monkeypatch.setattr(probe_cache.ProbeCache, "run_model_command",
+                            lambda self, action, report=print: timers.append(power_on_after(env, delay)) or True)
+        start = time.monotonic()
+        assert cli.enable_mobile_data() is True
+        elapsed[delay] = time.monotonic() - start
+        # The AT port is polled every second or two
+        assert delay <= elapsed[delay] < delay + 3
+    # Two seconds more until the module is ready, about two seconds more until connected
+    assert 1 < elapsed[2.5] - elapsed[0.5] < 3.5
@@ -0,0 +1,250 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import multipath
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 ** 2
+
+
+def fake_ip(commands):
+    # Records ip commands instead of running them; there is never a rule left to delete
+    return lambda *args: commands.append(args) or args[:2] != ("rule", "del")
+
+
+def engine(monkeypatch, tmp_path, **options):
+    # Stand-in interfaces with addresses; ip commands are recorded, not run
+    monkeypatch.setattr(multipath, "STATE_PATH", str(tmp_path / "multipath.json"))
+    instance = multipath.MultipathEngine(None, interfaces={"wifi": "wlan0", "mobile": "wwan0"},
+                                         report=lambda message: None, **options)
+    instance.commands = []
+    monkeypatch.setattr(instance, "ip", fake_ip(instance.commands))
+    for address, link in zip(("192.168.1.20", "10.64.0.2"), instance.links.values()):
+        link.address = address
+    return instance
+
+
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(multipath.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_parse_policy():
+    assert multipath.parse_policy("uid:1000=mobile") == ("uid", "1000", "mobile")
+    assert multipath.parse_policy("to:10.8.0.0/16=wifi") == ("to", "10.8.0.0/16", "wifi")
+    for text in ("uid:1000", "port:22=ethernet", "host:x=wifi", "port:=wifi"):
+        with pytest.raises(ValueError):
+            multipath.parse_policy(text)
+
+
+def test_rule_selectors():
+    assert multipath.rule_selectors("uid", "1000") == [["uidrange", "1000-1000"]]
+    assert multipath.rule_selectors("port", "22") == [["ipproto", "tcp", "dport", "22"],
+                                                      ["ipproto", "udp", "dport", "22"]]
+    assert multipath.rule_selectors("to", "10.8.0.0/16") == [["to", "10.8.0.0/16"]]
+
+
+def test_describe():
+    state = {"cap": 100 * MB, "links": {
+        "wifi": {"bytes": 300 * MB, "weight": 255, "capped": False},
+        "mobile": {"bytes": 100 * MB, "weight": 0, "capped": True},
+    }}
+    assert multipath.describe(state) == ("wifi 75% (300.0 MB, weight 255), mobile 25% (100.0 MB, cap reached), "
+                                         "4G cap 100.0 MB")
+    assert multipath.describe({"links": {"wifi": {"bytes": 0, "weight": 0, "capped": False}}}) == "wifi - (0 B, down)"
+
+
+def test_weights_follow_the_measured_rates(monkeypatch, tmp_path):
+    instance = engine(monkeypatch, tmp_path)
+    now = clock(monkeypatch)
+    instance.sample({"wlan0": (0, 0), "wwan0": (0, 0)})
+    # Until there is traffic both links get the same weight
+    assert [link.weight for link in instance.links.values()] == [255, 255]
+    now[0] += 10
+    instance.sample({"wlan0": (10 * MB, 0), "wwan0": (2 * MB, 0)})
+    wifi, mobile = instance.links.values()
+    assert (wifi.bytes, mobile.bytes) == (10 * MB, 2 * MB)
+    assert (wifi.weight, mobile.weight) == (255, 51)
+    # A rate that went down decays instead of dropping at once
+    now[0] += 10
+    instance.sample({"wlan0": (20 * MB, 0), "wwan0": (2 * MB, 0)})
+    assert mobile.rate == pytest.approx(0.2 * MB * multipath.DECAY ** 10)
+    assert wifi.rate == pytest.approx(MB)
+
+
+def test_slow_link_keeps_the_minimum_weight(monkeypatch, tmp_path):
+    instance = engine(monkeypatch, tmp_path)
+    now = clock(monkeypatch)
+    instance.sample({"wlan0": (0, 0), "wwan0": (0, 0)})
+    now[0] += 10
+    instance.sample({"wlan0": (50 * MB, 0), "wwan0": (1024, 0)})
+    assert instance.links["mobile"].weight == multipath.MIN_WEIGHT
+
+
+def test_cap_stops_new_connections_on_4g(monkeypatch, tmp_path):
+    instance = engine(monkeypatch, tmp_path, cap=5 * MB)
+    now = clock(monkeypatch)
+    instance.sample({"wlan0": (0, 0), "wwan0": (0, 0)})
+    now[0] += 5
+    instance.sample({"wlan0": (0, 0), "wwan0": (3 * MB, 1 * MB)})
+    assert instance.links["mobile"].usable()
+    now[0] += 5
+    instance.sample({"wlan0": (0, 0), "wwan0": (4 * MB, 2 * MB)})
+    assert not instance.links["mobile"].usable()
+    assert instance.state()["links"]["mobile"]["weight"] == 0
+    instance.apply()
+    assert ("route", "replace", "default", "dev", "wlan0", "table", str(multipath.MULTIPATH_TABLE)) in instance.commands
+
+
+def test_apply_only_changes_the_route_beyond_the_hysteresis(monkeypatch, tmp_path):
+    instance = engine(monkeypatch, tmp_path, policies=["port:22=mobile"])
+    assert instance.apply() is True
+    rules = [command for command in instance.commands if command[:2] == ("rule", "add")]
+    assert ("rule", "add", "priority", str(multipath.PRIORITY_POLICY), "ipproto", "tcp", "dport", "22",
+            "lookup", str(multipath.LINK_TABLES["mobile"])) in rules
+    assert ("route", "replace", "default", "table", str(multipath.MULTIPATH_TABLE),
+            "nexthop", "dev", "wlan0", "weight", "255", "nexthop", "dev", "wwan0", "weight", "255") in instance.commands
+    # Nothing changed
+    instance.commands.clear()
+    assert instance.apply() is False
+    # A small weight change leaves the route alone
+    instance.links["mobile"].weight = 230
+    assert instance.apply() is False
+    assert instance.commands == []
+    # A large one replaces only the multipath route
+    instance.links["mobile"].weight = 150
+    assert instance.apply() is True
+    assert [command[:2] for command in instance.commands] == [("route", "replace")]
+    # A changed address reinstalls the link rules as well
+    instance.commands.clear()
+    instance.links["mobile"].address = "10.64.0.6"
+    assert instance.apply() is True
+    assert ("rule", "add", "priority", str(multipath.PRIORITY_SOURCE), "from", "10.64.0.6",
+            "lookup", str(multipath.LINK_TABLES["mobile"])) in instance.commands
+
+
+def test_new_interface_is_not_diffed_against_the_old_one(monkeypatch, tmp_path):
+    monkeypatch.setattr(multipath, "STATE_PATH", str(tmp_path / "multipath.json"))
+    instance = multipath.MultipathEngine(None, report=lambda message: None)
+    monkeypatch.setattr(instance, "ip", fake_ip([]))
+    uplinks = {"wifi": "wlan0", "mobile": "wwan0"}
+    interfaces = {"wlan0": {"index": 3}, "wwan0": {"index": 4}, "usb0": {"index": 5}}
+    addresses = {index: {"ipv4": [f"10.0.0.{index}"], "ipv6": []} for index in (3, 4, 5)}
+    counters = {"wlan0": (0, 0), "wwan0": (1 * MB, 0), "usb0": (900 * MB, 0)}
+    monkeypatch.setattr(multipath, "uplink_interface", lambda kind: uplinks[kind])
+    monkeypatch.setattr(multipath.net_status, "read_default_routes", lambda: [])
+    monkeypatch.setattr(multipath.net_status, "read_interfaces", lambda: interfaces)
+    monkeypatch.setattr(multipath.net_status, "read_addresses_or_empty", lambda: addresses)
+    monkeypatch.setattr(multipath.usage_meter, "read_counters", lambda: dict(counters))
+    now = clock(monkeypatch)
+    instance.step()
+    now[0] += 5
+    # The module re-enumerated in another USB mode; usb0 already counted 900 MB elsewhere
+    uplinks["mobile"] = "usb0"
+    instance.step()
+    now[0] += 5
+    counters["usb0"] = (901 * MB, 0)
+    instance.step()
+    assert instance.links["mobile"].interface == "usb0"
+    assert instance.links["mobile"].bytes == 1 * MB
+
+
+def test_setup_waits_until_every_link_has_an_address(monkeypatch, tmp_path):
+    monkeypatch.setattr(multipath, "STATE_PATH", str(tmp_path / "multipath.json"))
+    instance = multipath.MultipathEngine(None, interfaces={"wifi": "wlan0", "mobile": "wwan0"},
+                                         report=lambda message: None)
+    monkeypatch.setattr(instance, "ip", fake_ip([]))
+    interfaces = {"wlan0": {"index": 3}, "wwan0": {"index": 4}}
+    addresses = {3: {"ipv4": ["192.168.1.20"], "ipv6": []}}
+    reads = []
+
+    def read_addresses():
+        # The mobile link gets its address on the third look
+        reads.append(1)
+        if len(reads) == 3:
+            addresses[4] = {"ipv4": ["10.64.0.2"], "ipv6": []}
+        return addresses
+
+    monkeypatch.setattr(multipath.net_status, "read_default_routes", lambda: [])
+    monkeypatch.setattr(multipath.net_status, "read_interfaces", lambda: interfaces)
+    monkeypatch.setattr(multipath.net_status, "read_addresses_or_empty", read_addresses)
+    monkeypatch.setattr(multipath.usage_meter, "read_counters", lambda: {})
+    monkeypatch.setattr(multipath.executor, "run_command", lambda *args, **kwargs: "0")
+    monkeypatch.setattr("modem_ready.time.sleep", lambda seconds: None)
+    assert instance.setup() is True
+    assert len(reads) == 3
+    assert instance.links["mobile"].address == "10.64.0.2"
+
+
+# Two uplinks on veth pairs in a network namespace, used as they are (see the
+# header of multipath.py). Runs in a user namespace, so it needs no root.
+NAMESPACE_SCRIPT = """
+import json, subprocess
+import multipath
+
+def sh(*commands):
+    for command in commands:
+        subprocess.run(command, check=True)
+
+def show(*args):
+    return subprocess.run(["ip", *args], check=True, capture_output=True, text=True).stdout
+
+# /sys/class/net of this namespace
+sh(["mount", "-t", "sysfs", "sysfs", "/sys"],
+   ["ip", "link", "add", "vw0", "type", "veth", "peer", "name", "vw1"],
+   ["ip", "link", "add", "vm0", "type", "veth", "peer", "name", "vm1"])
+for name in ("lo", "vw0", "vw1", "vm0", "vm1"):
+    sh(["ip", "link", "set", name, "up"])
+sh(["ip", "addr", "add", "10.98.0.2/24", "dev", "vw0"],
+   ["ip", "addr", "add", "10.97.0.2/24", "dev", "vm0"],
+   ["ip", "route", "add", "default", "via", "10.98.0.1", "dev", "vw0", "metric", "600"],
+   ["ip", "route", "add", "default", "via", "10.97.0.1", "dev", "vm0", "metric", "700"])
+engine = multipath.MultipathEngine(None, policies=["port:22=mobile"], interfaces={"wifi": "vw0", "mobile": "vm0"},
+                                   report=lambda message: None)
+results = {
+    "setup": engine.setup(),
+    "route": show("route", "show", "table", str(multipath.MULTIPATH_TABLE)),
+    "ssh": show("route", "get", "192.0.2.1", "ipproto", "tcp", "dport", "22"),
+    "from_wifi": show("route", "get", "192.0.2.1", "from", "10.98.0.2"),
+    "hash_policy": open("/proc/sys/net/ipv4/fib_multipath_hash_policy").read().strip(),
+}
+engine.teardown()
+results.update(rules_after=show("rule"), route_after=show("route", "show", "table", str(multipath.MULTIPATH_TABLE)),
+               hash_policy_after=open("/proc/sys/net/ipv4/fib_multipath_hash_policy").read().strip())
+print(json.dumps(results))
+"""
+
+
+def test_multipath_over_veth_pairs(env, tmp_path):
+    # The real ip and sysctl, not the benchmark's stand-ins; sudo only runs the command
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "sudo").write_text('#!/bin/sh\nexec "$@"\n')
+    (bin_dir / "sudo").chmod(0o755)
+    path = os.pathsep.join([str(bin_dir)] + [entry for entry in os.environ["PATH"].split(os.pathsep)
+                                             if entry != env.bin_dir])
+    environ = dict(os.environ, PATH=path)
+    try:
+        subprocess.run(["unshare", "-rnm", "sh", "-c", "mount -t sysfs sysfs /sys && "
+                        "ip link add veth0 type veth peer name veth1"], check=True, capture_output=True, env=environ)
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("no user or network namespaces with veth support")
+    output = subprocess.run(["unshare", "-rnm", sys.executable, "-c", NAMESPACE_SCRIPT], cwd=ROOT, env=environ,
+                            check=True, capture_output=True, text=True, timeout=30).stdout
+    results = json.loads(output)
+    assert results["setup"] is True
+    assert "nexthop via 10.98.0.1 dev vw0 weight" in results["route"]
+    assert "nexthop via 10.97.0.1 dev vm0 weight" in results["route"]
+    assert results["hash_policy"] == "1"
+    # Pinned traffic and replies from a link's address take that link
+    assert "dev vm0" in results["ssh"]
+    assert "dev vw0" in results["from_wifi"]
+    # Teardown removes the rules and routes again
+    assert "lookup 200" not in results["rules_after"]
+    assert results["route_after"] == ""
+    assert results["hash_policy_after"] == "0"
@@ -0,0 +1,19 @@
+import threading
+
+import pytest
+
+import net_events
+
+
+def test_stop_wakes_and_ends_the_netlink_thread():
+    monitor = net_events.NetworkEventMonitor(lambda sources: None)
+    if not monitor._start_netlink():
+        pytest.skip("no rtnetlink socket")
+    threads = list(monitor.threads)
+    # stop() joins the thread, so it only returns once the thread saw the wakeup
+    stopper = threading.Thread(target=monitor.stop, daemon=True)
+    stopper.start()
+    stopper.join(5)
+    assert not stopper.is_alive()
+    assert not any(thread.is_alive() for thread in threads)
+    assert monitor.netlink_socket is None and monitor.wakeup is None
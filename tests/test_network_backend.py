@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+import executor
+import network_backend
+
+
+def backend(client=None):
+    commands = []
+
+    def run_command(command, shell=False, on_line=None):
+        commands.append(command)
+        return executor.run_command(command, shell)
+    instance = network_backend.NetworkBackend(run_command)
+    instance.client = client
+    return instance, commands
+
+
+def power_on(env):
+    with open(os.path.join(env.state_dir, "modem"), "w"):
+        pass
+
+
+# Without D-Bus every call goes through the nmcli/mmcli stand-ins
+
+def test_fallback_wifi_radio(env):
+    instance, _ = backend()
+    assert instance.wifi_enabled() is True
+    instance.set_wifi_enabled(False)
+    assert instance.wifi_enabled() is False
+    assert instance.active_wifi_connections() == []
+
+
+def test_fallback_modem(env):
+    instance, _ = backend()
+    assert not instance.modem_detected()
+    assert instance.modem_index() is None
+    power_on(env)
+    assert instance.modem_detected()
+    assert instance.modem_index() == "0"
+    assert instance.modem_primary_port() == "ttyUSB2"
+    assert not instance.modem_connected()
+
+
+def test_fallback_connection(env):
+    instance, _ = backend()
+    power_on(env)
+    assert not instance.profile_exists("4gnet")
+    instance.add_gsm_profile("4gnet", "ttyUSB2", "internet")
+    assert instance.profile_exists("4gnet")
+    assert instance.profile_apn("4gnet") == "internet"
+    instance.connection_up("4gnet")
+    assert instance.connection_ip("4gnet") == "10.64.0.2/30"
+    assert {"name": "4gnet", "type": "gsm", "activated": True, "device": "ttyUSB2"} in instance.active_connections()
+    instance.connection_down("4gnet")
+    assert instance.connection_ip("4gnet") is None
+
+
+# Against NetworkManager mocked on a private system bus (python3-dbus and python-dbusmock)
+
+@pytest.fixture(scope="module")
+def system_bus():
+    pytest.importorskip("dbus")
+    dbusmock = pytest.importorskip("dbusmock")
+    dbusmock.DBusTestCase.start_system_bus()
+    yield dbusmock
+    dbusmock.DBusTestCase.tearDownClass()
+
+
+@pytest.fixture
+def networkmanager(system_bus):
+    server, manager = system_bus.DBusTestCase.spawn_server_template("networkmanager", {}, stdout=open(os.devnull, "w"))
+    yield manager
+    server.terminate()
+    server.wait()
+
+
+def test_dbus_wifi_radio(env, networkmanager):
+    instance, commands = backend(network_backend.connect())
+    assert instance.client is not None
+    assert instance.wifi_enabled() is True
+    instance.set_wifi_enabled(False)
+    assert instance.wifi_enabled() is False
+    assert commands == []
+
+
+def test_dbus_active_connections(env, networkmanager):
+    device = networkmanager.AddWiFiDevice("mock_WiFi", "wlan0", 100)
+    access_point = networkmanager.AddAccessPoint(device, "Mock_AP", "HomeWiFi", "AA:BB:CC:00:00:01",
+                                                 2, 5180, 54000, 70, 0)
+    connection = networkmanager.AddWiFiConnection(device, "HomeWiFi", "HomeWiFi", "")
+    networkmanager.AddActiveConnection([device], connection, access_point, "HomeWiFi", 2)
+    instance, commands = backend(network_backend.connect())
+    assert instance.profile_exists("HomeWiFi")
+    assert instance.active_wifi_connections() == ["HomeWiFi"]
+    assert commands == []
+
+
+def test_dbus_falls_back_without_networkmanager(env, system_bus):
+    # The bus is up but NetworkManager is not running on it
+    instance, commands = backend(network_backend.connect())
+    assert instance.wifi_enabled() is True
+    assert commands == [["nmcli", "radio", "wifi"]]
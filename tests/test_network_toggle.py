@@ -0,0 +1,33 @@
+class StatusText:
+    def __init__(self):
+        self.values = []
+
+    def set(self, value):
+        self.values.append(value)
+
+
+def toggle_app(env, monkeypatch):
+    # The toggle of the full GUI, over the stand-ins, without a window
+    import executor
+    import network_toggle
+    from network_backend import NetworkBackend
+
+    app = network_toggle.NetworkToggle.__new__(network_toggle.NetworkToggle)
+    app.backend = NetworkBackend(executor.run_command)
+    app.backend.client = None
+    app.status_text = StatusText()
+    app.errors = []
+    monkeypatch.setattr(network_toggle.messagebox, "showerror", lambda title, message: app.errors.append(message))
+    return app
+
+
+def test_disable_wifi_reports_the_backend_result(env, monkeypatch):
+    app = toggle_app(env, monkeypatch)
+    app.is_wifi_enabled = True
+    assert app._toggle_locally("wifi") is True
+    assert app.backend.wifi_enabled() is False
+    # The radio stays on
+    app.backend.set_wifi_enabled(True)
+    monkeypatch.setattr(app.backend, "set_wifi_enabled", lambda enabled: None)
+    assert app._toggle_locally("wifi") is False
+    assert app.errors == ["Failed to disable WiFi."]
@@ -0,0 +1,36 @@
+import argparse
+
+import pytest
+
+import bringup
+import network_toggle_cli
+import probe_cache
+
+
+def toggle(command, state):
+    return network_toggle_cli.command_toggle(argparse.Namespace(command=command, state=state, standby=None))
+
+
+def test_toggle_exit_codes(env, usb_modem):
+    assert toggle("wifi", "off") == network_toggle_cli.EXIT_OK
+    assert toggle("wifi", "on") == network_toggle_cli.EXIT_OK
+    assert toggle("mobile", "on") == network_toggle_cli.EXIT_OK
+    assert toggle("mobile", "off") == network_toggle_cli.EXIT_OK
+
+
+def test_failed_power_off_exits_with_failure(env, usb_modem, monkeypatch):
+    assert toggle("mobile", "on") == network_toggle_cli.EXIT_OK
+    monkeypatch.setattr(probe_cache.ProbeCache, "run_model_command", lambda self, action, report=print: False)
+    assert toggle("mobile", "off") == network_toggle_cli.EXIT_FAILED
+
+
+def test_wifi_without_a_known_network_exits_with_failure(env, monkeypatch):
+    monkeypatch.setattr(bringup.WifiBringUp, "run", lambda self: False)
+    assert toggle("wifi", "on") == network_toggle_cli.EXIT_FAILED
+
+
+def test_standby_is_only_accepted_for_mobile_off(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        network_toggle_cli.main(["mobile", "on", "--standby", "5"])
+    assert exit_info.value.code == 2
+    assert "--standby only applies to mobile off" in capsys.readouterr().err
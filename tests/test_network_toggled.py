@@ -0,0 +1,50 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+import network_toggle_client
+import network_toggled
+
+
+def test_stop_stops_the_failover_engine(env):
+    instance = network_toggled.NetworkToggleDaemon()
+    instance.toggle.backend.client = None
+    stopped = []
+    instance.failover = type("Engine", (), {"stop": lambda self: stopped.append(True)})()
+    instance.stop()
+    instance.status_cache.stop()
+    assert stopped == [True]
+
+
+def test_no_answer_is_a_failure_not_a_missing_daemon(env, monkeypatch):
+    # A daemon that takes the request and never answers must not make the caller run it again
+    path = os.path.join(env.root, "silent.sock")
+    monkeypatch.setattr(network_toggle_client, "SOCKET_PATH", path)
+    assert network_toggle_client.request("status") is None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen()
+        accepted = []
+        threading.Thread(target=lambda: accepted.append(server.accept()), daemon=True).start()
+        response = network_toggle_client.request("wifi", timeout=0.2, state="on")
+        assert response["ok"] is False
+        assert "no answer" in response["error"]
+        # Closing without an answer, as a daemon that stopped during the operation
+        accepted[0][0].close()
+        threading.Thread(target=lambda: server.accept()[0].close(), daemon=True).start()
+        response = network_toggle_client.request("wifi", state="on")
+        assert response == {"ok": False, "error": "the daemon stopped without answering"}
+    os.unlink(path)
+
+
+def test_clients_do_not_load_the_status_engine():
+    # The daemon path of the client and of "network_toggle_cli.py status" stays a socket round trip
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = ("import sys, network_toggle_client, network_toggle_cli; "
+              "print(' '.join(sorted(set(sys.modules) & {'net_status', 'standby', 'operations', 'at_channel', "
+              "'usage_meter', 'signal_history', 'executor', 'modem_ready', 'tracing'})))")
+    loaded = subprocess.run([sys.executable, "-c", script], cwd=root, check=True, capture_output=True,
+                            text=True).stdout.split()
+    assert loaded == []
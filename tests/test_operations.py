@@ -0,0 +1,138 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import operations
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One request in its own process: runs op for the given seconds, polling for cancellation
+REQUEST_SCRIPT = """
+import sys, time
+import operations
+
+op, seconds = sys.argv[1], float(sys.argv[2])
+
+def work():
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        operations.check_cancelled()
+        time.sleep(0.05)
+    print("ran", flush=True)
+    return True
+
+print("result", operations.run(op, work, report=lambda message: print(message, flush=True)), flush=True)
+"""
+
+
+@pytest.fixture
+def lock_path(tmp_path):
+    return str(tmp_path / "operations.lock")
+
+
+def request(lock_path, op, seconds):
+    return subprocess.Popen([sys.executable, "-c", REQUEST_SCRIPT, op, str(seconds)], cwd=ROOT, text=True,
+                            stdout=subprocess.PIPE, env=dict(os.environ, UCONSOLE_LOCK_PATH=lock_path))
+
+
+def wait_running(coordinator, op):
+    deadline = time.monotonic() + 10
+    while (coordinator.status()["running"] or {}).get("op") != op:
+        assert time.monotonic() < deadline, f"{op} did not start"
+        time.sleep(0.02)
+
+
+def test_identical_requests_coalesce_in_one_process(lock_path):
+    coordinator = operations.Coordinator(lock_path)
+    runs = []
+    results = []
+
+    def work():
+        runs.append(1)
+        time.sleep(0.3)
+        return True
+
+    threads = [threading.Thread(target=lambda: results.append(coordinator.run("mobile on", work, lambda m: None)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert runs == [1]
+    assert results == [True, True, True]
+
+
+def test_exception_reaches_every_caller_and_counts_as_failure(lock_path):
+    coordinator = operations.Coordinator(lock_path)
+    started = threading.Event()
+    errors = []
+
+    def work():
+        started.set()
+        time.sleep(0.3)
+        raise RuntimeError("modem vanished")
+
+    def call():
+        try:
+            coordinator.run("mobile on", work, lambda m: None)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    first = threading.Thread(target=call)
+    first.start()
+    started.wait()
+    second = threading.Thread(target=call)
+    second.start()
+    first.join()
+    second.join()
+    assert errors == ["modem vanished", "modem vanished"]
+    assert coordinator._state()["last"]["ok"] is False
+
+
+def test_only_true_counts_as_success(lock_path):
+    coordinator = operations.Coordinator(lock_path)
+    coordinator.run("wifi off", lambda: None, lambda m: None)
+    assert coordinator._state()["last"]["ok"] is False
+    coordinator.run("wifi off", lambda: True, lambda m: None)
+    assert coordinator._state()["last"]["ok"] is True
+
+
+def test_identical_request_from_another_process_takes_the_result(lock_path):
+    first = request(lock_path, "mobile on", 1)
+    wait_running(operations.Coordinator(lock_path), "mobile on")
+    second = request(lock_path, "mobile on", 0)
+    first_output, _ = first.communicate(timeout=10)
+    second_output, _ = second.communicate(timeout=10)
+    assert "ran" in first_output.split("\n")
+    assert "ran" not in second_output.split("\n")
+    assert "just finished in another process" in second_output
+    assert second_output.strip().endswith("result True")
+
+
+def test_other_requests_queue(lock_path):
+    first = request(lock_path, "wifi on", 0.5)
+    wait_running(operations.Coordinator(lock_path), "wifi on")
+    second = request(lock_path, "mobile on", 0)
+    first_output, _ = first.communicate(timeout=10)
+    second_output, _ = second.communicate(timeout=10)
+    assert first_output.strip().endswith("result True")
+    assert "Waiting for wifi on" in second_output
+    assert "ran" in second_output.split("\n")
+
+
+def test_opposite_request_preempts(lock_path):
+    first = request(lock_path, "mobile on", 10)
+    wait_running(operations.Coordinator(lock_path), "mobile on")
+    start = time.monotonic()
+    second = request(lock_path, "mobile off", 0)
+    first_output, _ = first.communicate(timeout=10)
+    second_output, _ = second.communicate(timeout=10)
+    assert time.monotonic() - start < 5
+    assert "mobile on cancelled: preempted by mobile off" in first_output
+    assert first_output.strip().endswith("result False")
+    assert "Cancelling mobile on" in second_output
+    assert second_output.strip().endswith("result True")
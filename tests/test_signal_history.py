@@ -0,0 +1,18 @@
+import signal_history
+
+
+def test_sampler_leaves_the_at_port_to_modemmanager(monkeypatch):
+    class Backend:
+        values = {}
+
+        def modem_signal(self, rate):
+            return self.values
+
+    monkeypatch.setattr(signal_history, "read_at", lambda: 1 / 0)
+    sampler = signal_history.SignalSampler(Backend())
+    # ModemManager has the modem but no reading yet
+    assert sampler.read() == {}
+    # No modem in ModemManager: the AT port is asked
+    Backend.values = None
+    monkeypatch.setattr(signal_history, "read_at", lambda: {"rssi": -70.0})
+    assert sampler.read() == {"rssi": -70.0}
@@ -0,0 +1,54 @@
+import subprocess
+import sys
+import types
+
+import standby
+
+
+def test_standby_minutes_reach_the_daemon(env, daemon, monkeypatch):
+    from network_toggle_cli import NetworkToggleCLI
+
+    # The daemon itself powers the module off on "mobile off"
+    monkeypatch.setattr(standby, "STANDBY_MINUTES", 0)
+    # The watcher is only recorded; a real one would outlive the test
+    watchers = []
+    monkeypatch.setattr(standby, "subprocess", types.SimpleNamespace(
+        Popen=lambda args, **kwargs: watchers.append((args, kwargs)), DEVNULL=subprocess.DEVNULL))
+    cli = NetworkToggleCLI(watch_events=False)
+    try:
+        assert cli.enable_mobile_data() is True
+        assert cli.disable_mobile_data(standby_minutes=5) is True
+        assert standby.active()
+        assert standby._state()["minutes"] == 5
+        assert [args for args, kwargs in watchers] == [[sys.executable, standby.__file__, "watch"]]
+        assert watchers[0][1]["start_new_session"] is True
+    finally:
+        standby._state(lambda state: state.update(since=None))
+        cli.status_cache.stop()
+
+
+def test_malformed_settings_fall_back_to_the_defaults(monkeypatch, capsys):
+    monkeypatch.setenv("UCONSOLE_STANDBY_MINUTES", "ten")
+    assert standby._env_number("UCONSOLE_STANDBY_MINUTES", 0.0) == 0.0
+    assert "ignoring 'ten'" in capsys.readouterr().err
+    monkeypatch.setenv("UCONSOLE_STANDBY_MINUTES", "2.5")
+    assert standby._env_number("UCONSOLE_STANDBY_MINUTES", 0.0) == 2.5
+
+
+def test_watcher_of_a_finished_standby_exits(env, monkeypatch):
+    standby._state(lambda state: state.update(since=None))
+    monkeypatch.setattr(standby.time, "sleep", lambda seconds: 1 / 0)
+    assert standby.watch() is None
+
+
+def test_radio_that_stays_on_is_not_standby(env):
+    class Backend:
+        def modem_detected(self):
+            return True
+
+        def modem_enable(self, enabled):
+            return False
+
+    standby._state(lambda state: state.update(since=None))
+    assert standby.enter(Backend(), report=lambda message: None, minutes=5) is False
+    assert not standby.active()
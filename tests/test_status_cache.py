@@ -0,0 +1,40 @@
+import threading
+
+from status_cache import StatusCache
+
+
+def test_invalidation_during_a_load_is_not_lost():
+    cache = StatusCache(use_events=False)
+    loading, release = threading.Event(), threading.Event()
+    values = iter(["before", "after"])
+
+    def load():
+        value = next(values)
+        if value == "before":
+            loading.set()
+            release.wait(5)
+        return value
+
+    cache.loaders["wifi"] = load
+    results = []
+    reader = threading.Thread(target=lambda: results.append(cache.get("wifi")))
+    reader.start()
+    assert loading.wait(5)
+    # An event arrives while the old state is being read
+    cache.invalidate("wifi")
+    release.set()
+    reader.join(5)
+    assert results == ["before"]
+    assert "wifi" in cache.stale_fields()
+    assert cache.get("wifi") == "after"
+    assert "wifi" not in cache.stale_fields()
+
+
+def test_value_is_kept_until_invalidated():
+    cache = StatusCache(use_events=False)
+    loads = []
+    cache.loaders["modem"] = lambda: loads.append(1) or len(loads)
+    assert cache.get("modem") == 1
+    assert cache.get("modem") == 1
+    cache.invalidate_for("mobile")
+    assert cache.get("modem") == 2
@@ -0,0 +1,38 @@
+import usage_meter
+
+
+def test_counter_reset_from_above_two_gib_counts_from_zero():
+    previous = 3 * 1024 ** 3
+    assert usage_meter.counter_delta(previous, 1000) == 1000
+
+
+def test_counter_increase():
+    assert usage_meter.counter_delta(2 ** 33, 2 ** 33 + 5) == 5
+
+
+def test_reset_does_not_inflate_mobile_usage(tmp_path):
+    meter = usage_meter.UsageMeter(path=str(tmp_path / "usage.json"))
+    meter.sample({"wwan0": (3 * 1024 ** 3, 3 * 1024 ** 3)})
+    meter.sample({"wwan0": (3 * 1024 ** 3 + 500, 3 * 1024 ** 3 + 100)})
+    # The interface was re-created and its counters started again
+    meter.sample({"wwan0": (2000, 1000)})
+    day = next(iter(meter.state["days"].values()))
+    assert day["wwan0"] == [2500, 1100]
+
+
+def test_traffic_during_a_gap_is_counted(tmp_path, monkeypatch):
+    meter = usage_meter.UsageMeter(path=str(tmp_path / "usage.json"))
+    now = [1_000_000_000.0]
+    monkeypatch.setattr(usage_meter.time, "time", lambda: now[0])
+    meter.sample({"wwan0": (1000, 1000)})
+    # Nobody sampled for ten minutes while 500 MB went through
+    now[0] += 600
+    meter.sample({"wwan0": (1000 + 500 * 1024 ** 2, 2000)})
+    day = next(iter(meter.state["days"].values()))
+    assert day["wwan0"] == [500 * 1024 ** 2, 1000]
+    # It did start a new session
+    assert meter.state["interfaces"]["wwan0"]["session_start"] == now[0]
+    # After a gap with a counter reset only the new session's bytes count
+    now[0] += 600
+    meter.sample({"wwan0": (300, 300)})
+    assert day["wwan0"] == [500 * 1024 ** 2, 1000]
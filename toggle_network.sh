@@ -9,11 +9,76 @@
 #   ./toggle_network.sh mobile off - Turn off mobile data
 #   ./toggle_network.sh status     - Show current status
 
-# APN settings for Digi Spain
-APN="internet.digimobil.es"
+# Directory of this script, used to find the Python helpers
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
+# APN settings; leave APN empty to use the SIM operator's (see apn_db.py)
+APN=""
 USERNAME=""
 PASSWORD=""
 
+# Readiness deadlines (seconds) for the 4G bring-up phases
+PORT_TIMEOUT=45
+AT_TIMEOUT=20
+MODEM_TIMEOUT=30
+PROFILE_TIMEOUT=10
+IP_TIMEOUT=60
+AT_PORT="${UCONSOLE_AT_PORT:-/dev/ttyUSB2}"
+PHASE_TIMINGS=""
+
+# Poll a condition until it succeeds or the deadline passes, recording how long it took
+# Usage: wait_until "phase name" TIMEOUT command [args...]
+wait_until() {
+    local name="$1"
+    local timeout="$2"
+    shift 2
+    echo "Waiting for $name (up to $timeout seconds)..."
+    local start=$(date +%s.%N)
+    local deadline=$(( $(date +%s) + timeout ))
+    local result=0
+    while ! "$@"; do
+        if [ "$(date +%s)" -ge "$deadline" ]; then
+            result=1
+            break
+        fi
+        sleep 0.5
+    done
+    local elapsed=$(awk -v s="$start" -v e="$(date +%s.%N)" 'BEGIN { printf "%.1f", e - s }')
+    PHASE_TIMINGS="$PHASE_TIMINGS $name=${elapsed}s"
+    if [ $result -eq 0 ]; then
+        echo "$name ready after ${elapsed}s"
+    else
+        echo "Timed out waiting for $name after ${elapsed}s"
+    fi
+    return $result
+}
+
+# Readiness conditions used by wait_until
+modem_ports_present() {
+    [ -e "$AT_PORT" ]
+}
+
+at_port_answers() {
+    [[ "$(echo -en "AT\r\n" | sudo timeout 2 socat - $AT_PORT,crnl 2>/dev/null)" == *"OK"* ]]
+}
+
+modem_exported() {
+    local output=$(mmcli -L 2>/dev/null)
+    [[ "$output" == *"SIMCOM_SIM7600G-H"* ]] || [[ "$output" == *"QUALCOMM"* ]]
+}
+
+profile_exists() {
+    nmcli -t -f NAME connection show 2>/dev/null | grep -qx "4gnet"
+}
+
+connection_has_ip() {
+    [ -n "$(nmcli -g IP4.ADDRESS connection show 4gnet 2>/dev/null)" ]
+}
+
+usb0_has_ip() {
+    ip -4 -o addr show dev usb0 2>/dev/null | grep -q " inet "
+}
+
 # Function to check status
 check_status() {
     echo "Checking network status..."
@@ -59,7 +124,12 @@ enable_wifi() {
     echo "Enabling WiFi..."
     nmcli radio wifi on
     echo "Attempting to connect to known WiFi networks..."
-    nmcli device wifi connect
+    # Cached access point first (see wifi_reconnect.py), else NetworkManager's pick
+    if [ -f "$SCRIPT_DIR/wifi_reconnect.py" ]; then
+        python3 "$SCRIPT_DIR/wifi_reconnect.py"
+    else
+        nmcli device connect "$(nmcli -t -f DEVICE,TYPE device | grep ':wifi$' | head -n1 | cut -d: -f1)"
+    fi
     echo "WiFi enabled."
 }
 
@@ -97,12 +167,15 @@ enable_mobile() {
     echo "Using uConsole $MODEL model commands"
     
     # Wait for the module to initialize
-    echo "Waiting for 4G module to initialize (20 seconds)..."
-    sleep 20
+    if ! wait_until "modem ports" $PORT_TIMEOUT modem_ports_present || ! wait_until "AT port" $AT_TIMEOUT at_port_answers; then
+        echo "4G module did not come up. Please check your hardware."
+        echo "Bring-up phases:$PHASE_TIMINGS"
+        exit 1
+    fi
     
     # Check the version of the 4G extension
     echo "Checking 4G module version..."
-    VERSION_OUTPUT=$(echo -en "AT+CUSBPIDSWITCH?\r\n" | sudo socat - /dev/ttyUSB2,crnl)
+    VERSION_OUTPUT=$(echo -en "AT+CUSBPIDSWITCH?\r\n" | sudo timeout 2 socat - $AT_PORT,crnl)
     
     if [[ "$VERSION_OUTPUT" == *"9001"* ]]; then
         # For version 9001, we need to use ModemManager
@@ -111,12 +184,11 @@ enable_mobile() {
         # Restart ModemManager to detect the modem
         echo "Restarting ModemManager..."
         sudo systemctl restart ModemManager
-        sleep 5
         
         # Check if the modem is detected
-        MODEM_OUTPUT=$(mmcli -L)
-        if [[ "$MODEM_OUTPUT" != *"SIMCOM_SIM7600G-H"* ]] && [[ "$MODEM_OUTPUT" != *"QUALCOMM"* ]]; then
+        if ! wait_until "ModemManager modem" $MODEM_TIMEOUT modem_exported; then
             echo "4G modem not detected. Please check your hardware."
+            echo "Bring-up phases:$PHASE_TIMINGS"
             exit 1
         fi
         
@@ -139,12 +211,15 @@ EOF'
             echo "No port detected, defaulting to: $PORT"
         fi
         
-        # Create 4G connection with the APN
+        # Create 4G connection with the APN of the SIM's operator
+        if [ -z "$APN" ]; then
+            eval "$(python3 "$SCRIPT_DIR/apn_db.py" --shell 2>/dev/null)"
+        fi
+        APN="${APN:-internet.digimobil.es}"
         echo "Creating 4G connection with APN: $APN..."
         
         # Check if the connection already exists
-        CONN_CHECK=$(nmcli connection show 4gnet 2>&1)
-        if [[ "$CONN_CHECK" != *"not found"* ]]; then
+        if profile_exists; then
             # Connection exists, just bring it up
             echo "Connection already exists, bringing it up..."
             sudo nmcli connection up 4gnet
@@ -157,28 +232,32 @@ EOF'
                 sudo nmcli connection add type gsm ifname "$PORT" con-name 4gnet apn "$APN"
             fi
             
-            sleep 2
+            wait_until "connection profile" $PROFILE_TIMEOUT profile_exists
             
             # Bring up the connection
             echo "Bringing up the connection..."
             sudo nmcli connection up 4gnet
         fi
+        
+        # Wait for the bearer to get an address
+        if ! wait_until "bearer IP address" $IP_TIMEOUT connection_has_ip; then
+            echo "4G connection did not get an IP address. Please check your SIM card and APN."
+            echo "Bring-up phases:$PHASE_TIMINGS"
+            exit 1
+        fi
     else
         # For other versions (e.g., 9011), just check if usb0 is available
         echo "Checking for usb0 interface..."
-        sleep 5
-        IFCONFIG_OUTPUT=$(sudo ifconfig)
-        if [[ "$IFCONFIG_OUTPUT" == *"usb0"* ]]; then
+        if wait_until "usb0 IP address" $IP_TIMEOUT usb0_has_ip; then
             echo "Mobile data connection detected on usb0"
         else
             echo "Failed to detect mobile data connection. Please check your SIM card and 4G module."
+            echo "Bring-up phases:$PHASE_TIMINGS"
             exit 1
         fi
     fi
     
-    # Wait a bit for the connection to stabilize
-    echo "Waiting for connection to stabilize..."
-    sleep 5
+    echo "Bring-up phases:$PHASE_TIMINGS"
     echo "Mobile data enabled"
 }
 
@@ -202,14 +281,56 @@ disable_mobile() {
     echo "Mobile data disabled"
 }
 
+# Hand the request to the resident daemon (network_toggled.py) when it is
+# running; only returns when the daemon is not available (client exit code 2)
+try_daemon() {
+    if [ -f "$SCRIPT_DIR/network_toggle_client.py" ]; then
+        python3 "$SCRIPT_DIR/network_toggle_client.py" "$@"
+        local result=$?
+        if [ $result -ne 2 ]; then
+            exit $result
+        fi
+    fi
+}
+
+# Hold the lock the Python tools take (see operations.py) until the script
+# exits, so a toggle never runs at the same time as another one
+take_lock() {
+    if ! command -v flock &> /dev/null; then
+        return
+    fi
+    local lock_dir="/run/lock"
+    [ -w "$lock_dir" ] || lock_dir="${TMPDIR:-/tmp}"
+    local lock_path="${UCONSOLE_LOCK_PATH:-$lock_dir/uconsole-network-toggle.lock}"
+    # Shared by root and the netdev group, as operations.py creates it: without
+    # group write when the file cannot belong to the group
+    if [ ! -e "$lock_path" ]; then
+        (umask 077 && touch "$lock_path")
+        if chgrp netdev "$lock_path" 2> /dev/null; then
+            chmod 660 "$lock_path"
+        else
+            chmod 640 "$lock_path"
+        fi
+    fi
+    exec 9< "$lock_path"
+    if ! flock -n 9; then
+        echo "Waiting for another network operation..."
+        flock 9
+    fi
+}
+
 # Main script logic
 case "$1" in
     wifi)
         case "$2" in
             on)
+                try_daemon wifi on
+                take_lock
                 enable_wifi
                 ;;
             off)
+                try_daemon wifi off
+                take_lock
                 disable_wifi
                 ;;
             *)
@@ -221,9 +342,13 @@ case "$1" in
     mobile)
         case "$2" in
             on)
+                try_daemon mobile on
+                take_lock
                 enable_mobile
                 ;;
             off)
+                try_daemon mobile off
+                take_lock
                 disable_mobile
                 ;;
             *)
@@ -232,16 +357,30 @@ case "$1" in
                 ;;
         esac
         ;;
+    handover)
+        case "$2" in
+            wifi|mobile)
+                try_daemon handover "$2"
+                python3 "$SCRIPT_DIR/handover.py" "$2"
+                ;;
+            *)
+                echo "Usage: $0 handover [wifi|mobile]"
+                exit 1
+                ;;
+        esac
+        ;;
     status)
+        try_daemon status
         check_status
         ;;
     *)
-        echo "Usage: $0 [wifi|mobile] [on|off] or $0 status"
+        echo "Usage: $0 [wifi|mobile] [on|off], $0 handover [wifi|mobile] or $0 status"
         echo "Examples:"
         echo "  $0 wifi on    - Turn on WiFi"
         echo "  $0 wifi off   - Turn off WiFi"
         echo "  $0 mobile on  - Turn on mobile data"
         echo "  $0 mobile off - Turn off mobile data"
+        echo "  $0 handover mobile - Switch to mobile data without dropping connections"
         echo "  $0 status     - Show current status"
         exit 1
         ;;
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# Lightweight tracing of network operations.
+# Operations (wifi on, mobile on, ...), bring-up phases and every external
+# command are recorded as nested spans with their duration and outcome;
+# commands also record the exit code. The trace can be written as JSON and
+# as a Prometheus textfile-collector file. Tracing is off by default: span()
+# then returns a shared no-op object, so the cost is one attribute check.
+# Usage: python3 tracing.py TRACE.json   (prints the trace as a tree)
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+METRIC_PREFIX = "uconsole_network"
+# Spans kept per trace; later ones are counted but not recorded
+MAX_SPANS = 10000
+
+
+class Span:
+    def __init__(self, tracer, name, parent, attrs, stacked=True):
+        # A stacked span becomes the parent of spans this thread opens inside it
+        self.tracer = tracer
+        self.stacked = stacked
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.outcome = "ok"
+        self.start = time.monotonic()
+        self.duration = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, **attrs):
+        self.outcome = "error"
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        if self.stacked:
+            self.tracer._push(self)
+        else:
+            self.tracer._register(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.monotonic() - self.start
+        if exc_type is not None:
+            self.fail(error=exc_type.__name__)
+        if self.stacked:
+            self.tracer._pop(self)
+        return False
+
+
+class NullSpan:
+    def set(self, **attrs):
+        pass
+
+    def fail(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.json_path = None
+        self.metrics_path = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.dropped = 0
+            self.origin = time.monotonic()
+            self.started = time.time()
+
+    def span(self, name, **attrs):
+        if not self.enabled:
+            return NULL_SPAN
+        stack = getattr(self.local, "stack", None)
+        return Span(self, name, stack[-1] if stack else None, attrs)
+
+    def detached(self, name, parent, **attrs):
+        # Span under parent that does not nest what this thread opens next;
+        # for coroutines, which share a thread
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, parent, attrs, stacked=False)
+
+    def current(self):
+        # Innermost open span of this thread, or None
+        stack = getattr(self.local, "stack", None)
+        return stack[-1] if stack else None
+
+    @contextlib.contextmanager
+    def attached(self, parent):
+        # Nest the spans this thread opens under parent, a span of another thread
+        if parent is None:
+            yield
+            return
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        self.local.stack.append(parent)
+        try:
+            yield
+        finally:
+            self.local.stack.remove(parent)
+
+    def _push(self, span):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        self.local.stack.append(span)
+        self._register(span)
+
+    def _register(self, span):
+        with self.lock:
+            span.id = len(self.spans)
+            if span.id < MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def _pop(self, span):
+        if self.local.stack and self.local.stack[-1] is span:
+            self.local.stack.pop()
+
+    def records(self):
+        with self.lock:
+            spans = list(self.spans)
+        return [{
+            "id": span.id,
+            "parent": span.parent.id if span.parent and span.parent.id < MAX_SPANS else None,
+            "name": span.name,
+            "start": round(span.start - self.origin, 4),
+            "duration": round(span.duration, 4) if span.duration is not None else None,
+            "outcome": span.outcome,
+            **span.attrs,
+        } for span in spans]
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump({"started": self.started, "dropped": self.dropped, "spans": self.records()}, f, indent=2)
+
+    def write_metrics(self, path):
+        # Prometheus text format; written atomically as the textfile collector expects
+        operations, phases, commands = {}, {}, {}
+        for record in self.records():
+            if record["duration"] is None:
+                continue
+            if record["parent"] is None and "command" not in record:
+                operations[(record["name"], record["outcome"])] = record["duration"]
+            elif "command" in record:
+                key = (record["program"], record["outcome"])
+                count, total = commands.get(key, (0, 0.0))
+                commands[key] = (count + 1, total + record["duration"])
+            else:
+                phases[record["name"]] = phases.get(record["name"], 0.0) + record["duration"]
+
+        lines = [
+            f"# HELP {METRIC_PREFIX}_operation_duration_seconds Duration of the last traced operations.",
+            f"# TYPE {METRIC_PREFIX}_operation_duration_seconds gauge",
+        ]
+        lines += [f'{METRIC_PREFIX}_operation_duration_seconds{{operation="{_label(name)}",outcome="{outcome}"}} {duration:.4f}'
+                  for (name, outcome), duration in sorted(operations.items())]
+        lines += [
+            f"# HELP {METRIC_PREFIX}_phase_duration_seconds Time spent in each phase of the last traced operations.",
+            f"# TYPE {METRIC_PREFIX}_phase_duration_seconds gauge",
+        ]
+        lines += [f'{METRIC_PREFIX}_phase_duration_seconds{{phase="{_label(name)}"}} {duration:.4f}'
+                  for name, duration in sorted(phases.items())]
+        lines += [
+            f"# HELP {METRIC_PREFIX}_commands Commands run by the last traced operations.",
+            f"# TYPE {METRIC_PREFIX}_commands gauge",
+        ]
+        lines += [f'{METRIC_PREFIX}_commands{{program="{_label(program)}",outcome="{outcome}"}} {count}'
+                  for (program, outcome), (count, _) in sorted(commands.items())]
+        lines += [
+            f"# HELP {METRIC_PREFIX}_command_duration_seconds Time spent in commands by the last traced operations.",
+            f"# TYPE {METRIC_PREFIX}_command_duration_seconds gauge",
+        ]
+        lines += [f'{METRIC_PREFIX}_command_duration_seconds{{program="{_label(program)}",outcome="{outcome}"}} {total:.4f}'
+                  for (program, outcome), (_, total) in sorted(commands.items())]
+        lines += [
+            f"# HELP {METRIC_PREFIX}_trace_timestamp_seconds When the last trace started.",
+            f"# TYPE {METRIC_PREFIX}_trace_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_trace_timestamp_seconds {self.started:.0f}",
+        ]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        # Write the configured outputs; errors only produce a warning
+        try:
+            if self.json_path:
+                self.write_json(self.json_path)
+            if self.metrics_path:
+                self.write_metrics(self.metrics_path)
+        except OSError as e:
+            print(f"Could not write trace: {e}")
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+tracer = Tracer()
+
+
+def enable(json_path=None, metrics_path=None):
+    tracer.enabled = True
+    tracer.json_path = json_path
+    tracer.metrics_path = metrics_path
+    tracer.reset()
+
+
+def span(name, **attrs):
+    return tracer.span(name, **attrs)
+
+
+_CURRENT = object()
+
+
+def program_name(command):
+    # Name of the program a command runs, skipping sudo, timeout and its duration
+    words = command.split() if isinstance(command, str) else [str(word) for word in command]
+    program = next((word for word in words if word not in ("sudo", "timeout") and not word[0].isdigit()), "")
+    return os.path.basename(program)
+
+
+def command_span(command, parent=_CURRENT):
+    # Span for an external command; program is its name without sudo/timeout.
+    # An explicit parent makes it a detached span (see Tracer.detached).
+    if not tracer.enabled:
+        return NULL_SPAN
+    text = command if isinstance(command, str) else " ".join(str(word) for word in command)
+    if parent is _CURRENT:
+        return tracer.span("command", command=text, program=program_name(command))
+    return tracer.detached("command", parent, command=text, program=program_name(command))
+
+
+def traced(name):
+    # Decorator for operations; returning False marks the span as failed
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                result = func(*args, **kwargs)
+                if result is False:
+                    current.fail()
+                return result
+        return wrapper
+    return decorate
+
+
+def print_tree(records):
+    children = {}
+    for record in records:
+        children.setdefault(record["parent"], []).append(record)
+
+    def show(parent, depth):
+        for record in children.get(parent, []):
+            label = record.get("command", record["name"])
+            extra = f" exit {record['exit_code']}" if record.get("exit_code") not in (None, 0) else ""
+            duration = f"{record['duration'] * 1000:9.1f} ms" if record["duration"] is not None else "  running"
+            print(f"{duration}  {'  ' * depth}{label} [{record['outcome']}{extra}]")
+            show(record["id"], depth + 1)
+    show(None, 0)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} TRACE.json")
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        print_tree(json.load(f)["spans"])
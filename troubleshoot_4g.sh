@@ -11,6 +11,9 @@ if [ "$EUID" -ne 0 ]; then
   exit 1
 fi
 
+# Directory of this script, used to find the Python helpers
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
 # Function to check if a command exists
 command_exists() {
   command -v "$1" >/dev/null 2>&1
@@ -26,9 +29,9 @@ if ! command_exists mmcli; then
   MISSING_TOOLS=1
 fi
 
-if ! command_exists socat; then
-  echo "  [ERROR] socat not found."
-  echo "  Please install with: sudo apt install socat"
+if ! command_exists python3; then
+  echo "  [ERROR] python3 not found."
+  echo "  Please install with: sudo apt install python3"
   MISSING_TOOLS=1
 fi
 
@@ -70,9 +73,8 @@ fi
 
 # Step 3: Wait for the module to initialize
 echo ""
-echo "Step 3: Waiting for 4G module to initialize (30 seconds)..."
-echo "  This may take longer on some systems."
-sleep 30
+echo "Step 3: Waiting for 4G module to initialize (up to 45 seconds)..."
+python3 "$SCRIPT_DIR/diagnose_4g.py" --wait-for ports --timeout 45 | sed 's/^/  /'
 
 # Step 4: Check for USB devices
 echo ""
@@ -108,34 +110,9 @@ fi
 # Step 6: Try different AT command ports
 echo ""
 echo "Step 6: Testing AT commands on different ports..."
-for i in {0..5}; do
-  if [ -e "/dev/ttyUSB$i" ]; then
-    echo "  Testing AT command on /dev/ttyUSB$i..."
-    at_output=$(echo -en "AT\r\n" | socat - /dev/ttyUSB$i,crnl 2>/dev/null)
-    if [[ "$at_output" == *"OK"* ]]; then
-      echo "  [OK] AT command successful on /dev/ttyUSB$i"
-      WORKING_PORT=$i
-      
-      # Try the version check command
-      echo "  Testing version check on /dev/ttyUSB$i..."
-      version_output=$(echo -en "AT+CUSBPIDSWITCH?\r\n" | socat - /dev/ttyUSB$i,crnl 2>/dev/null)
-      echo "  Version output: $version_output"
-      
-      if [[ "$version_output" == *"9001"* ]]; then
-        echo "  [OK] Detected version 9001 on /dev/ttyUSB$i"
-        VERSION="9001"
-      elif [[ "$version_output" == *"9011"* ]]; then
-        echo "  [OK] Detected version 9011 on /dev/ttyUSB$i"
-        VERSION="9011"
-      else
-        echo "  [INFO] Could not determine version from output."
-        VERSION="unknown"
-      fi
-    else
-      echo "  [INFO] AT command failed on /dev/ttyUSB$i"
-    fi
-  fi
-done
+# All ports are probed concurrently; the report goes to stderr and the
+# WORKING_PORT/VERSION/... variables to stdout
+eval "$(python3 "$SCRIPT_DIR/diagnose_4g.py" --ports-only --format shell 2> >(sed 's/^/  /' >&2))"
 
 if [ -z "$WORKING_PORT" ]; then
   echo "  [WARNING] Could not find a working port for AT commands."
@@ -147,8 +124,8 @@ fi
 echo ""
 echo "Step 7: Restarting ModemManager service..."
 systemctl restart ModemManager
-echo "  Waiting for ModemManager to initialize (10 seconds)..."
-sleep 10
+echo "  Waiting for ModemManager to initialize (up to 30 seconds)..."
+python3 "$SCRIPT_DIR/diagnose_4g.py" --wait-for modem --timeout 30 | sed 's/^/  /'
 
 # Step 8: Check for modems with mmcli
 echo ""
@@ -214,8 +191,15 @@ else
   PORT="ttyUSB2"  # Default fallback
 fi
 
-echo "  Creating new connection with APN: internet.digimobil.es on port: $PORT"
-nmcli connection add type gsm ifname "$PORT" con-name 4gnet apn "internet.digimobil.es"
+# APN of the SIM's operator (see apn_db.py)
+eval "$(python3 "$SCRIPT_DIR/apn_db.py" --shell 2>/dev/null)"
+APN="${APN:-internet.digimobil.es}"
+echo "  Creating new connection with APN: $APN on port: $PORT"
+if [ -n "$USERNAME" ] && [ -n "$PASSWORD" ]; then
+  nmcli connection add type gsm ifname "$PORT" con-name 4gnet apn "$APN" gsm.username "$USERNAME" gsm.password "$PASSWORD"
+else
+  nmcli connection add type gsm ifname "$PORT" con-name 4gnet apn "$APN"
+fi
 
 echo "  Bringing up the connection..."
 nmcli connection up 4gnet
@@ -223,7 +207,7 @@ nmcli connection up 4gnet
 # Step 10: Check connection status
 echo ""
 echo "Step 10: Checking connection status..."
-sleep 5
+python3 "$SCRIPT_DIR/diagnose_4g.py" --wait-for ip --timeout 30 | sed 's/^/  /'
 
 # Check if we have a ppp0 interface
 if ip link show | grep -q ppp0; then
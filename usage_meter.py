@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# Per-interface throughput and data usage meter.
+# Samples /proc/net/dev (one read for all interfaces) and keeps the recent
+# samples of every interface in a fixed-size ring buffer for live rates.
+# Byte counts are accumulated per session and per day, so they survive
+# counter resets (the modem re-enumerating). The totals are saved to a small
+# JSON file at most once a minute. One process at a time (the daemon, a GUI,
+# or a single CLI update) owns the file through a lock; the others only read
+# it. The monthly mobile total can be checked against a quota, with an alert
+# at 80% and 100%.
+# Usage: python3 usage_meter.py [--watch] [--interval SECONDS] [--quota GB]
+import argparse
+import array
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+
+import net_status
+
+USAGE_PATH = os.path.join(os.environ.get("XDG_STATE_HOME", os.path.expanduser("~/.local/state")),
+                          "uconsole-network-toggle", "usage.json")
+
+SAMPLE_INTERVAL = 1.0  # seconds between samples
+RING_SIZE = 300  # samples kept per interface for rates
+RATE_WINDOW = 5  # seconds the live rate is averaged over
+SAVE_INTERVAL = 60  # seconds between writes of the totals
+SESSION_GAP = 300  # an interface gone for longer than this starts a new session
+DAYS_KEPT = 62
+QUOTA_ALERTS = (0.8, 1.0)
+
+
+def read_counters(path="/proc/net/dev"):
+    # Returns {ifname: (rx_bytes, tx_bytes)}, without the loopback interface
+    counters = {}
+    with open(path) as f:
+        for line in f.read().splitlines()[2:]:
+            name, _, fields = line.partition(":")
+            name = name.strip()
+            if name == "lo":
+                continue
+            values = fields.split()
+            counters[name] = (int(values[0]), int(values[8]))
+    return counters
+
+
+def counter_delta(previous, current):
+    # Bytes transferred between two counter readings. The counters in
+    # /proc/net/dev are 64-bit and do not wrap in practice, so a smaller
+    # reading means the counter was reset (interface re-created); count from zero.
+    if current >= previous:
+        return current - previous
+    return current
+
+
+def format_bytes(count):
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024 or unit == "GB":
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+
+
+class CounterRing:
+    # Fixed-size ring of (time, rx total, tx total) samples
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.times = array.array("d", bytes(8 * size))
+        self.rx = array.array("d", bytes(8 * size))
+        self.tx = array.array("d", bytes(8 * size))
+        self.count = 0
+
+    def append(self, when, rx, tx):
+        index = self.count % self.size
+        self.times[index], self.rx[index], self.tx[index] = when, rx, tx
+        self.count += 1
+
+    def rate(self, window=RATE_WINDOW):
+        # (rx, tx) bytes per second over the last window seconds
+        if self.count < 2:
+            return 0.0, 0.0
+        last = (self.count - 1) % self.size
+        first = last
+        for back in range(1, min(self.count, self.size)):
+            index = (self.count - 1 - back) % self.size
+            first = index
+            if self.times[last] - self.times[index] >= window:
+                break
+        elapsed = self.times[last] - self.times[first]
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return (self.rx[last] - self.rx[first]) / elapsed, (self.tx[last] - self.tx[first]) / elapsed
+
+
+class UsageMeter:
+    def __init__(self, path=USAGE_PATH, interval=SAMPLE_INTERVAL, quota=None, on_alert=print):
+        # quota: monthly mobile data allowance in bytes
+        self.path = path
+        self.interval = interval
+        self.quota = quota
+        self.on_alert = on_alert
+        self.state = self._load()
+        self.rings = {}
+        self.kinds = {}
+        self.lock = threading.Lock()
+        self.lock_file = None
+        self.last_save = time.monotonic()
+        self.dirty = False
+        self.stopped = threading.Event()
+        self.thread = None
+
+    # Storage
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("interfaces", {})
+        state.setdefault("days", {})
+        state.setdefault("alerts", {})
+        return state
+
+    def _acquire(self):
+        # Become the writer of the usage file; False if another process is
+        if self.lock_file is not None:
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            lock_file = open(f"{self.path}.lock", "w")
+        except OSError:
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        # The previous writer may have saved since this object was created
+        self.state = self._load()
+        return True
+
+    def _release(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def save(self):
+        if not self.dirty:
+            return
+        days = sorted(self.state["days"])
+        for day in days[:-DAYS_KEPT]:
+            del self.state["days"][day]
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except OSError as e:
+            print(f"Could not save data usage: {e}")
+        self.last_save = time.monotonic()
+
+    # Sampling
+
+    def sample(self, counters=None):
+        now = time.time()
+        counters = read_counters() if counters is None else counters
+        today = time.strftime("%Y-%m-%d", time.localtime(now))
+        with self.lock:
+            day = self.state["days"].setdefault(today, {})
+            for name, (rx, tx) in counters.items():
+                entry = self.state["interfaces"].get(name)
+                if entry is None or now - entry["seen"] > SESSION_GAP:
+                    # New session. Bytes sent while nobody sampled are still counted unless
+                    # the counters went down (interface re-created), which loses the baseline;
+                    # bytes from before we first saw the interface are not counted.
+                    if entry is None or rx < entry["rx"] or tx < entry["tx"]:
+                        base_rx, base_tx = rx, tx
+                    else:
+                        base_rx, base_tx = entry["rx"], entry["tx"]
+                    entry = {"rx": base_rx, "tx": base_tx, "session_rx": 0, "session_tx": 0,
+                             "session_start": now, "seen": now}
+                    self.state["interfaces"][name] = entry
+                delta_rx = counter_delta(entry["rx"], rx)
+                delta_tx = counter_delta(entry["tx"], tx)
+                entry.update(rx=rx, tx=tx, seen=now)
+                if delta_rx or delta_tx:
+                    entry["session_rx"] += delta_rx
+                    entry["session_tx"] += delta_tx
+                    totals = day.setdefault(name, [0, 0])
+                    totals[0] += delta_rx
+                    totals[1] += delta_tx
+                self.dirty = True
+                ring = self.rings.get(name)
+                if ring is None:
+                    ring = self.rings[name] = CounterRing()
+                ring.append(now, entry["session_rx"], entry["session_tx"])
+            self._check_quota(now)
+
+    def update(self):
+        # One sample from a short-lived process; only read the file if another process owns it
+        if not self._acquire():
+            with self.lock:
+                self.state = self._load()
+            return False
+        try:
+            self.sample()
+            self.save()
+        finally:
+            self._release()
+        return True
+
+    def _check_quota(self, now):
+        if not self.quota:
+            return
+        month = time.strftime("%Y-%m", time.localtime(now))
+        used = self.mobile_total(month) / self.quota
+        fired = self.state["alerts"].setdefault(month, [])
+        for threshold in QUOTA_ALERTS:
+            if used >= threshold and threshold not in fired:
+                fired.append(threshold)
+                self.on_alert(f"Mobile data: {used:.0%} of the monthly quota used ({format_bytes(self.mobile_total(month))})")
+
+    def mobile_total(self, prefix):
+        # Bytes (rx + tx) on mobile interfaces for the days starting with prefix (a date or month)
+        total = 0
+        for day, interfaces in self.state["days"].items():
+            if day.startswith(prefix):
+                total += sum(rx + tx for name, (rx, tx) in interfaces.items() if self.kind(name) == "mobile")
+        return total
+
+    def kind(self, name):
+        if name not in self.kinds:
+            self.kinds[name] = net_status.interface_kind(name)
+        return self.kinds[name]
+
+    def summary(self):
+        now = time.time()
+        today = time.strftime("%Y-%m-%d", time.localtime(now))
+        month = today[:7]
+        with self.lock:
+            interfaces = {}
+            for name, entry in self.state["interfaces"].items():
+                if now - entry["seen"] > SESSION_GAP:
+                    continue
+                rx_rate, tx_rate = self.rings[name].rate() if name in self.rings else (0.0, 0.0)
+                day = self.state["days"].get(today, {}).get(name, [0, 0])
+                interfaces[name] = {
+                    "kind": self.kind(name),
+                    "rx_rate": round(rx_rate), "tx_rate": round(tx_rate),
+                    "session_rx": entry["session_rx"], "session_tx": entry["session_tx"],
+                    "today_rx": day[0], "today_tx": day[1],
+                }
+            return {
+                "interfaces": interfaces,
+                "mobile_today": self.mobile_total(today),
+                "mobile_month": self.mobile_total(month),
+                "quota": self.quota,
+            }
+
+    # Background sampling
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if self.lock_file is None and not self._acquire():
+                # Another process writes the file; show its totals
+                with self.lock:
+                    self.state = self._load()
+                continue
+            self.sample()
+            if time.monotonic() - self.last_save >= SAVE_INTERVAL:
+                self.save()
+
+    def start(self):
+        # May be called again after stop()
+        self.stopped.clear()
+        if self._acquire():
+            self.sample()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.lock_file is not None:
+            self.save()
+            self._release()
+
+
+def describe(summary):
+    # One line of mobile data usage for status displays
+    text = f"today {format_bytes(summary['mobile_today'])}, this month {format_bytes(summary['mobile_month'])}"
+    if summary["quota"]:
+        text += f" of {format_bytes(summary['quota'])}"
+    mobile = [info for info in summary["interfaces"].values() if info["kind"] == "mobile"]
+    if mobile:
+        rx_rate = sum(info["rx_rate"] for info in mobile)
+        tx_rate = sum(info["tx_rate"] for info in mobile)
+        text += f" (down {format_bytes(rx_rate)}/s, up {format_bytes(tx_rate)}/s)"
+    return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show per-interface throughput and mobile data usage")
+    parser.add_argument("--watch", action="store_true", help="keep sampling and print the rates")
+    parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL)
+    parser.add_argument("--quota", type=float, metavar="GB", help="monthly mobile data quota")
+    args = parser.parse_args()
+    meter = UsageMeter(interval=args.interval, quota=args.quota * 1024 ** 3 if args.quota else None)
+    if not args.watch:
+        meter.update()
+        print(json.dumps(meter.summary(), indent=2))
+        sys.exit(0)
+    meter.start()
+    try:
+        while True:
+            time.sleep(args.interval)
+            summary = meter.summary()
+            rates = ", ".join(f"{name} down {format_bytes(info['rx_rate'])}/s up {format_bytes(info['tx_rate'])}/s"
+                              for name, info in sorted(summary["interfaces"].items()))
+            print(f"{rates} | mobile {describe(summary)}")
+    except KeyboardInterrupt:
+        meter.stop()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# Fast WiFi reconnect.
+# "nmcli device wifi connect" without an SSID fails. Before this module the
+# reconnect after turning the radio on was left to NetworkManager's autoconnect,
+# which waits for a full scan first. Now every successful association records
+# the profile's access point (BSSID, channel, band) in the probe cache. The
+# next reconnect first sends a directed probe for that SSID and associates with
+# the cached BSSID as soon as it shows up. It only falls back to a scan and
+# NetworkManager's own choice of network when that fails. NetworkManager
+# cannot limit a scan to one channel, so the channel and band are reported
+# but do not narrow the scan.
+# Scan results are cached for SCAN_MAX_AGE seconds, so repeated list/connect
+# operations do not trigger a scan each. --compare measures the
+# time-to-associate of both paths, turning the radio off and on in between.
+# Usage: python3 wifi_reconnect.py [--list] [--rescan] [--compare ROUNDS]
+import argparse
+import statistics
+import sys
+import time
+
+import net_status
+import probe_cache
+from modem_ready import wait_until
+
+SCAN_MAX_AGE = 30  # seconds scan results are reused
+SCAN_TIMEOUT = 5  # seconds to wait for an access point to show up in a scan
+ASSOCIATE_TIMEOUT = 15
+CACHED_TRIES = 2  # cached networks tried before falling back to a scan
+POLL_INTERVAL = 0.25
+
+
+def channel(frequency):
+    if frequency == 2484:
+        return 14
+    if frequency < 3000:
+        return (frequency - 2407) // 5
+    if frequency < 5925:
+        return (frequency - 5000) // 5
+    return (frequency - 5950) // 5
+
+
+def band(frequency):
+    if frequency < 3000:
+        return "2.4 GHz"
+    return "5 GHz" if frequency < 5925 else "6 GHz"
+
+
+def wifi_interface():
+    return next((name for name, info in sorted(net_status.read_interfaces().items()) if info["kind"] == "wifi"), "wlan0")
+
+
+class WifiReconnect:
+    def __init__(self, backend, cache=None, report=print):
+        self.backend = backend
+        self.cache = cache or probe_cache.ProbeCache()
+        self.report = report
+        self.interface = wifi_interface()
+        self.result = {}
+
+    def associated(self):
+        # Name of the activated WiFi profile, or None
+        return next((conn["name"] for conn in self.backend.active_connections()
+                     if conn["type"] == "wifi" and conn["activated"]), None)
+
+    def scan(self, max_age=SCAN_MAX_AGE, rescan=False):
+        # Access points seen by NetworkManager, reusing results up to max_age seconds old
+        access_points = None if rescan else self.cache.wifi_scan(max_age)
+        if access_points is not None:
+            return access_points
+        access_points = self.backend.wifi_access_points(self.interface)
+        if rescan or not access_points:
+            known = {ap["bssid"] for ap in access_points}
+            self.backend.wifi_request_scan(self.interface)
+            # Results arrive when the scan completes; wait for the list to change
+            wait_until(lambda: {ap["bssid"] for ap in self.backend.wifi_access_points(self.interface)} - known,
+                       SCAN_TIMEOUT, POLL_INTERVAL)
+            access_points = self.backend.wifi_access_points(self.interface)
+        self.cache.save_wifi_scan(access_points)
+        return access_points
+
+    def _find(self, facts):
+        # The cached access point if it is visible, else another one of the same network
+        access_points = self.backend.wifi_access_points(self.interface)
+        for ap in access_points:
+            if ap["bssid"] == facts["bssid"]:
+                return ap
+        return next((ap for ap in access_points if ap["ssid"] == facts["ssid"]), None)
+
+    def _associate(self, profile, facts):
+        # Targeted association with the access point cached for profile
+        ap = self._find(facts)
+        if ap is None:
+            # Right after the radio comes on the list is empty; a directed probe fills it
+            self.backend.wifi_request_scan(self.interface, facts["ssid"])
+            ap, _ = wait_until(lambda: self._find(facts), SCAN_TIMEOUT, POLL_INTERVAL)
+            if ap is None:
+                self.report(f"{profile} ({facts['ssid']}) is not in range")
+                return False
+        if not self.backend.wifi_connect(profile, self.interface, ap["bssid"]):
+            return False
+        connected, _ = wait_until(lambda: self.associated() == profile, ASSOCIATE_TIMEOUT, POLL_INTERVAL)
+        return connected
+
+    def connect(self):
+        # Connect to a known network; returns True once a WiFi profile is activated
+        start = time.monotonic()
+        for profile, facts in list(self.cache.wifi_networks().items())[:CACHED_TRIES]:
+            if self._associate(profile, facts):
+                return self._finish("cached access point", start)
+        # Full path: scan (or reuse a recent scan) and let NetworkManager pick the best known network
+        self.scan()
+        if self.backend.wifi_autoconnect(self.interface):
+            connected, _ = wait_until(self.associated, ASSOCIATE_TIMEOUT, POLL_INTERVAL)
+            if connected:
+                return self._finish("scan", start)
+        self.result = {"method": None, "seconds": round(time.monotonic() - start, 2)}
+        self.report("Could not connect to a known WiFi network")
+        return False
+
+    def _finish(self, method, start):
+        elapsed = time.monotonic() - start
+        profile = self.associated()
+        ap = next((ap for ap in self.backend.wifi_access_points(self.interface) if ap["in_use"]), None)
+        self.result = {"method": method, "profile": profile, "seconds": round(elapsed, 2)}
+        if ap is None:
+            self.report(f"Connected to {profile} in {elapsed:.2f}s via {method}")
+            return True
+        facts = {"ssid": ap["ssid"], "bssid": ap["bssid"], "channel": channel(ap["frequency"]),
+                 "band": band(ap["frequency"])}
+        self.result.update(facts)
+        self.cache.update_wifi(profile, associate_seconds=round(elapsed, 2), **facts)
+        self.report(f"Connected to {profile} ({facts['bssid']}, channel {facts['channel']}, {facts['band']}) "
+                    f"in {elapsed:.2f}s via {method}")
+        return True
+
+
+def compare(reconnect, rounds):
+    # Time-to-associate of NetworkManager's autoconnect after "radio on" versus connect()
+    backend = reconnect.backend
+    times = {"autoconnect": [], "reconnect": []}
+    for _ in range(rounds):
+        for name in times:
+            backend.set_wifi_enabled(False)
+            wait_until(lambda: reconnect.associated() is None, ASSOCIATE_TIMEOUT, POLL_INTERVAL)
+            start = time.monotonic()
+            backend.set_wifi_enabled(True)
+            if name == "autoconnect":
+                connected, _ = wait_until(reconnect.associated, 60, POLL_INTERVAL)
+            else:
+                connected = reconnect.connect()
+            times[name].append(time.monotonic() - start if connected else None)
+    for name, values in times.items():
+        ok = [value for value in values if value is not None]
+        mean = f"{statistics.mean(ok):.2f}s mean, {min(ok):.2f}s best" if ok else "never connected"
+        print(f"{name:12} {mean} ({len(ok)}/{len(values)} connected)")
+
+
+if __name__ == "__main__":
+    from network_backend import NetworkBackend
+    from executor import run_command
+
+    parser = argparse.ArgumentParser(description="Reconnect WiFi using the cached access point")
+    parser.add_argument("--list", action="store_true", help="show visible and cached networks instead")
+    parser.add_argument("--rescan", action="store_true", help="with --list, scan even if recent results exist")
+    parser.add_argument("--compare", type=int, metavar="ROUNDS",
+                        help="compare the time-to-associate with NetworkManager's autoconnect")
+    args = parser.parse_args()
+    reconnect = WifiReconnect(NetworkBackend(run_command))
+    if args.list:
+        for ap in sorted(reconnect.scan(rescan=args.rescan), key=lambda ap: -ap["signal"]):
+            print(f"{'*' if ap['in_use'] else ' '} {ap['signal']:3}%  {ap['bssid']}  ch {channel(ap['frequency']):3} "
+                  f"{band(ap['frequency']):7}  {ap['ssid']}")
+        for profile, facts in reconnect.cache.wifi_networks().items():
+            print(f"cached: {profile} -> {facts['bssid']} ch {facts['channel']} {facts['band']} "
+                  f"({facts['associate_seconds']}s)")
+    elif args.compare:
+        compare(reconnect, args.compare)
+    else:
+        sys.exit(0 if reconnect.connect() else 1)